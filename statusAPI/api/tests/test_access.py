@@ -10,7 +10,7 @@ from django.utils import timezone
 
 from statusAPI.shared.models import *
 
-from statusAPI.shared.lib import hmac
+from statusAPI.shared.lib import hmac, notificationBus, utils
 from . import apiTestHelpers
 
 #############################################################################
@@ -116,3 +116,43 @@ class AccessTestCase(TestCase):
 
         self.assertEqual(access_id.device_id, device_id_1)
 
+
+
+    def test_delete_access_invalidates_cache(self):
+        """ Check that deleting an access ID removes it from the cache.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        # Looking up the access ID twice should hit the cache the second time.
+
+        hits = utils.access_id_cache_stats()['hits']
+
+        self.assertEqual(utils.get_access_id(global_id.global_id), access_id)
+        self.assertEqual(utils.get_access_id(global_id.global_id), access_id)
+        self.assertEqual(utils.access_id_cache_stats()['hits'], hits + 1)
+
+        response = self.client.delete("/access?global_id=" +
+                                      global_id.global_id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(utils.get_access_id(global_id.global_id), None)
+
+
+
+    def test_access_id_cache_invalidated_by_notification(self):
+        """ Check that an invalidation from another process clears the cache.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        self.assertEqual(utils.get_access_id(global_id.global_id), access_id)
+
+        # Delete the access ID behind the cache's back, as another server
+        # process would, and then publish that process's notification.
+
+        AccessID.objects.filter(id=access_id.id).delete()
+        self.assertEqual(utils.get_access_id(global_id.global_id), access_id)
+
+        notificationBus.get_bus().publish(["cache:access_id"])
+        self.assertEqual(utils.get_access_id(global_id.global_id), None)
@@ -182,3 +182,205 @@ class HistoryTestCase(TestCase):
         self.assertEqual(update_2['timestamp'], timestamp_1)
         self.assertEqual(update_2['contents'],  contents_1)
 
+
+    # -----------------------------------------------------------------------
+
+    def test_get_history_pages(self):
+        """ Test that the "more" cursor pages through the full history.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        status_type,created = StatusUpdateType.objects.get_or_create(
+                                    type="available/text",
+                                    defaults={'description' : "Description"})
+
+        # Create enough status updates for three pages.  Pairs of status
+        # updates share the same timestamp, so the cursor has to use the
+        # record ID to tell them apart.
+
+        now = timezone.now()
+
+        expected = []
+        for i in range(120):
+            status_update = StatusUpdate()
+            status_update.global_id = global_id
+            status_update.type      = status_type
+            status_update.timestamp = now - datetime.timedelta(seconds=i//2)
+            status_update.tz_offset = 0
+            status_update.contents  = str(i)
+            status_update.save()
+            expected.append(str(i))
+
+        url = "/" + global_id.global_id + "/history"
+
+        contents  = []
+        more      = None
+        num_pages = 0
+        while True:
+            headers = hmac.calc_hmac_headers(
+                                    method="GET",
+                                    url=url,
+                                    body="",
+                                    access_secret=access_id.access_secret)
+
+            params = ("?global_id=" + global_id.global_id +
+                      "&type=available/text")
+            if more != None:
+                params = params + "&more=" + more
+
+            response = self.client.get(url + params, **headers)
+            self.assertEqual(response.status_code, 200)
+
+            data = json.loads(response.content.decode("utf-8"))
+            for update in data['updates']:
+                contents.append(update['contents'])
+
+            num_pages = num_pages + 1
+            more      = data['more']
+            if more == None:
+                break
+
+        self.assertEqual(num_pages, 3)
+        self.assertCountEqual(contents, expected)
+
+        # Within each pair of status updates with the same timestamp, the
+        # most recently created one comes first.
+
+        self.assertEqual(contents[:4], ["1", "0", "3", "2"])
+
+    # -----------------------------------------------------------------------
+
+    def test_get_history_types_and_range(self):
+        """ Test retrieving several types of history within a time range.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        status_types = []
+        for type in ["available/text", "location/text", "other/text"]:
+            status_type,created = StatusUpdateType.objects.get_or_create(
+                                    type=type,
+                                    defaults={'description' : "Description"})
+            status_types.append(status_type)
+
+        # Create 60 status updates, one per minute, cycling through the three
+        # status update types.
+
+        start = timezone.now().replace(microsecond=0)
+
+        for i in range(60):
+            status_update = StatusUpdate()
+            status_update.global_id = global_id
+            status_update.type      = status_types[i % 3]
+            status_update.timestamp = start + datetime.timedelta(minutes=i)
+            status_update.tz_offset = 0
+            status_update.contents  = str(i)
+            status_update.save()
+
+        url = "/" + global_id.global_id + "/history"
+
+        params = ("?global_id=" + global_id.global_id +
+                  "&type=available/text&type=location/text" +
+                  "&from=" + utils.datetime_to_timestamp(
+                                start + datetime.timedelta(minutes=10)) +
+                  "&to=" + utils.datetime_to_timestamp(
+                                start + datetime.timedelta(minutes=40)))
+
+        headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id.access_secret)
+
+        response = self.client.get(url + params.replace("+", "%2B"),
+                                   **headers)
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.content.decode("utf-8"))
+
+        expected = [str(i) for i in reversed(range(10, 40)) if i % 3 != 2]
+
+        self.assertEqual([update['contents'] for update in data['updates']],
+                         expected)
+        self.assertEqual(data['more'], None)
+
+    # -----------------------------------------------------------------------
+
+    def test_get_simplified_history(self):
+        """ Test retrieving a simplified location/latlong history.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        status_type,created = StatusUpdateType.objects.get_or_create(
+                                type="location/latlong",
+                                defaults={'description' : "Description"})
+
+        # Create a straight track heading north, with a single detour to the
+        # east half-way along.
+
+        start = timezone.now().replace(microsecond=0)
+
+        for i in range(100):
+            if i == 50:
+                longitude = 0.01
+            else:
+                longitude = 0
+            contents = json.dumps({'latitude'  : i * 0.0001,
+                                   'longitude' : longitude,
+                                   'type'      : "presence"})
+
+            status_update = StatusUpdate()
+            status_update.global_id = global_id
+            status_update.type      = status_type
+            status_update.timestamp = start + datetime.timedelta(seconds=i)
+            status_update.tz_offset = 0
+            status_update.contents  = contents
+            status_update.save()
+
+        url = "/" + global_id.global_id + "/history"
+
+        def get_latitudes(params):
+            headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id.access_secret)
+
+            response = self.client.get(url + "?global_id=" +
+                                       global_id.global_id +
+                                       "&type=location/latlong" + params,
+                                       **headers)
+            self.assertEqual(response.status_code, 200)
+
+            data = json.loads(response.content.decode("utf-8"))
+            self.assertEqual(data['more'], None)
+
+            latitudes = []
+            for update in data['updates']:
+                contents = json.loads(update['contents'])
+                latitudes.append(round(contents['latitude'] / 0.0001))
+            return latitudes
+
+        # With a tolerance of 10 metres, only the ends of the track and the
+        # corners on either side of the detour should be kept.
+
+        self.assertEqual(get_latitudes("&simplify=10"), [99, 51, 50, 49, 0])
+
+        # Limiting the number of points should only keep the ends.
+
+        self.assertEqual(get_latitudes("&max_points=2"), [99, 0])
+
+        # Other types of status update can't be simplified.
+
+        headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id.access_secret)
+
+        response = self.client.get(url + "?global_id=" + global_id.global_id +
+                                   "&type=availability/text&simplify=10",
+                                   **headers)
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,174 @@
+""" statusAPI.api.tests.test_hmac
+
+    This module tests the HMAC signing schemes used by the Status API.
+"""
+import datetime
+import json
+
+from django.http  import HttpResponse
+from django.test  import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from statusAPI.shared.models import *
+
+from statusAPI.shared.lib import hmac, utils
+from . import apiTestHelpers
+
+#############################################################################
+
+class HMACTestCase(TestCase):
+    """ Unit tests for the HMAC authentication of API requests.
+    """
+    def test_version_1(self):
+        """ Test that a version 1 HMAC-signed request is still accepted.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        url = "/" + global_id.global_id + "/permission"
+
+        headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id.access_secret,
+                                version=1)
+
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200)
+
+
+    @override_settings(HMAC_ACCEPT_V1=False)
+    def test_version_1_disabled(self):
+        """ Test that a version 1 request is rejected once v1 is turned off.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        url = "/" + global_id.global_id + "/permission"
+
+        headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id.access_secret,
+                                version=1)
+
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 403)
+
+
+    def test_version_2_clock_skew(self):
+        """ Test that a version 2 request with an old timestamp is rejected.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        url = "/" + global_id.global_id + "/permission"
+
+        headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id.access_secret)
+
+        # Re-sign the request using a timestamp from an hour ago.
+
+        timestamp = utils.datetime_to_timestamp(
+                            timezone.now() - datetime.timedelta(hours=1))
+        parts = ["GET", url, headers['Content_MD5'], headers['Nonce'],
+                 timestamp, access_id.access_secret]
+
+        headers['Timestamp']     = timestamp
+        headers['Authorization'] = "HMAC2 " + hmac._calc_digest(parts)
+
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 403)
+
+
+    def test_hmac_authenticated(self):
+        """ Test that the hmac_authenticated decorator annotates the request.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        @hmac.hmac_authenticated
+        def view(request, global_id):
+            return HttpResponse(status=200)
+
+        url = "/" + global_id.global_id + "/status"
+
+        headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id.access_secret)
+
+        request  = RequestFactory().get(url, **headers)
+        response = view(request, global_id.global_id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(request.access_id, access_id)
+        self.assertEqual(request.global_id_rec, global_id)
+        self.assertCountEqual(request.auth_timings.keys(),
+                              ["credentials", "content_md5", "signature",
+                               "nonce"])
+
+        # Replaying the same request should be rejected.
+
+        request  = RequestFactory().get(url, **headers)
+        response = view(request, global_id.global_id)
+
+        self.assertEqual(response.status_code, 403)
+
+
+    def test_compressed_body(self):
+        """ Test that compressed request bodies are signed and decompressed.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        url = "/" + global_id.global_id + "/status"
+
+        def post(body, content_encoding):
+            headers = hmac.calc_hmac_headers(
+                                method="POST",
+                                url=url,
+                                body=body,
+                                access_secret=access_id.access_secret)
+
+            return self.client.post(url, body,
+                                    content_type="application/json",
+                                    HTTP_CONTENT_ENCODING=content_encoding,
+                                    **headers)
+
+        for content_encoding in ["gzip", "deflate"]:
+            request = {"type"      : "availability/text",
+                       "timestamp" : utils.current_utc_timestamp(),
+                       "contents"  : content_encoding}
+
+            body = utils.compress_body(json.dumps(request), content_encoding)
+
+            response = post(body, content_encoding)
+            self.assertEqual(response.status_code, 201)
+
+        contents = StatusUpdate.objects.filter(global_id=global_id) \
+                                       .order_by("id") \
+                                       .values_list("contents", flat=True)
+        self.assertEqual(list(contents), ["gzip", "deflate"])
+
+        # A body which decompresses to more than the maximum size should be
+        # rejected.
+
+        body = utils.compress_body(" " * 100000, "gzip")
+        with override_settings(MAX_DECOMPRESSED_BODY_SIZE=10000):
+            response = post(body, "gzip")
+        self.assertEqual(response.status_code, 413)
+
+        # So should a corrupted body, or an unknown content encoding.
+
+        response = post(body[:-10], "gzip")
+        self.assertEqual(response.status_code, 400)
+
+        response = post(body, "br")
+        self.assertEqual(response.status_code, 415)
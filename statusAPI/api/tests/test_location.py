@@ -2,16 +2,18 @@
 
     This module tests the /location endpoint for the Status API.
 """
+import datetime
 import json
 import random
 import uuid
 
-from django.test  import TestCase
+from django.test  import TestCase, override_settings
 from django.utils import timezone
 
 from statusAPI.shared.models import *
 
-from statusAPI.shared.lib import hmac, utils
+from statusAPI.api.views import location as location_views
+from statusAPI.shared.lib import hmac, locationQueue, utils
 from . import apiTestHelpers
 
 #############################################################################
@@ -54,3 +56,237 @@ class LocationTestCase(TestCase):
 
         self.assertEqual(response.status_code, 201)
 
+
+    # -----------------------------------------------------------------------
+
+    def test_post_location_batch(self):
+        """ Test posting a batch of locations.
+        """
+        global_id_1 = apiTestHelpers.create_unique_global_id()
+        global_id_2 = apiTestHelpers.create_unique_global_id()
+        access_id   = apiTestHelpers.create_access_id(global_id_1)
+
+        permission = Permission()
+        permission.issuing_global_id   = global_id_1
+        permission.access_type         = Permission.ACCESS_TYPE_CURRENT
+        permission.recipient_global_id = global_id_2
+        permission.status_type         = "location/*"
+        permission.save()
+
+        session_id = uuid.uuid4().hex
+
+        session = LocationSession()
+        session.global_id  = global_id_1
+        session.session_id = session_id
+        session.save()
+
+        # Post a batch of locations, which are deliberately out of order.
+
+        now = timezone.now()
+
+        locations = []
+        for minutes,latitude in [(2, 10), (0, 30), (1, 20)]:
+            timestamp = now - datetime.timedelta(minutes=minutes)
+            locations.append({'timestamp' : utils.datetime_to_timestamp(
+                                                                timestamp),
+                              'latitude'  : latitude,
+                              'longitude' : 0})
+
+        request = {'session_id' : session_id,
+                   'locations'  : locations}
+
+        url = "/location"
+
+        headers = hmac.calc_hmac_headers(
+                                method="POST",
+                                url=url,
+                                body=json.dumps(request),
+                                access_secret=access_id.access_secret)
+
+        response = self.client.post(url,
+                                    json.dumps(request),
+                                    content_type="application/json",
+                                    **headers)
+
+        self.assertEqual(response.status_code, 201)
+
+        # Every location should be in the history, but only the most recent
+        # location should have been fanned out to the recipient.
+
+        self.assertEqual(StatusUpdate.objects.filter(
+                                        global_id=global_id_1).count(), 3)
+
+        latest = StatusUpdate.objects.filter(global_id=global_id_1) \
+                                     .order_by("-timestamp").first()
+        self.assertEqual(json.loads(latest.contents)['latitude'], 30)
+
+        view = CurrentStatusUpdateView.objects.get(
+                                        recipient_global_id=global_id_2)
+        self.assertEqual(view.status_update_id, latest.id)
+
+        # A batch with an invalid location should be rejected without saving
+        # any of the locations.
+
+        request['locations'].append({'timestamp' : locations[0]['timestamp'],
+                                     'latitude'  : 100,
+                                     'longitude' : 0})
+
+        headers = hmac.calc_hmac_headers(
+                                method="POST",
+                                url=url,
+                                body=json.dumps(request),
+                                access_secret=access_id.access_secret)
+
+        response = self.client.post(url,
+                                    json.dumps(request),
+                                    content_type="application/json",
+                                    **headers)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(StatusUpdate.objects.filter(
+                                        global_id=global_id_1).count(), 3)
+
+    # -----------------------------------------------------------------------
+
+    def test_post_location_columns(self):
+        """ Test posting a batch of locations in the columnar format.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        session_id = uuid.uuid4().hex
+
+        session = LocationSession()
+        session.global_id  = global_id
+        session.session_id = session_id
+        session.save()
+
+        base_timestamp = "2016-08-01T10:00:00+10:00"
+
+        request = {'session_id'     : session_id,
+                   'base_timestamp' : base_timestamp,
+                   'time_deltas'    : [0, 1500, 2500],
+                   'latitudes_e7'   : [-338688000, -338689000, -338690000],
+                   'longitudes_e7'  : [1512093000, 1512094000, 1512095000]}
+
+        url = "/location"
+
+        def post(request):
+            headers = hmac.calc_hmac_headers(
+                                method="POST",
+                                url=url,
+                                body=json.dumps(request),
+                                access_secret=access_id.access_secret)
+
+            return self.client.post(
+                            url,
+                            json.dumps(request),
+                            content_type=location_views.COLUMNAR_CONTENT_TYPE,
+                            **headers)
+
+        response = post(request)
+        self.assertEqual(response.status_code, 201)
+
+        updates = StatusUpdate.objects.filter(global_id=global_id) \
+                                      .order_by("timestamp")
+
+        base_datetime = utils.timestamp_to_datetime(base_timestamp)
+
+        self.assertEqual([update.timestamp for update in updates],
+                         [base_datetime,
+                          base_datetime + datetime.timedelta(seconds=1.5),
+                          base_datetime + datetime.timedelta(seconds=4)])
+        self.assertEqual([update.tz_offset for update in updates],
+                         [600, 600, 600])
+
+        contents = json.loads(updates[2].contents)
+        self.assertEqual(contents['latitude'],  -33.869)
+        self.assertEqual(contents['longitude'], 151.2095)
+
+        # Columns with an out-of-range value or a mismatched length should be
+        # rejected.
+
+        request['latitudes_e7'] = [-338688000, -908689000, -338690000]
+        response = post(request)
+        self.assertEqual(response.status_code, 400)
+
+        request['latitudes_e7'] = [-338688000, -338689000]
+        response = post(request)
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(StatusUpdate.objects.filter(
+                                        global_id=global_id).count(), 3)
+
+    # -----------------------------------------------------------------------
+
+    @override_settings(LOCATION_QUEUE=True)
+    def test_post_location_queued(self):
+        """ Test posting locations via the location queue.
+        """
+        global_id_1 = apiTestHelpers.create_unique_global_id()
+        global_id_2 = apiTestHelpers.create_unique_global_id()
+        access_id   = apiTestHelpers.create_access_id(global_id_1)
+
+        permission = Permission()
+        permission.issuing_global_id   = global_id_1
+        permission.access_type         = Permission.ACCESS_TYPE_CURRENT
+        permission.recipient_global_id = global_id_2
+        permission.status_type         = "location/*"
+        permission.save()
+
+        session_id = uuid.uuid4().hex
+
+        session = LocationSession()
+        session.global_id  = global_id_1
+        session.session_id = session_id
+        session.save()
+
+        now = timezone.now()
+
+        locations = []
+        for minutes,latitude in [(1, 10), (0, 20)]:
+            timestamp = now - datetime.timedelta(minutes=minutes)
+            locations.append({'timestamp' : utils.datetime_to_timestamp(
+                                                                timestamp),
+                              'latitude'  : latitude,
+                              'longitude' : 0})
+
+        request = {'session_id' : session_id,
+                   'locations'  : locations}
+
+        url = "/location"
+
+        headers = hmac.calc_hmac_headers(
+                                method="POST",
+                                url=url,
+                                body=json.dumps(request),
+                                access_secret=access_id.access_secret)
+
+        response = self.client.post(url,
+                                    json.dumps(request),
+                                    content_type="application/json",
+                                    **headers)
+
+        # The locations should be queued rather than written out.
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(StatusUpdate.objects.filter(
+                                        global_id=global_id_1).count(), 0)
+        self.assertEqual(locationQueue.stats()['depth'], 1)
+
+        # Draining the queue should write out the locations, and fan out the
+        # most recent one.
+
+        self.assertEqual(locationQueue.drain(100), 1)
+        self.assertEqual(locationQueue.stats(), {'depth' : 0, 'lag' : 0})
+
+        updates = StatusUpdate.objects.filter(global_id=global_id_1) \
+                                      .order_by("timestamp")
+        self.assertEqual([json.loads(update.contents)['latitude']
+                          for update in updates], [10, 20])
+        self.assertEqual([update.timestamp for update in updates],
+                         [now - datetime.timedelta(minutes=1), now])
+
+        view = CurrentStatusUpdateView.objects.get(
+                                        recipient_global_id=global_id_2)
+        self.assertEqual(view.status_update_id, updates[1].id)
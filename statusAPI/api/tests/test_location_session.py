@@ -10,7 +10,7 @@ from django.utils import timezone
 
 from statusAPI.shared.models import *
 
-from statusAPI.shared.lib import hmac, utils
+from statusAPI.shared.lib import hmac, notificationBus, utils
 from . import apiTestHelpers
 
 #############################################################################
@@ -87,3 +87,79 @@ class LocationSessionTestCase(TestCase):
 
         self.assertEqual(session, None)
 
+
+
+    def test_location_session_cache(self):
+        """ Test that location sessions are reused, cached and invalidated.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        url = "/" + global_id.global_id + "/location_session"
+
+        def send(method):
+            headers = hmac.calc_hmac_headers(
+                                method=method,
+                                url=url,
+                                body="",
+                                access_secret=access_id.access_secret)
+            if method == "POST":
+                return self.client.post(url, "",
+                                        content_type="application/json",
+                                        **headers)
+            else:
+                return self.client.delete(url, **headers)
+
+        # Posting a second time should return the same session.
+
+        data = json.loads(send("POST").content.decode("utf-8"))
+        session_id = data['session_id']
+
+        data = json.loads(send("POST").content.decode("utf-8"))
+        self.assertEqual(data['session_id'], session_id)
+        self.assertEqual(LocationSession.objects.filter(
+                                            global_id=global_id).count(), 1)
+
+        # Looking up the session, or an unknown session, should only query
+        # the database the first time.
+
+        unknown_session_id = uuid.uuid4().hex
+
+        for i in range(2):
+            with self.assertNumQueries(1 if i == 0 else 0):
+                self.assertEqual(utils.get_location_session(session_id),
+                                 global_id)
+            with self.assertNumQueries(1 if i == 0 else 0):
+                self.assertEqual(
+                        utils.get_location_session(unknown_session_id), None)
+
+        # Deleting the session should remove it from the cache.
+
+        self.assertEqual(send("DELETE").status_code, 200)
+        self.assertEqual(utils.get_location_session(session_id), None)
+
+
+
+    def test_location_session_cache_invalidated_by_notification(self):
+        """ Check that an invalidation from another process clears the cache.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+
+        session = LocationSession()
+        session.session_id = uuid.uuid4().hex
+        session.global_id  = global_id
+        session.save()
+
+        self.assertEqual(utils.get_location_session(session.session_id),
+                         global_id)
+
+        # Delete the session behind the cache's back, as another server
+        # process would, and then publish that process's notification.
+
+        LocationSession.objects.filter(id=session.id).delete()
+        self.assertEqual(utils.get_location_session(session.session_id),
+                         global_id)
+
+        notificationBus.get_bus().publish(["cache:location_session"])
+        self.assertEqual(utils.get_location_session(session.session_id),
+                         None)
@@ -0,0 +1,103 @@
+""" statusAPI.api.tests.test_message
+
+    This module tests the /message endpoint for the Status API.
+"""
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from statusAPI.shared.models import *
+
+from statusAPI.api.views  import message as message_views
+from statusAPI.shared.lib import hmac, utils
+from . import apiTestHelpers
+
+#############################################################################
+
+class MessageTestCase(TestCase):
+    """ Unit tests for the "<global_id>/message" API endpoint.
+    """
+    def test_get_messages(self):
+        """ Test that retrieving messages drains the recipient's inbox.
+        """
+        global_id_1 = apiTestHelpers.create_unique_global_id()
+        global_id_2 = apiTestHelpers.create_unique_global_id()
+        access_id_1 = apiTestHelpers.create_access_id(global_id_1)
+        access_id_2 = apiTestHelpers.create_access_id(global_id_2)
+
+        # Send five messages from the first global ID to the second.
+
+        url = "/" + global_id_1.global_id + "/message"
+
+        for i in range(5):
+            request = {'recipient' : global_id_2.global_id,
+                       'message'   : {'count' : i}}
+
+            headers = hmac.calc_hmac_headers(
+                                method="POST",
+                                url=url,
+                                body=json.dumps(request),
+                                access_secret=access_id_1.access_secret)
+
+            response = self.client.post(url,
+                                        json.dumps(request),
+                                        content_type="application/json",
+                                        **headers)
+
+            self.assertEqual(response.status_code, 201)
+
+        # Retrieve the messages, a few at a time.
+
+        url = "/" + global_id_2.global_id + "/message"
+
+        def get_messages(params):
+            headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id_2.access_secret)
+
+            response = self.client.get(url + params, **headers)
+            self.assertEqual(response.status_code, 200)
+
+            return json.loads(response.content.decode("utf-8"))
+
+        messages = get_messages("?limit=3")
+        self.assertEqual(messages,
+                         [{'sender'  : global_id_1.global_id,
+                           'message' : {'count' : i}} for i in range(3)])
+
+        messages = get_messages("")
+        self.assertEqual([message['message']['count']
+                          for message in messages], [3, 4])
+
+        self.assertEqual(get_messages(""), [])
+        self.assertEqual(Message.objects.count(), 0)
+
+
+    def test_take_messages_fallback(self):
+        """ Test the chunked fallback used to drain an inbox.
+        """
+        sender    = apiTestHelpers.create_unique_global_id()
+        recipient = apiTestHelpers.create_unique_global_id()
+
+        for i in range(5):
+            message = Message()
+            message.timestamp = utils.current_utc_timestamp()
+            message.sender    = sender
+            message.recipient = recipient
+            message.message   = json.dumps(i)
+            message.save()
+
+        with mock.patch.object(message_views, "_supports_delete_returning",
+                               return_value=False):
+            rows = message_views._take_messages(recipient.id, 3)
+            self.assertEqual(rows, [(sender.id, json.dumps(i))
+                                    for i in range(3)])
+
+            rows = message_views._take_messages(recipient.id, None)
+            self.assertEqual(rows, [(sender.id, json.dumps(i))
+                                    for i in range(3, 5)])
+
+        self.assertEqual(Message.objects.count(), 0)
@@ -0,0 +1,167 @@
+""" statusAPI.api.tests.test_nonce_store
+
+    This module tests the nonce stores used to detect replayed requests.
+"""
+import datetime
+import io
+import os.path
+import shutil
+import tempfile
+import time
+import uuid
+
+from django.core.management import call_command
+from django.test  import TestCase, override_settings
+from django.utils import timezone
+
+from statusAPI.shared.models import *
+
+from statusAPI.shared.lib import bloomFilter, hmac, nonceStore
+from . import apiTestHelpers
+
+#############################################################################
+
+class NonceStoreTestCase(TestCase):
+    """ Unit tests for the various nonce stores.
+    """
+    def test_memory_store(self):
+        """ Test that the memory nonce store rejects a reused nonce.
+        """
+        store = nonceStore.MemoryNonceStore(max_entries=2)
+        nonce = uuid.uuid4().hex
+
+        self.assertTrue(store.add(nonce))
+        self.assertFalse(store.add(nonce))
+
+        # Once the store is full, new nonces are rejected rather than
+        # forgetting a nonce which could then be replayed.
+
+        self.assertTrue(store.add(uuid.uuid4().hex))
+        self.assertFalse(store.add(uuid.uuid4().hex))
+        self.assertFalse(store.add(nonce))
+
+
+
+    @override_settings(HMAC_ACCEPT_V1=False, HMAC_MAX_CLOCK_SKEW=0.05)
+    def test_memory_store_expiry(self):
+        """ Test that a full memory nonce store recovers as nonces expire.
+        """
+        store = nonceStore.MemoryNonceStore(max_entries=1)
+        nonce = uuid.uuid4().hex
+
+        self.assertTrue(store.add(nonce))
+        self.assertFalse(store.add(uuid.uuid4().hex))
+
+        time.sleep(0.15)
+
+        self.assertTrue(store.add(uuid.uuid4().hex))
+
+
+    def test_sqlite_store(self):
+        """ Test that the SQLite nonce store rejects a reused nonce.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path  = os.path.join(tmp_dir, "nonces.sqlite3")
+            nonce = uuid.uuid4().hex
+
+            self.assertTrue(nonceStore.SQLiteNonceStore(path).add(nonce))
+            self.assertFalse(nonceStore.SQLiteNonceStore(path).add(nonce))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+    def test_database_store(self):
+        """ Test that the database nonce store rejects a reused nonce.
+        """
+        store = nonceStore.DatabaseNonceStore()
+        nonce = uuid.uuid4().hex
+
+        self.assertTrue(store.add(nonce))
+        self.assertFalse(store.add(nonce))
+        self.assertEqual(NonceValue.objects.filter(nonce=nonce).count(), 1)
+
+
+    @override_settings(KEEP_NONCE_VALUES_FOR=1)
+    def test_chunked_purge(self):
+        """ Test that old nonce values are purged in chunks.
+        """
+        old_timestamp = timezone.now() - datetime.timedelta(days=2)
+        for i in range(5):
+            NonceValue.objects.create(nonce=uuid.uuid4().hex,
+                                      timestamp=old_timestamp)
+        NonceValue.objects.create(nonce=uuid.uuid4().hex,
+                                  timestamp=timezone.now())
+
+        output = io.StringIO()
+        call_command("purge_nonces", chunk_size=2, pause=0, stdout=output)
+
+        self.assertTrue(output.getvalue().startswith("Purged 5 nonce values"))
+        self.assertEqual(NonceValue.objects.count(), 1)
+
+
+    def test_nonce_filter(self):
+        """ Test that the nonce filter remembers nonces across restarts.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            window = datetime.timedelta(hours=1)
+            nonce  = uuid.uuid4().hex
+
+            nonce_filter = bloomFilter.RotatingBloomFilter(window, 4, 1000,
+                                                           0.001, tmp_dir)
+            self.assertFalse(nonce_filter.might_contain(nonce))
+            nonce_filter.add(nonce)
+            self.assertTrue(nonce_filter.might_contain(nonce))
+
+            # Opening the filter again, as a restarted process would, should
+            # still find the nonce.
+
+            nonce_filter = bloomFilter.RotatingBloomFilter(window, 4, 1000,
+                                                           0.001, tmp_dir)
+            self.assertTrue(nonce_filter.might_contain(nonce))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+    @override_settings(NONCE_FILTER=True)
+    def test_replayed_request_with_filter(self):
+        """ Test that a replayed request is rejected when using the filter.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        url = "/" + global_id.global_id + "/permission"
+
+        headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id.access_secret)
+
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 403)
+
+
+    def test_replayed_request(self):
+        """ Test that replaying an authenticated request is rejected.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        url = "/" + global_id.global_id + "/permission"
+
+        headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id.access_secret)
+
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 403)
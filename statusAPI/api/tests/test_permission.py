@@ -10,7 +10,8 @@ from django.utils import timezone
 
 from statusAPI.shared.models import *
 
-from statusAPI.shared.lib import hmac, utils
+from statusAPI.shared.lib import (hmac, notificationBus, permissionMatcher,
+                                  utils)
 from . import apiTestHelpers
 
 #############################################################################
@@ -143,3 +144,74 @@ class PermissionTestCase(TestCase):
 
         self.assertEqual(response.status_code, 200)
 
+
+    # -----------------------------------------------------------------------
+
+    def test_permission_matcher(self):
+        """ Test the compiled permission matcher and its invalidation.
+        """
+        global_id_1 = apiTestHelpers.create_unique_global_id()
+        global_id_2 = apiTestHelpers.create_unique_global_id()
+        global_id_3 = apiTestHelpers.create_unique_global_id()
+        access_id   = apiTestHelpers.create_access_id(global_id_1)
+
+        for recipient,status_type in [(global_id_2, "availability/*"),
+                                      (global_id_3, "location/latlong")]:
+            permission = Permission()
+            permission.issuing_global_id   = global_id_1
+            permission.access_type         = Permission.ACCESS_TYPE_CURRENT
+            permission.recipient_global_id = recipient
+            permission.status_type         = status_type
+            permission.save()
+
+        matcher = permissionMatcher.get_matcher(global_id_1.global_id,
+                                                Permission.ACCESS_TYPE_CURRENT)
+
+        self.assertEqual(matcher.recipients("availability/text"),
+                         set([global_id_2.id]))
+        self.assertEqual(matcher.recipients("location/latlong"),
+                         set([global_id_3.id]))
+        self.assertEqual(matcher.recipients("location/text"), set())
+        self.assertEqual(matcher.patterns("availability/text"),
+                         set(["availability/*"]))
+
+        # Adding a permission via the API should invalidate the matcher.
+
+        request = {"access_type" : "CURRENT",
+                   "global_id"   : global_id_3.global_id,
+                   "status_type" : "*"}
+
+        url = "/" + global_id_1.global_id + "/permission"
+
+        headers = hmac.calc_hmac_headers(
+                                method="POST",
+                                url=url,
+                                body=json.dumps(request),
+                                access_secret=access_id.access_secret)
+
+        response = self.client.post(url,
+                                    json.dumps(request),
+                                    content_type="application/json",
+                                    **headers)
+
+        self.assertEqual(response.status_code, 201)
+
+        matcher = permissionMatcher.get_matcher(global_id_1.global_id,
+                                                Permission.ACCESS_TYPE_CURRENT)
+
+        self.assertEqual(matcher.recipients("availability/text"),
+                         set([global_id_2.id, global_id_3.id]))
+
+        # A permission revoked by another server process should be dropped
+        # once that process's invalidation notification arrives.
+
+        Permission.objects.filter(issuing_global_id=global_id_1,
+                                  recipient_global_id=global_id_2).delete()
+
+        notificationBus.get_bus().publish(["cache:permission"])
+
+        matcher = permissionMatcher.get_matcher(global_id_1.global_id,
+                                                Permission.ACCESS_TYPE_CURRENT)
+
+        self.assertEqual(matcher.recipients("availability/text"),
+                         set([global_id_3.id]))
@@ -3,18 +3,29 @@
     This module tests the /status endpoint for the Status API.
 """
 import json
+import threading
+import time
 import uuid
+from unittest import mock
 
-from django.test  import TestCase
-from django.utils import timezone
+from django.db         import connection
+from django.test       import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils      import timezone
 
 from statusAPI.shared.models import *
 
-from statusAPI.shared.lib import hmac, utils
+from statusAPI.api.views  import status as status_views
+from statusAPI.shared.lib import cache, hmac, notificationBus, utils
 from . import apiTestHelpers
 
 #############################################################################
 
+STATUS_VIEWS_FOR_BUDGET = 50 # Number of views to retrieve in our budget test.
+GET_STATUS_QUERY_BUDGET = 8  # Maximum number of queries for GET /status.
+
+#############################################################################
+
 class StatusTestCase(TestCase):
     """ Unit tests for the "<global_id>/status" API endpoint.
     """
@@ -44,6 +55,33 @@ class StatusTestCase(TestCase):
         self.assertEqual(response.status_code, 201)
 
 
+    @override_settings(MAX_REQUEST_BODY_SIZE=16)
+    def test_post_status_too_large(self):
+        """ Test that posting a status update with a huge body is rejected.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        request = {"type"      : "availability/text",
+                   "timestamp" : utils.current_utc_timestamp(),
+                   "contents"  : "Available"}
+
+        url = "/" + global_id.global_id + "/status"
+
+        headers = hmac.calc_hmac_headers(
+                                method="POST",
+                                url=url,
+                                body=json.dumps(request),
+                                access_secret=access_id.access_secret)
+
+        response = self.client.post(url,
+                                    json.dumps(request),
+                                    content_type="application/json",
+                                    **headers)
+
+        self.assertEqual(response.status_code, 413)
+
+
     def test_post_status_yields_view(self):
         """ Test that posting a status with a permission creates a view.
         """
@@ -87,6 +125,65 @@ class StatusTestCase(TestCase):
 
         self.assertNotEqual(view, None)
 
+        # The view should hold the status update's JSON representation.
+
+        fragment = json.loads(view.json_fragment)
+
+        self.assertEqual(fragment['global_id'], global_id_1.global_id)
+        self.assertEqual(fragment['type'],      "availability/text")
+        self.assertEqual(fragment['contents'],  "Available")
+        self.assertEqual(utils.timestamp_to_datetime(fragment['timestamp']),
+                         utils.timestamp_to_datetime(request['timestamp']))
+        self.assertEqual(view.json_fragment,
+                         view.status_update.json_fragment)
+
+
+    def test_post_status_replaces_views(self):
+        """ Test that posting a second status replaces each recipient's view.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        recipients = []
+        for i in range(3):
+            recipient = apiTestHelpers.create_unique_global_id()
+            recipients.append(recipient)
+
+            permission = Permission()
+            permission.issuing_global_id   = global_id
+            permission.access_type         = Permission.ACCESS_TYPE_CURRENT
+            permission.recipient_global_id = recipient
+            permission.status_type         = "availability/*"
+            permission.save()
+
+        url = "/" + global_id.global_id + "/status"
+
+        for contents in ["Available", "Busy"]:
+            request = {"type"      : "availability/text",
+                       "timestamp" : utils.current_utc_timestamp(),
+                       "contents"  : contents}
+
+            headers = hmac.calc_hmac_headers(
+                                    method="POST",
+                                    url=url,
+                                    body=json.dumps(request),
+                                    access_secret=access_id.access_secret)
+
+            response = self.client.post(url,
+                                        json.dumps(request),
+                                        content_type="application/json",
+                                        **headers)
+
+            self.assertEqual(response.status_code, 201)
+
+        views = CurrentStatusUpdateView.objects.filter(
+                                        issuing_global_id=global_id)
+
+        self.assertCountEqual([view.recipient_global_id for view in views],
+                              recipients)
+        for view in views:
+            self.assertEqual(view.contents, "Busy")
+
 
     def test_get_status(self):
         """ Test that the GET <global_id>/status" endpoint returns the views.
@@ -149,3 +246,375 @@ class StatusTestCase(TestCase):
         self.assertEqual(utils.timestamp_to_datetime(update['timestamp']), now)
         self.assertEqual(update['contents'], contents)
 
+
+
+    @override_settings(FANOUT_ON_READ_THRESHOLD=2)
+    def test_fanout_on_read(self):
+        """ Test that a large audience finds the status update at read time.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        recipients = []
+        for status_type in ["availability/*", "availability/*", "location/*"]:
+            recipient = apiTestHelpers.create_unique_global_id()
+            recipients.append(recipient)
+
+            permission = Permission()
+            permission.issuing_global_id   = global_id
+            permission.access_type         = Permission.ACCESS_TYPE_CURRENT
+            permission.recipient_global_id = recipient
+            permission.status_type         = status_type
+            permission.save()
+
+        url = "/" + global_id.global_id + "/status"
+
+        request = {"type"      : "availability/text",
+                   "timestamp" : utils.current_utc_timestamp(),
+                   "contents"  : "Available"}
+
+        headers = hmac.calc_hmac_headers(
+                                method="POST",
+                                url=url,
+                                body=json.dumps(request),
+                                access_secret=access_id.access_secret)
+
+        response = self.client.post(url,
+                                    json.dumps(request),
+                                    content_type="application/json",
+                                    **headers)
+
+        self.assertEqual(response.status_code, 201)
+
+        # No views should have been written, as the audience reached our
+        # threshold.
+
+        self.assertFalse(CurrentStatusUpdateView.objects.filter(
+                                    issuing_global_id=global_id).exists())
+
+        latest = LatestStatusUpdate.objects.get(global_id=global_id)
+        self.assertFalse(latest.fanned_out)
+
+        # Each recipient should only see the status update if their permission
+        # covers it.
+
+        for recipient,num_updates in zip(recipients, [1, 1, 0]):
+            recipient_access_id = apiTestHelpers.create_access_id(recipient)
+
+            url = "/" + recipient.global_id + "/status"
+
+            headers = hmac.calc_hmac_headers(
+                            method="GET",
+                            url=url,
+                            body="",
+                            access_secret=recipient_access_id.access_secret)
+
+            response = self.client.get(url, **headers)
+            self.assertEqual(response.status_code, 200)
+
+            data = json.loads(response.content.decode("utf-8"))
+            self.assertEqual(len(data['updates']), num_updates)
+            if num_updates > 0:
+                self.assertEqual(data['updates'][0]['global_id'],
+                                 global_id.global_id)
+                self.assertEqual(data['updates'][0]['contents'], "Available")
+
+
+    def test_get_status_query_budget(self):
+        """ Test that GET <global_id>/status doesn't query once per update.
+        """
+        recipient = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(recipient)
+
+        status_type,created = StatusUpdateType.objects.get_or_create(
+                                    type="available/text",
+                                    defaults={'description' : "Description"})
+
+        now = timezone.now()
+
+        for i in range(STATUS_VIEWS_FOR_BUDGET):
+            issuer = apiTestHelpers.create_unique_global_id()
+
+            status_update = StatusUpdate()
+            status_update.global_id = issuer
+            status_update.type      = status_type
+            status_update.timestamp = now
+            status_update.tz_offset = 0
+            status_update.contents  = apiTestHelpers.random_string()
+            status_update.save()
+
+            view = CurrentStatusUpdateView()
+            view.issuing_global_id   = issuer
+            view.recipient_global_id = recipient
+            view.status_update       = status_update
+            view.type                = status_type
+            view.timestamp           = now
+            view.tz_offset           = 0
+            view.contents            = status_update.contents
+            view.save()
+
+        url = "/" + recipient.global_id + "/status"
+
+        headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id.access_secret)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **headers)
+
+        self.assertEqual(response.status_code, 200)
+
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(len(data['updates']), STATUS_VIEWS_FOR_BUDGET)
+
+        self.assertLessEqual(len(queries), GET_STATUS_QUERY_BUDGET)
+
+
+    def test_get_status_not_modified(self):
+        """ Test that an unchanged set of status updates yields a 304 response.
+        """
+        # Cached versions can be left over from earlier tests whose database
+        # records have since been rolled back, so start with an empty cache.
+
+        cache.get_cache("status_version").clear()
+
+        global_id_1 = apiTestHelpers.create_unique_global_id()
+        global_id_2 = apiTestHelpers.create_unique_global_id()
+        access_id_1 = apiTestHelpers.create_access_id(global_id_1)
+        access_id_2 = apiTestHelpers.create_access_id(global_id_2)
+
+        permission = Permission()
+        permission.issuing_global_id   = global_id_1
+        permission.access_type         = Permission.ACCESS_TYPE_CURRENT
+        permission.recipient_global_id = global_id_2
+        permission.status_type         = "*"
+        permission.save()
+
+        url = "/" + global_id_2.global_id + "/status"
+
+        def get_status(etag=None):
+            headers = hmac.calc_hmac_headers(
+                                method="GET",
+                                url=url,
+                                body="",
+                                access_secret=access_id_2.access_secret)
+            if etag != None:
+                headers['HTTP_IF_NONE_MATCH'] = etag
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, **headers)
+
+            num_view_queries = 0
+            for query in queries.captured_queries:
+                if CurrentStatusUpdateView._meta.db_table in query['sql']:
+                    num_view_queries = num_view_queries + 1
+
+            return (response, num_view_queries)
+
+        response,num_view_queries = get_status()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(num_view_queries, 1)
+
+        etag = response['ETag']
+
+        # Asking again with the ETag shouldn't query the views at all.
+
+        response,num_view_queries = get_status(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(num_view_queries, 0)
+
+        # Posting a status update should change the ETag.
+
+        request = {"type"      : "availability/text",
+                   "timestamp" : utils.current_utc_timestamp(),
+                   "contents"  : "Available"}
+
+        post_url = "/" + global_id_1.global_id + "/status"
+
+        headers = hmac.calc_hmac_headers(
+                                method="POST",
+                                url=post_url,
+                                body=json.dumps(request),
+                                access_secret=access_id_1.access_secret)
+
+        response = self.client.post(post_url,
+                                    json.dumps(request),
+                                    content_type="application/json",
+                                    **headers)
+        self.assertEqual(response.status_code, 201)
+
+        response,num_view_queries = get_status(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(len(data['updates']), 1)
+
+
+    @override_settings(FANOUT_ON_READ_THRESHOLD=1)
+    def test_get_status_not_modified_after_permission_change(self):
+        """ Test that a permission change alters the ETag for unfanned updates.
+        """
+        cache.get_cache("status_version").clear()
+
+        issuer       = apiTestHelpers.create_unique_global_id()
+        recipient    = apiTestHelpers.create_unique_global_id()
+        bystander    = apiTestHelpers.create_unique_global_id()
+        issuer_id    = apiTestHelpers.create_access_id(issuer)
+        recipient_id = apiTestHelpers.create_access_id(recipient)
+
+        def send(method, access_id, url, request=None, etag=None):
+            body    = "" if request == None else json.dumps(request)
+            headers = hmac.calc_hmac_headers(
+                                method=method,
+                                url=url.split("?")[0],
+                                body=body,
+                                access_secret=access_id.access_secret)
+            if etag != None:
+                headers['HTTP_IF_NONE_MATCH'] = etag
+
+            if method == "POST":
+                return self.client.post(url, body,
+                                        content_type="application/json",
+                                        **headers)
+            elif method == "DELETE":
+                return self.client.delete(url, **headers)
+            else:
+                return self.client.get(url, **headers)
+
+        # The issuer posts a status update before the recipient can see it.
+        # Another global ID can already see it, so the issuer's audience
+        # reaches our threshold and the update is fanned out on read.
+
+        permission = Permission()
+        permission.issuing_global_id   = issuer
+        permission.access_type         = Permission.ACCESS_TYPE_CURRENT
+        permission.recipient_global_id = bystander
+        permission.status_type         = "*"
+        permission.save()
+
+        response = send("POST", issuer_id,
+                        "/" + issuer.global_id + "/status",
+                        {"type"      : "availability/text",
+                         "timestamp" : utils.current_utc_timestamp(),
+                         "contents"  : "Available"})
+        self.assertEqual(response.status_code, 201)
+
+        status_url = "/" + recipient.global_id + "/status"
+
+        response = send("GET", recipient_id, status_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))
+                                                            ['updates'], [])
+        etag = response['ETag']
+
+        # Granting the recipient a permission should change the ETag, as the
+        # issuer's update is now visible.
+
+        permission_url = "/" + issuer.global_id + "/permission"
+
+        response = send("POST", issuer_id, permission_url,
+                        {"access_type" : "CURRENT",
+                         "global_id"   : recipient.global_id,
+                         "status_type" : "*"})
+        self.assertEqual(response.status_code, 201)
+
+        response = send("GET", recipient_id, status_url, etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(json.loads(response.content.decode("utf-8"))
+                                                            ['updates']), 1)
+        etag = response['ETag']
+
+        # Revoking the permission should change the ETag again.
+
+        response = send("DELETE", issuer_id,
+                        permission_url + "?access_type=CURRENT" +
+                        "&global_id=" + recipient.global_id +
+                        "&status_type=*")
+        self.assertEqual(response.status_code, 200)
+
+        response = send("GET", recipient_id, status_url, etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))
+                                                            ['updates'], [])
+
+
+
+    def test_get_status_wait(self):
+        """ Test that GET <global_id>/status can wait for a notification.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        url = "/" + global_id.global_id + "/status"
+
+        def get_status(wait):
+            headers = hmac.calc_hmac_headers(
+                                    method="GET",
+                                    url=url,
+                                    body="",
+                                    access_secret=access_id.access_secret)
+
+            start    = time.time()
+            response = self.client.get(url + "?wait=" + str(wait), **headers)
+            return (response, time.time() - start)
+
+        # With no status updates, the request should wait for the full time.
+
+        response,elapsed = get_status(0.2)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(elapsed, 0.2)
+
+        # A notification which doesn't bring any status updates for us, such
+        # as a change to the generation, shouldn't end the wait.
+
+        bus = notificationBus.get_bus()
+
+        timer = threading.Timer(0.05, bus.publish, [["generation"]])
+        timer.start()
+
+        response,elapsed = get_status(0.3)
+        timer.join()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(elapsed, 0.3)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(data['updates'], [])
+
+        # A notification which does bring a status update for us should wake
+        # the request up early.  The status update has to be posted by
+        # another thread, which can't see our test transaction, so we pretend
+        # that it has arrived once the notification is received.
+
+        real_check_for_updates = status_views._check_for_updates
+
+        def check_for_updates(*args):
+            etag,updates,latest = real_check_for_updates(*args)
+            if check_for_updates.notified:
+                updates = ['{"contents": "Available"}']
+                latest  = timezone.now()
+            return (etag, updates, latest)
+
+        def notify():
+            check_for_updates.notified = True
+            bus.publish([global_id.id])
+
+        check_for_updates.notified = False
+
+        timer = threading.Timer(0.1, notify)
+        timer.start()
+
+        with mock.patch.object(status_views, "_check_for_updates",
+                               check_for_updates):
+            response,elapsed = get_status(10)
+        timer.join()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 5)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(len(data['updates']), 1)
@@ -0,0 +1,303 @@
+""" statusAPI.api.tests.test_stream
+
+    This module tests the gateway which streams status updates to clients.
+"""
+import asyncio
+import json
+
+from django.test  import TestCase, override_settings
+from django.utils import timezone
+
+from statusAPI.shared.models import *
+
+from statusAPI.shared.lib import fanout, hmac, streamGateway, utils
+from . import apiTestHelpers
+
+#############################################################################
+
+class InlineStreamGateway(streamGateway.StreamGateway):
+    """ A StreamGateway which accesses the database from the calling thread.
+
+        The test database is only visible to the test's own thread, so we
+        can't use the gateway's worker threads.
+    """
+    def _run(self, function, *args):
+        """ Call the given function immediately, returning a resolved future.
+        """
+        future = asyncio.Future()
+        future.set_result(function(*args))
+        return future
+
+#############################################################################
+
+class FakeStreamWriter:
+    """ A stand-in for an asyncio StreamWriter which remembers the output.
+    """
+    def __init__(self):
+        self.output = b""
+
+
+    def write(self, data):
+        self.output = self.output + data
+
+
+    async def drain(self):
+        pass
+
+
+    def close(self):
+        pass
+
+#############################################################################
+
+class StreamTestCase(TestCase):
+    """ Unit tests for the "<global_id>/status/stream" endpoint.
+    """
+    def setUp(self):
+        """ Prepare to run the gateway in its own event loop.
+        """
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+
+    def tearDown(self):
+        """ Clean up after running the gateway.
+        """
+        self.loop.run_until_complete(asyncio.sleep(0)) # Finish cancelling.
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+
+    def stream(self, global_id, access_id, last_event_id=None):
+        """ Connect to the gateway for a short time, returning its output.
+        """
+        url = "/" + global_id.global_id + "/status/stream"
+
+        headers = hmac.calc_hmac_headers(method="GET",
+                                         url=url,
+                                         body="",
+                                         access_secret=access_id.access_secret)
+        if last_event_id != None:
+            headers['Last-Event-ID'] = last_event_id
+
+        request = "GET " + url + " HTTP/1.1\r\n"
+        for name,value in headers.items():
+            request = request + name.replace("_", "-") + ": " + value + "\r\n"
+        request = request + "\r\n"
+
+        reader = asyncio.StreamReader()
+        reader.feed_data(request.encode("utf-8"))
+        writer = FakeStreamWriter()
+
+        gateway = InlineStreamGateway("127.0.0.1", 0, keepalive=0.05)
+        try:
+            self.loop.run_until_complete(asyncio.wait_for(
+                            gateway._handle_connection(reader, writer), 0.2))
+        except asyncio.TimeoutError:
+            pass
+
+        return writer.output.decode("utf-8")
+
+
+    def test_stream(self):
+        """ Test that the gateway streams the current status updates.
+        """
+        global_id_1 = apiTestHelpers.create_unique_global_id()
+        global_id_2 = apiTestHelpers.create_unique_global_id()
+        access_id_1 = apiTestHelpers.create_access_id(global_id_1)
+        access_id_2 = apiTestHelpers.create_access_id(global_id_2)
+
+        permission = Permission()
+        permission.issuing_global_id   = global_id_1
+        permission.access_type         = Permission.ACCESS_TYPE_CURRENT
+        permission.recipient_global_id = global_id_2
+        permission.status_type         = "*"
+        permission.save()
+
+        request = {"type"      : "availability/text",
+                   "timestamp" : utils.current_utc_timestamp(),
+                   "contents"  : "Available"}
+
+        url = "/" + global_id_1.global_id + "/status"
+
+        headers = hmac.calc_hmac_headers(
+                                method="POST",
+                                url=url,
+                                body=json.dumps(request),
+                                access_secret=access_id_1.access_secret)
+
+        response = self.client.post(url,
+                                    json.dumps(request),
+                                    content_type="application/json",
+                                    **headers)
+
+        self.assertEqual(response.status_code, 201)
+
+        view = CurrentStatusUpdateView.objects.get(
+                                        recipient_global_id=global_id_2)
+
+        # Connecting should send the recipient's current status update.
+
+        output = self.stream(global_id_2, access_id_2)
+
+        self.assertTrue(output.startswith("HTTP/1.1 200 OK\r\n"))
+        self.assertIn("Content-Type: text/event-stream\r\n", output)
+
+        events = output.split("\r\n\r\n", 1)[1].split("\n\n")
+        self.assertEqual(events[0].split("\n")[0],
+                         "id: " + str(view.sequence))
+
+        data = json.loads(events[0].split("\n")[1][len("data: "):])
+        self.assertEqual(data['global_id'], global_id_1.global_id)
+        self.assertEqual(data['type'],      "availability/text")
+        self.assertEqual(data['contents'],  "Available")
+
+        # Resuming from the status update should only send keep-alives.
+
+        output = self.stream(global_id_2, access_id_2, str(view.sequence))
+
+        self.assertTrue(output.startswith("HTTP/1.1 200 OK\r\n"))
+        self.assertNotIn("data: ", output)
+        self.assertIn(": keepalive\n\n", output)
+
+
+    def test_stream_commit_order(self):
+        """ Test that resuming doesn't skip a status update committed late.
+        """
+        issuer_1  = apiTestHelpers.create_unique_global_id()
+        issuer_2  = apiTestHelpers.create_unique_global_id()
+        recipient = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(recipient)
+
+        for issuer in [issuer_1, issuer_2]:
+            permission = Permission()
+            permission.issuing_global_id   = issuer
+            permission.access_type         = Permission.ACCESS_TYPE_CURRENT
+            permission.recipient_global_id = recipient
+            permission.status_type         = "*"
+            permission.save()
+
+        status_type,created = StatusUpdateType.objects.get_or_create(
+                                    type="availability/text",
+                                    defaults={'description' : "Description"})
+
+        updates = []
+        for issuer in [issuer_1, issuer_2]:
+            update = StatusUpdate()
+            update.global_id = issuer
+            update.type      = status_type
+            update.timestamp = timezone.now()
+            update.tz_offset = 0
+            update.contents  = issuer.global_id
+            update.save()
+            updates.append(update)
+
+        self.assertLess(updates[0].id, updates[1].id)
+
+        # The second status update is fanned out, and streamed, before the
+        # first one, as happens when its transaction commits first.
+
+        fanout.fan_out(updates[1])
+
+        output = self.stream(recipient, access_id)
+        events = output.split("\r\n\r\n", 1)[1].split("\n\n")
+        self.assertIn(issuer_2.global_id, events[0])
+        last_event_id = events[0].split("\n")[0][len("id: "):]
+
+        # Resuming from that event should still send the first status update.
+
+        fanout.fan_out(updates[0])
+
+        output = self.stream(recipient, access_id, last_event_id)
+        self.assertIn(issuer_1.global_id, output)
+        self.assertNotIn(issuer_2.global_id, output)
+
+
+
+    @override_settings(FANOUT_ON_READ_THRESHOLD=1)
+    def test_stream_fanout_on_read(self):
+        """ Test that status updates fanned out on read are streamed.
+        """
+        issuer    = apiTestHelpers.create_unique_global_id()
+        recipient = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(recipient)
+
+        permission = Permission()
+        permission.issuing_global_id   = issuer
+        permission.access_type         = Permission.ACCESS_TYPE_CURRENT
+        permission.recipient_global_id = recipient
+        permission.status_type         = "*"
+        permission.save()
+
+        status_type,created = StatusUpdateType.objects.get_or_create(
+                                    type="availability/text",
+                                    defaults={'description' : "Description"})
+
+        update = StatusUpdate()
+        update.global_id = issuer
+        update.type      = status_type
+        update.timestamp = timezone.now()
+        update.tz_offset = 0
+        update.contents  = "Available"
+        update.save()
+
+        self.assertEqual(fanout.fan_out(update), None)
+
+        # The status update should be sent without an event ID, as it has no
+        # sequence number.
+
+        output = self.stream(recipient, access_id)
+        events = output.split("\r\n\r\n", 1)[1].split("\n\n")
+
+        self.assertTrue(events[0].startswith("data: "))
+        data = json.loads(events[0][len("data: "):])
+        self.assertEqual(data['global_id'], issuer.global_id)
+        self.assertEqual(data['contents'],  "Available")
+        self.assertEqual(output.count("data: "), 1)
+
+
+
+    def test_stream_forbidden(self):
+        """ Test that the gateway rejects an incorrectly-signed request.
+        """
+        global_id = apiTestHelpers.create_unique_global_id()
+        access_id = apiTestHelpers.create_access_id(global_id)
+
+        access_id.access_secret = "wrong"
+
+        output = self.stream(global_id, access_id)
+
+        self.assertTrue(output.startswith("HTTP/1.1 403 Forbidden\r\n"))
+
+
+
+    def test_stream_request_timeout(self):
+        """ Test that the gateway times out an unfinished request.
+        """
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"GET /x/status/stream HTTP/1.1\r\nHost: x\r\n")
+        writer = FakeStreamWriter()
+
+        gateway = InlineStreamGateway("127.0.0.1", 0, request_timeout=0.05)
+        self.loop.run_until_complete(asyncio.wait_for(
+                            gateway._handle_connection(reader, writer), 0.2))
+
+        self.assertTrue(writer.output.startswith(
+                                        b"HTTP/1.1 408 Request Timeout\r\n"))
+
+
+
+    def test_stream_header_too_long(self):
+        """ Test that the gateway rejects a header line which is too long.
+        """
+        reader = asyncio.StreamReader(limit=64)
+        reader.feed_data(b"GET /x/status/stream HTTP/1.1\r\n" +
+                         b"X-Padding: " + b"x" * 100 + b"\r\n\r\n")
+        writer = FakeStreamWriter()
+
+        gateway = InlineStreamGateway("127.0.0.1", 0)
+        self.loop.run_until_complete(asyncio.wait_for(
+                            gateway._handle_connection(reader, writer), 0.2))
+
+        self.assertTrue(writer.output.startswith(
+                                        b"HTTP/1.1 400 Bad Request\r\n"))
@@ -16,6 +16,7 @@ from django.http import (HttpResponseNotAllowed, HttpResponse,
                          HttpResponseForbidden)
 
 from statusAPI.shared.models import *
+from statusAPI.shared.lib    import utils
 
 #############################################################################
 
@@ -100,6 +101,8 @@ def post_access(request):
     access_id.access_secret = uuid.uuid4().hex
     access_id.save()
 
+    utils.invalidate_access_id(global_id)
+
     # Finally, return the details of the newly-created access ID back to the
     # caller.
 
@@ -129,6 +132,7 @@ def delete_access(request):
     # Delete the existing access credentials for this global ID, if it exists.
 
     AccessID.objects.filter(global_id=global_id_rec).delete()
+    utils.invalidate_access_id(global_id)
 
     # Tell the caller that we succeeded.
 
@@ -2,18 +2,25 @@
 
     This module implements the /history endpoint for the Status API.
 """
-from django.core.paginator import Paginator
+import heapq
+import itertools
+import json
+
+from django.db.models import Q
 from django.views.decorators.csrf import csrf_exempt
 from django.http import (HttpResponseBadRequest, HttpResponseForbidden,
-                         HttpResponseNotAllowed, JsonResponse)
+                         HttpResponseNotAllowed)
 
-from statusAPI.shared.lib    import hmac, utils
+from statusAPI.shared.lib    import (hmac, permissionMatcher,
+                                     trackSimplifier, utils)
 from statusAPI.shared.models import *
 
 #############################################################################
 
 MAX_PAGE_SIZE = 50 # Maximum number of status updates to return at once.
 
+MAX_TRACK_PAGE_SIZE = 10000 # Maximum number of status updates to simplify.
+
 #############################################################################
 
 @csrf_exempt
@@ -23,15 +30,26 @@ def history(request, global_id):
     if request.method != "GET":
         return HttpResponseNotAllowed(["GET"])
 
-    # Check the HMAC authentication.
+    return get_history(request, global_id)
 
-    access_id = utils.get_access_id(global_id)
-    if access_id == None:
-        return HttpResponseForbidden()
-
-    if not hmac.check_hmac_authentication(request, access_id.access_secret):
-        return HttpResponseForbidden()
+#############################################################################
 
+@hmac.hmac_authenticated
+def get_history(request, global_id):
+    """ Respond to an HTTP GET "<global_id>/history" API call.
+
+        The 'type' parameter can be given more than once to retrieve the
+        history for several types of status update at once.  The optional
+        'from' and 'to' parameters limit the history to the status updates
+        with a timestamp at or after 'from', and before 'to'.
+
+        When retrieving a "location/latlong" history, the optional 'simplify'
+        and 'max_points' parameters can be used to simplify the track before
+        it is returned.  'simplify' is a tolerance, in metres, and
+        'max_points' is the maximum number of points to return.  In this case,
+        each page is made from up to MAX_TRACK_PAGE_SIZE status updates, and
+        only the most significant of these are returned.
+    """
     # Get our request parameters.
 
     if "global_id" in request.GET:
@@ -39,9 +57,8 @@ def history(request, global_id):
     else:
         return HttpResponseBadRequest("Missing request params")
 
-    if "type" in request.GET:
-        type_param = request.GET['type']
-    else:
+    type_params = request.GET.getlist("type")
+    if len(type_params) == 0:
         return HttpResponseBadRequest("Missing request params")
 
     if "more" in request.GET:
@@ -49,68 +66,170 @@ def history(request, global_id):
     else:
         more_param = None
 
+    from_param = None
+    to_param   = None
+    try:
+        if "from" in request.GET:
+            from_param = utils.timestamp_to_datetime(request.GET['from'])
+            if from_param == None:
+                raise ValueError()
+        if "to" in request.GET:
+            to_param = utils.timestamp_to_datetime(request.GET['to'])
+            if to_param == None:
+                raise ValueError()
+    except ValueError:
+        return HttpResponseBadRequest("Invalid time range")
+
+    tolerance  = None
+    max_points = None
+    try:
+        if "simplify" in request.GET:
+            tolerance = float(request.GET['simplify'])
+            if not (tolerance >= 0):
+                raise ValueError()
+        if "max_points" in request.GET:
+            max_points = int(request.GET['max_points'])
+            if max_points < 2:
+                raise ValueError()
+    except ValueError:
+        return HttpResponseBadRequest("Invalid simplification parameters")
+
+    simplifying = (tolerance != None or max_points != None)
+    if simplifying:
+        if type_params != ["location/latlong"]:
+            return HttpResponseBadRequest("Only location/latlong " +
+                                          "histories can be simplified")
+        page_size = MAX_TRACK_PAGE_SIZE
+    else:
+        page_size = MAX_PAGE_SIZE
+
     # Check that the request is valid.
 
-    try:
-        status_type = StatusUpdateType.objects.get(type=type_param)
-    except StatusUpdateType.DoesNotExist:
+    status_types = {} # Maps status type ID to status type string.
+    query = StatusUpdateType.objects.filter(type__in=type_params)
+    for status_type_id,status_type in query.values_list("id", "type"):
+        status_types[status_type_id] = status_type
+
+    if len(status_types) != len(set(type_params)):
         return HttpResponseBadRequest("Invalid type")
 
-    if access_id.global_id.global_id != global_id_param:
+    if request.global_id_rec.global_id != global_id_param:
         # The user is attempting to access someone else's history.  Make sure
         # the other user has created a Permission record to allow this.
-        has_permission = False # initially.
-        for permission in Permission.objects.filter(
-                                issuing_global_id__global_id=global_id_param,
-                                access_type=Permission.ACCESS_TYPE_HISTORY,
-                                recipient_global_id=access_id.global_id):
-            if permission.matches_status_type(type_param):
-                has_permission = True
-                break
-
-        if not has_permission:
-            return HttpResponseForbidden()
+        matcher = permissionMatcher.get_matcher(
+                                    global_id_param,
+                                    Permission.ACCESS_TYPE_HISTORY)
+        for type_param in type_params:
+            if request.global_id_rec.id not in matcher.recipients(type_param):
+                return HttpResponseForbidden()
 
     if more_param != None:
         try:
-            more_param = int(more_param)
+            more_timestamp,more_id = utils.decode_cursor(more_param)
         except ValueError:
             return HttpResponseBadRequest("Invalid more parameter")
+    else:
+        more_timestamp = None
+        more_id        = None
+
+    # Retrieve the desired set of status updates.  For each type of status
+    # update, we scan the history index from the cursor's position, and then
+    # merge the status updates of the various types together, newest first.
+    # Each scan retrieves one extra status update, so we can tell if there are
+    # any more pages.
+
+    scans = []
+    for status_type_id in status_types.keys():
+        scans.append(_history_query(global_id_param, status_type_id,
+                                    from_param, to_param,
+                                    more_timestamp, more_id,
+                                    page_size).iterator())
+
+    rows = list(itertools.islice(
+                    heapq.merge(*scans, key=lambda row: (row[0], row[1]),
+                                reverse=True),
+                    page_size+1))
+
+    if len(rows) > page_size:
+        last_row = rows[page_size-1]
+        more     = utils.encode_cursor(last_row[0], last_row[1])
+    else:
+        more = None
 
-    # Build the database query to retrieve the desired set of status updates.
-    # Note that we use a Paginator to paginate the results.
+    rows = rows[:page_size]
+    if simplifying:
+        rows = _simplify_track(rows, tolerance, max_points)
 
-    query = StatusUpdate.objects.filter(global_id__global_id=global_id_param,
-                                        type=status_type)
-    query = query.order_by("-timestamp")
-    paginator = Paginator(query, MAX_PAGE_SIZE)
+    updates = []
+    for timestamp,id,type_id,fragment,tz_offset,contents in rows:
+        if fragment == "":
+            fragment = utils.status_update_to_json(global_id_param,
+                                                   status_types[type_id],
+                                                   timestamp, tz_offset,
+                                                   contents)
+        updates.append(fragment)
 
-    if more_param != None:
-        page_num = more_param
-    else:
-        page_num = 1
+    # Finally, return the results back to the caller.
 
-    if page_num > paginator.num_pages:
-        updates = []
-        more    = None
-    else:
-        updates = []
-        for update in paginator.page(page_num):
-            date_time = utils.utc_and_timezone_to_datetime(update.timestamp,
-                                                           update.tz_offset)
-            updates.append(
-                {'global_id' : update.global_id.global_id,
-                 'type'      : update.type.type,
-                 'timestamp' : utils.datetime_to_timestamp(date_time),
-                 'contents'  : update.contents})
-
-        if page_num < paginator.num_pages:
-            more = str(page_num + 1)
-        else:
-            more = None
+    return utils.json_fragments_response("updates", updates, more=more)
 
-    # Finally, return the results back to the caller.
+#############################################################################
+
+def _history_query(global_id, status_type_id, from_timestamp, to_timestamp,
+                   more_timestamp, more_id, page_size=MAX_PAGE_SIZE):
+    """ Return the query used to retrieve a page of history for a single type.
+
+        'global_id' is the global ID whose history we want, as a string, and
+        'status_type_id' is the record ID of the desired StatusUpdateType.
+        'from_timestamp' and 'to_timestamp', if not None, are the limits of
+        the time range to retrieve.  If 'more_timestamp' and 'more_id' are not
+        None, the page starts after the status update with that timestamp and
+        record ID.  'page_size' is the number of status updates in a page.
+
+        Note that, rather than counting and skipping over the earlier pages,
+        we seek directly to the cursor's position in the history index.  The
+        query returns up to page_size+1 (timestamp, id, type_id,
+        json_fragment, tz_offset, contents) tuples, newest first.
+    """
+    query = StatusUpdate.objects.filter(global_id__global_id=global_id,
+                                        type=status_type_id)
+
+    if from_timestamp != None:
+        query = query.filter(timestamp__gte=from_timestamp)
+
+    if to_timestamp != None:
+        query = query.filter(timestamp__lt=to_timestamp)
 
-    return JsonResponse({'updates' : updates,
-                         'more'    : more})
+    if more_timestamp != None:
+        # Note that the first condition is redundant, but allows the database
+        # to start its index scan at the cursor's position.
+        query = query.filter(timestamp__lte=more_timestamp)
+        query = query.filter(Q(timestamp__lt=more_timestamp) |
+                             Q(timestamp=more_timestamp, id__lt=more_id))
+
+    query = query.order_by("-timestamp", "-id")
+    query = query.values_list("timestamp", "id", "type", "json_fragment",
+                              "tz_offset", "contents")
+    return query[:page_size+1]
+
+#############################################################################
+
+def _simplify_track(rows, tolerance, max_points):
+    """ Simplify a page of "location/latlong" status updates.
+
+        'rows' is the list of (timestamp, id, type_id, json_fragment,
+        tz_offset, contents) tuples for the page, newest first, and
+        'tolerance' and 'max_points' are the simplification parameters passed
+        to trackSimplifier.simplify().  We return the rows for the status
+        updates to keep, in the same order.
+
+        Note that the first and last status update in the page are always
+        kept, so the simplified pages will join up with each other.
+    """
+    points = []
+    for row in rows:
+        contents = json.loads(row[5])
+        points.append((contents['latitude'], contents['longitude']))
 
+    return [rows[i] for i in trackSimplifier.simplify(points, tolerance,
+                                                      max_points)]
@@ -2,16 +2,27 @@
 
     This module implements the /location endpoint for the Status API.
 """
+import datetime
+import itertools
 import json
 import traceback
 
 from django.http import (HttpResponseNotAllowed, HttpResponseForbidden,
                          HttpResponseBadRequest, HttpResponse, JsonResponse)
 
+from django.conf import settings
+from django.db   import transaction
+
 from django.views.decorators.csrf import csrf_exempt
 
 from statusAPI.shared.models import *
-from statusAPI.shared.lib    import hmac, utils
+from statusAPI.shared.lib    import fanout, hmac, locationQueue, utils
+
+#############################################################################
+
+# The content type used to upload locations in our compact columnar format:
+
+COLUMNAR_CONTENT_TYPE = "application/vnd.globalid.location-columns+json"
 
 #############################################################################
 
@@ -32,10 +43,40 @@ def location(request):
 
 def post_location(request):
     """ Respond to an HTTP POST "location" API call.
+
+        The locations can be uploaded in one of two formats, selected by the
+        request's content type:
+
+            "application/json"
+
+                The request has a 'locations' entry, which is a list of
+                objects with 'timestamp', 'latitude' and 'longitude' entries.
+
+            COLUMNAR_CONTENT_TYPE
+
+                The request has a 'base_timestamp' entry, which is an RFC-3339
+                format timestamp, and 'time_deltas', 'latitudes_e7' and
+                'longitudes_e7' entries which are lists of integers with one
+                entry per location.  Each time delta is the number of
+                milliseconds since the previous location, or since the base
+                timestamp for the first location, and each latitude and
+                longitude is measured in units of 10^-7 degrees.
+
+        The entire batch of locations is checked before any of them are
+        saved.  The status updates for the locations are then written to the
+        issuer's history in bulk, and only the most recent location is fanned
+        out to the recipients, as this is the only one which will appear in
+        their current status updates.
+
+        If settings.LOCATION_QUEUE is True, the checked batch is instead added
+        to the location queue, and we return an HTTP 202 (Accepted) response
+        without writing the status updates.  See the
+        statusAPI.shared.lib.locationQueue module for details.
     """
     # Get our parameters from the body of the request.
 
-    if request.META['CONTENT_TYPE'] != "application/json":
+    content_type = request.META['CONTENT_TYPE']
+    if content_type not in ["application/json", COLUMNAR_CONTENT_TYPE]:
         return HttpResponse(status=415) # Unsupported media type.
 
     try:
@@ -43,116 +84,188 @@ def post_location(request):
     except ValueError:
         return HttpResponseBadRequest("Invalid JSON request")
 
-    if "session_id" in request_data:
-        session_id = request_data['session_id']
-    else:
+    if not isinstance(request_data, dict):
         return HttpResponseBadRequest("Invalid JSON request")
 
-    if "locations" in request_data:
-        locations = request_data['locations']
+    if "session_id" in request_data:
+        session_id = request_data['session_id']
     else:
         return HttpResponseBadRequest("Invalid JSON request")
 
-    if not isinstance(locations, (list,tuple)):
+    if not isinstance(session_id, str):
         return HttpResponseBadRequest("Invalid JSON request")
 
     # Check that the session ID is valid.
 
-    try:
-        session = LocationSession.objects.get(session_id=session_id)
-    except LocationSession.DoesNotExist:
+    global_id_rec = utils.get_location_session(session_id)
+    if global_id_rec == None:
         return HttpResponseForbidden()
 
     # Get the status type to use for our new status updates.
 
-    status_type = "location/latlong"
-
     try:
-        status_update_type = StatusUpdateType.objects.get(type=status_type)
+        status_update_type = StatusUpdateType.objects.get(
+                                            type=locationQueue.STATUS_TYPE)
     except StatusUpdateType.DoesNotExist:
         return HttpResponseBadRequest("Missing status type!")
 
-    # Create a "presence" update for each received location.
+    # Check and extract the uploaded locations.
+
+    try:
+        if content_type == COLUMNAR_CONTENT_TYPE:
+            points = _parse_columns(request_data)
+        else:
+            points = _parse_locations(request_data)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    # If we're using the location queue, add the batch of locations to the
+    # queue and tell the caller it will be processed later.
+
+    if settings.LOCATION_QUEUE:
+        if len(points) > 0:
+            locationQueue.enqueue(global_id_rec, points)
+        return HttpResponse(status=202) # Accepted.
+
+    # Save a "presence" status update for each location and, based upon the
+    # permissions, create or replace the CurrentStatusUpdateView record for
+    # each global ID able to view the most recent one.
+
+    with transaction.atomic():
+        fanned_out = locationQueue.write_locations(
+                                        status_update_type,
+                                        [(global_id_rec, points)])
+
+    for update,recipient_ids in fanned_out:
+        fanout.publish(update, recipient_ids)
+
+    # Finally, tell the caller that we accepted all the new locations.
+
+    return HttpResponse(status=201)
 
+#############################################################################
+
+def _parse_locations(request_data):
+    """ Extract the locations from an "application/json" format request.
+
+        'request_data' is the decoded body of the request.  We return a list
+        of (utc_datetime, tz_offset, latitude, longitude) tuples, one for each
+        location.  If the locations are invalid, we raise a ValueError with a
+        suitable error message.
+    """
+    if "locations" in request_data:
+        locations = request_data['locations']
+    else:
+        raise ValueError("Invalid JSON request")
+
+    if not isinstance(locations, (list,tuple)):
+        raise ValueError("Invalid JSON request")
+
+    points = []
     for location in locations:
         if not isinstance(location, dict):
-            return HttpResponseBadRequest("Invalid location: " + repr(location))
+            raise ValueError("Invalid location: " + repr(location))
 
         if "timestamp" in location:
             timestamp = location['timestamp']
         else:
-            return HttpResponseBadRequest("Missing timestamp: " +
-                                          repr(location))
+            raise ValueError("Missing timestamp: " + repr(location))
 
         try:
             timestamp = utils.timestamp_to_datetime(timestamp)
+            utc_datetime,tz_offset = \
+                    utils.datetime_to_utc_and_timezone(timestamp)
         except:
-            return HttpResponseBadRequest("Invalid timestamp")
+            raise ValueError("Invalid timestamp")
 
         if "latitude" in location:
             latitude = location['latitude']
         else:
-            return HttpResponseBadRequest("Missing latitude: " +
-                                          repr(location))
+            raise ValueError("Missing latitude: " + repr(location))
 
         if not isinstance(latitude, (int, float)):
-            return HttpResponseBadRequest("Invalid latitude value")
+            raise ValueError("Invalid latitude value")
 
         if latitude < -90 or latitude > 90:
-            return HttpResponseBadRequest("Invalid latitude value")
+            raise ValueError("Invalid latitude value")
 
         if "longitude" in location:
             longitude = location['longitude']
         else:
-            return HttpResponseBadRequest("Missing longitude: " +
-                                          repr(location))
+            raise ValueError("Missing longitude: " + repr(location))
 
         if not isinstance(longitude, (int, float)):
-            return HttpResponseBadRequest("Invalid longitude value")
+            raise ValueError("Invalid longitude value")
 
         if longitude < -180 or longitude > 180:
-            return HttpResponseBadRequest("Invalid longitude value")
-
-        contents = json.dumps({'latitude'  : latitude,
-                               'longitude' : longitude,
-                               'type'      : "presence"})
-
-        utc_datetime,tz_offset = utils.datetime_to_utc_and_timezone(timestamp)
-
-        update = StatusUpdate()
-        update.global_id = session.global_id
-        update.type      = status_update_type
-        update.timestamp = utc_datetime
-        update.tz_offset = tz_offset
-        update.contents  = contents
-        update.save()
-
-        # Based upon the permissions, create a CurrentStatusUpdateView record
-        # for each global ID able to view this status update.
-
-        for permission in Permission.objects.filter(
-                                    issuing_global_id=session.global_id,
-                                    access_type=Permission.ACCESS_TYPE_CURRENT):
-            if permission.matches_status_type(status_type):
-                # Create a CurrentStatusUpdateView record for this recipient,
-                # replacing the existing one if it exists.
-
-                CurrentStatusUpdateView.objects.filter(
-                        issuing_global_id=session.global_id,
-                        recipient_global_id=permission.recipient_global_id,
-                        type=status_update_type).delete()
-
-                view = CurrentStatusUpdateView()
-                view.issuing_global_id   = session.global_id
-                view.recipient_global_id = permission.recipient_global_id
-                view.status_update       = update
-                view.type                = status_update_type
-                view.timestamp           = utc_datetime
-                view.tz_offset           = tz_offset
-                view.contents            = contents
-                view.save()
+            raise ValueError("Invalid longitude value")
 
-    # Finally, tell the caller that we accepted all the new locations.
+        points.append((utc_datetime, tz_offset, latitude, longitude))
 
-    return HttpResponse(status=201)
+    return points
+
+#############################################################################
+
+def _parse_columns(request_data):
+    """ Extract the locations from a columnar format request.
 
+        'request_data' is the decoded body of the request.  We return a list
+        of (utc_datetime, tz_offset, latitude, longitude) tuples, one for each
+        location.  If the locations are invalid, we raise a ValueError with a
+        suitable error message.
+
+        Rather than checking each location in turn, each column is checked as
+        a whole.  All the locations share the base timestamp's timezone.
+    """
+    try:
+        base_timestamp = utils.timestamp_to_datetime(
+                                        request_data['base_timestamp'])
+        base_datetime,tz_offset = \
+                utils.datetime_to_utc_and_timezone(base_timestamp)
+    except:
+        raise ValueError("Invalid base timestamp")
+
+    columns = []
+    for name in ["time_deltas", "latitudes_e7", "longitudes_e7"]:
+        column = request_data.get(name)
+        if not isinstance(column, list):
+            raise ValueError("Missing " + name)
+        if not all(map(_is_integer, column)):
+            raise ValueError("Invalid " + name)
+        columns.append(column)
+
+    time_deltas,latitudes,longitudes = columns
+
+    if len(time_deltas) != len(latitudes) or \
+       len(time_deltas) != len(longitudes):
+        raise ValueError("Columns must be the same length")
+
+    if len(time_deltas) == 0:
+        return []
+
+    if min(time_deltas) < 0:
+        raise ValueError("Invalid time_deltas")
+
+    if min(latitudes) < -900000000 or max(latitudes) > 900000000:
+        raise ValueError("Invalid latitude value")
+
+    if min(longitudes) < -1800000000 or max(longitudes) > 1800000000:
+        raise ValueError("Invalid longitude value")
+
+    try:
+        timestamps = [base_datetime + datetime.timedelta(milliseconds=offset)
+                      for offset in itertools.accumulate(time_deltas)]
+    except OverflowError:
+        raise ValueError("Invalid time_deltas")
+
+    return [(timestamp, tz_offset, latitude / 10000000,
+             longitude / 10000000)
+            for timestamp,latitude,longitude
+            in zip(timestamps, latitudes, longitudes)]
+
+#############################################################################
+
+def _is_integer(value):
+    """ Return True if the given decoded JSON value is an integer.
+    """
+    return type(value) == int
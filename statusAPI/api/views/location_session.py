@@ -4,10 +4,9 @@
 """
 import json
 import traceback
-import uuid
 
-from django.http import (HttpResponseNotAllowed, HttpResponseForbidden,
-                         HttpResponseNotFound, HttpResponse, JsonResponse)
+from django.http import (HttpResponseNotAllowed, HttpResponseNotFound,
+                         HttpResponse, JsonResponse)
 
 from django.views.decorators.csrf import csrf_exempt
 
@@ -33,50 +32,30 @@ def location_session(request, global_id):
 
 #############################################################################
 
+@hmac.hmac_authenticated
 def post_location_session(request, global_id):
     """ Respond to an HTTP POST "<global_id>/location_session" API call.
     """
-    # Check the HMAC authentication.
-
-    access_id = utils.get_access_id(global_id)
-    if access_id == None:
-        return HttpResponseForbidden()
-
-    if not hmac.check_hmac_authentication(request, access_id.access_secret):
-        return HttpResponseForbidden()
-
     # Create a new location session for this user, re-using the old one if it
     # exists.
 
-    try:
-        session = LocationSession.objects.get(global_id__global_id=global_id)
-    except LocationSession.DoesNotExist:
-        session = None
+    session_id = LocationSession.objects.get_or_create_session_id(
+                                                    request.global_id_rec)
+
+    # Make sure we don't still have the session ID cached as unknown.
 
-    if session == None:
-        session = LocationSession()
-        session.global_id  = access_id.global_id
-        session.session_id = uuid.uuid4().hex
-        session.save()
+    utils.invalidate_location_session(session_id)
 
     # Finally, return the session ID back to the caller.
 
-    return JsonResponse({'session_id' : session.session_id}, status=201)
+    return JsonResponse({'session_id' : session_id}, status=201)
 
 #############################################################################
 
+@hmac.hmac_authenticated
 def delete_location_session(request, global_id):
     """ Respond to an HTTP DELETE "<global_id>/location_session" API call.
     """
-    # Check the HMAC authentication.
-
-    access_id = utils.get_access_id(global_id)
-    if access_id == None:
-        return HttpResponseForbidden()
-
-    if not hmac.check_hmac_authentication(request, access_id.access_secret):
-        return HttpResponseForbidden()
-
     # Delete the location session for this user.
 
     try:
@@ -85,6 +64,7 @@ def delete_location_session(request, global_id):
         return HttpResponseNotFound()
 
     session.delete()
+    utils.invalidate_location_session(session.session_id)
 
     # Tell the user we succeeded.
 
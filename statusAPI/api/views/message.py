@@ -5,10 +5,13 @@
     NOTE: This is temporary, and will be deleted at some time in the future.
 """
 import json
+import sqlite3
 import traceback
 
-from django.http import (HttpResponseNotAllowed, HttpResponseForbidden,
-                         HttpResponseBadRequest, HttpResponse, JsonResponse)
+from django.http import (HttpResponseNotAllowed, HttpResponseBadRequest,
+                         HttpResponse, JsonResponse)
+
+from django.db import connection, transaction
 
 from django.views.decorators.csrf import csrf_exempt
 
@@ -17,6 +20,10 @@ from statusAPI.shared.lib    import hmac, utils
 
 #############################################################################
 
+MESSAGE_CHUNK_SIZE = 100 # Number of messages to delete at once.
+
+#############################################################################
+
 @csrf_exempt
 def message(request, global_id):
     """ Respond to the "<global_id>/status" endpoint.
@@ -34,56 +41,51 @@ def message(request, global_id):
 
 #############################################################################
 
+@hmac.hmac_authenticated
 def get_message(request, global_id):
     """ Respond to an HTTP GET "<global_id>/message" API call.
-    """
-    # Check the HMAC authentication.
-
-    access_id = utils.get_access_id(global_id)
-    if access_id == None:
-        return HttpResponseForbidden()
-
-    if not hmac.check_hmac_authentication(request, access_id.access_secret):
-        return HttpResponseForbidden()
 
-    # Get the messages to return.  At the same time, remember the messages to
-    # delete.
-
-    message_ids = []
-    messages    = []
+        The caller's messages are returned, oldest first, and removed from
+        their inbox.  If the optional 'limit' parameter is given, at most this
+        many messages are returned; the rest are left for the next call.
+    """
+    # Get our request parameters.
+
+    if "limit" in request.GET:
+        try:
+            limit = int(request.GET['limit'])
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return HttpResponseBadRequest("Invalid limit")
+    else:
+        limit = None
 
-    query = Message.objects.filter(recipient__global_id=global_id)
+    # Remove the messages from the caller's inbox.
 
-    for message in query.order_by("timestamp"):
-        message_ids.append(message.id)
-        messages.append({'sender'  : message.sender.global_id,
-                         'message' : json.loads(message.message)})
+    rows = _take_messages(request.global_id_rec.id, limit)
 
-    # Delete the messages we retrieved.
+    # Look up the senders for all the messages at once.
 
-    for message_id in message_ids:
-        Message.objects.filter(id=message_id).delete()
+    sender_ids = set([sender_id for sender_id,message in rows])
+    senders    = dict(GlobalID.objects.filter(id__in=sender_ids)
+                                      .values_list("id", "global_id"))
 
     # Finally, return the messages back to the caller.
 
-    print("Returning messages: {}".format(json.dumps(messages)))
+    messages = []
+    for sender_id,message in rows:
+        messages.append({'sender'  : senders[sender_id],
+                         'message' : json.loads(message)})
 
     return JsonResponse(messages, safe=False)
 
 #############################################################################
 
+@hmac.hmac_authenticated
 def post_message(request, global_id):
     """ Respond to an HTTP POST "<global_id>/message" API call.
     """
-    # Check the HMAC authentication.
-
-    access_id = utils.get_access_id(global_id)
-    if access_id == None:
-        return HttpResponseForbidden()
-
-    if not hmac.check_hmac_authentication(request, access_id.access_secret):
-        return HttpResponseForbidden()
-
     # Get our parameters from the body of the request.
 
     if request.META['CONTENT_TYPE'] != "application/json":
@@ -110,16 +112,88 @@ def post_message(request, global_id):
 
     message_rec = Message()
     message_rec.timestamp = utils.current_utc_timestamp()
-    message_rec.sender    = access_id.global_id
+    message_rec.sender    = request.global_id_rec
     message_rec.recipient = recipient_rec
     message_rec.message   = json.dumps(message)
     message_rec.save()
 
     # Finally, tell the caller that we created the new message
 
-    print("Created message {} from {} to {}".format(json.dumps(message),
-                                                    access_id.global_id,
-                                                    recipient_rec.global_id))
-
     return HttpResponse(status=201)
 
+#############################################################################
+
+def _take_messages(recipient_id, limit):
+    """ Remove and return the oldest messages in a recipient's inbox.
+
+        'recipient_id' is the record ID of the recipient's GlobalID, and
+        'limit' is the maximum number of messages to take, or None to take
+        all of them.  We return a list of (sender_id, message) tuples, oldest
+        first.
+
+        Where the database supports it, the messages are fetched and deleted
+        using a single "DELETE ... RETURNING" statement.  On PostgreSQL, this
+        skips any messages locked by a concurrent reader, so each message is
+        only ever returned to one caller.  Otherwise, the messages are
+        locked, read and then deleted in chunks of MESSAGE_CHUNK_SIZE, within
+        a single transaction.
+    """
+    if _supports_delete_returning():
+        qn    = connection.ops.quote_name
+        table = qn(Message._meta.db_table)
+
+        sql = ("SELECT id FROM " + table + " WHERE recipient_id = %s" +
+               " ORDER BY timestamp, id")
+        params = [recipient_id]
+        if limit != None:
+            sql = sql + " LIMIT %s"
+            params.append(limit)
+        if connection.vendor == "postgresql":
+            sql = sql + " FOR UPDATE SKIP LOCKED"
+
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM " + table + " WHERE id IN (" + sql +
+                           ") RETURNING timestamp, id, sender_id, message",
+                           params)
+            rows = sorted(cursor.fetchall())
+
+        return [(sender_id, message)
+                for timestamp,id,sender_id,message in rows]
+
+    rows = []
+    with transaction.atomic():
+        while limit == None or len(rows) < limit:
+            chunk_size = MESSAGE_CHUNK_SIZE
+            if limit != None:
+                chunk_size = min(chunk_size, limit - len(rows))
+
+            chunk = list(Message.objects.filter(recipient_id=recipient_id)
+                                        .select_for_update()
+                                        .order_by("timestamp", "id")
+                                        .values_list("id", "sender_id",
+                                                     "message")
+                                        [:chunk_size])
+
+            Message.objects.filter(id__in=[row[0] for row in chunk]).delete()
+            rows.extend([(sender_id, message)
+                         for id,sender_id,message in chunk])
+
+            if len(chunk) < chunk_size:
+                break
+
+    return rows
+
+#############################################################################
+
+def _supports_delete_returning():
+    """ Return True if our database supports "DELETE ... RETURNING".
+
+        On PostgreSQL, we also need "SKIP LOCKED", which requires version 9.5.
+    """
+    if connection.vendor == "postgresql":
+        return connection.pg_version >= 90500
+    elif connection.vendor == "sqlite":
+        return sqlite3.sqlite_version_info >= (3, 35, 0)
+    else:
+        return False
+
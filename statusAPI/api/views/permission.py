@@ -6,14 +6,13 @@ import json
 import traceback
 import urllib.parse
 
-from django.http import (HttpResponseNotAllowed, HttpResponseForbidden,
-                         HttpResponseBadRequest, HttpResponse, JsonResponse,
-                         HttpResponseNotFound)
+from django.http import (HttpResponseNotAllowed, HttpResponseBadRequest,
+                         HttpResponse, JsonResponse, HttpResponseNotFound)
 
 from django.views.decorators.csrf import csrf_exempt
 
 from statusAPI.shared.models import *
-from statusAPI.shared.lib    import hmac, utils
+from statusAPI.shared.lib    import fanout, hmac, permissionMatcher
 
 #############################################################################
 
@@ -36,18 +35,10 @@ def permission(request, global_id):
 
 #############################################################################
 
+@hmac.hmac_authenticated
 def get_permission(request, global_id):
     """ Respond to the HTTP GET "<global_id>/permission" endpoint.
     """
-    # Check the HMAC authentication.
-
-    access_id = utils.get_access_id(global_id)
-    if access_id == None:
-        return HttpResponseForbidden()
-
-    if not hmac.check_hmac_authentication(request, access_id.access_secret):
-        return HttpResponseForbidden()
-
     # Get our query-string parameters.
 
     if "global_id" in request.GET:
@@ -62,25 +53,32 @@ def get_permission(request, global_id):
 
     # Build a database query to retrieve the desired set of permissions.
 
-    query = Permission.objects.filter(issuing_global_id=access_id.global_id)
+    query = Permission.objects.filter(issuing_global_id=request.global_id_rec)
 
     if global_id_param != None:
         query = query.filter(recipient_global_id__global_id=global_id_param)
 
+    if type_param != None:
+        # Only include the permissions which cover the given type of status
+        # update.
+        patterns = set()
+        for access_type,label in Permission.ACCESS_TYPE_CHOICES:
+            matcher = permissionMatcher.get_matcher(
+                                    request.global_id_rec.global_id,
+                                    access_type)
+            patterns.update(matcher.patterns(type_param))
+        query = query.filter(status_type__in=patterns)
+
     # Build a list of the matching permissions.
 
     permissions = []
-    for permission in query:
-        if type_param != None:
-            # Only include the permission if it covers the given type of status
-            # update.
-            if not permission.matches_status_type(type_param):
-                continue
-
-        permissions.append(
-            {'access_type' : permission.access_type,
-             'global_id'   : permission.recipient_global_id.global_id,
-             'status_type' : permission.status_type})
+    for access_type,global_id,status_type in query.values_list(
+                                            "access_type",
+                                            "recipient_global_id__global_id",
+                                            "status_type"):
+        permissions.append({'access_type' : access_type,
+                            'global_id'   : global_id,
+                            'status_type' : status_type})
 
     # Finally, return the results back to the caller.
 
@@ -88,18 +86,10 @@ def get_permission(request, global_id):
 
 ############################################################################
 
+@hmac.hmac_authenticated
 def post_permission(request, global_id):
     """ Respond to the HTTP POST "<global_id>/permission" endpoint.
     """
-    # Check the HMAC authentication.
-
-    access_id = utils.get_access_id(global_id)
-    if access_id == None:
-        return HttpResponseForbidden()
-
-    if not hmac.check_hmac_authentication(request, access_id.access_secret):
-        return HttpResponseForbidden()
-
     # Get our request parameters.
 
     if request.META['CONTENT_TYPE'] != "application/json":
@@ -140,30 +130,27 @@ def post_permission(request, global_id):
     # Create the new permission.
 
     permission = Permission()
-    permission.issuing_global_id   = access_id.global_id
+    permission.issuing_global_id   = request.global_id_rec
     permission.access_type         = access_type
     permission.recipient_global_id = global_id_rec
     permission.status_type         = status_type
     permission.save()
 
+    permissionMatcher.invalidate_matchers(request.global_id_rec.global_id)
+
+    if access_type == Permission.ACCESS_TYPE_CURRENT:
+        fanout.permission_changed(request.global_id_rec, global_id_rec.id)
+
     # Finally, tell the caller the good news.
 
     return HttpResponse(status=201)
 
 #############################################################################
 
+@hmac.hmac_authenticated
 def delete_permission(request, global_id):
     """ Respond to the HTTP DELETE "<global_id>/permission" endpoint.
     """
-    # Check the HMAC authentication.
-
-    access_id = utils.get_access_id(global_id)
-    if access_id == None:
-        return HttpResponseForbidden()
-
-    if not hmac.check_hmac_authentication(request, access_id.access_secret):
-        return HttpResponseForbidden()
-
     # Get our request parameters.  Note that, because Django doesn't parse our
     # query-string parameters, we have to do it manually.
 
@@ -186,10 +173,21 @@ def delete_permission(request, global_id):
 
     # Delete the given permission, if it exists.
 
-    Permission.objects.filter(issuing_global_id=access_id.global_id,
-                              access_type=access_type,
-                              recipient_global_id__global_id=global_id,
-                              status_type=status_type).delete()
+    permissions = Permission.objects.filter(
+                            issuing_global_id=request.global_id_rec,
+                            access_type=access_type,
+                            recipient_global_id__global_id=global_id,
+                            status_type=status_type)
+
+    recipient_ids = list(permissions.values_list("recipient_global_id",
+                                                 flat=True))
+    permissions.delete()
+
+    permissionMatcher.invalidate_matchers(request.global_id_rec.global_id)
+
+    if access_type == Permission.ACCESS_TYPE_CURRENT:
+        for recipient_id in recipient_ids:
+            fanout.permission_changed(request.global_id_rec, recipient_id)
 
     return HttpResponse(status=200)
 
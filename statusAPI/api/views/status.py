@@ -3,15 +3,20 @@
     This module implements the /status endpoint for the Status API.
 """
 import json
+import time
 import traceback
 
-from django.http import (HttpResponseNotAllowed, HttpResponseForbidden,
-                         HttpResponseBadRequest, HttpResponse, JsonResponse)
+from django.http import (HttpResponseNotAllowed, HttpResponseBadRequest,
+                         HttpResponse)
+
+from django.conf import settings
+from django.db   import transaction
 
 from django.views.decorators.csrf import csrf_exempt
 
 from statusAPI.shared.models import *
-from statusAPI.shared.lib    import hmac, utils
+from statusAPI.shared.lib    import (currentStatus, fanout, hmac,
+                                     notificationBus, statusVersion, utils)
 
 #############################################################################
 
@@ -32,18 +37,10 @@ def status(request, global_id):
 
 #############################################################################
 
+@hmac.hmac_authenticated
 def get_status(request, global_id):
     """ Respond to an HTTP GET "<global_id>/status" API call.
     """
-    # Check the HMAC authentication.
-
-    access_id = utils.get_access_id(global_id)
-    if access_id == None:
-        return HttpResponseForbidden()
-
-    if not hmac.check_hmac_authentication(request, access_id.access_secret):
-        return HttpResponseForbidden()
-
     # Get our request parameters.
 
     if "own" in request.GET and request.GET['own'] == "1":
@@ -69,39 +66,60 @@ def get_status(request, global_id):
     else:
         param_since = None
 
-    # Build the database query to retrieve the desired set of
-    # CurrentStatusUpdateView records.
-
-    query = CurrentStatusUpdateView.objects.all()
-
-    if param_own:
-        query = query.filter(issuing_global_id=access_id.global_id)
+    if "wait" in request.GET:
+        try:
+            param_wait = float(request.GET['wait'])
+        except ValueError:
+            return HttpResponseBadRequest("Invalid 'wait' value")
+        if param_wait < 0:
+            return HttpResponseBadRequest("Invalid 'wait' value")
+        param_wait = min(param_wait, settings.MAX_STATUS_WAIT)
     else:
-        query = query.filter(recipient_global_id=access_id.global_id)
+        param_wait = 0
 
-    if param_global_id != None:
-        query = query.filter(issuing_global_id__global_id=param_global_id)
+    # If the caller wants to wait for new status updates, subscribe to the
+    # notifications for this global ID before checking for status updates, so
+    # that we can't miss a status update posted while we are checking.
 
-    if param_type != None:
-        query = query.filter(type__type=param_type)
-
-    if param_since != None:
-        query = query.filter(timestamp__gt=param_since)
-
-    # Assemble the list of status updates which match our database query.
+    if param_wait > 0:
+        subscription = notificationBus.get_bus().subscribe(
+                                    [request.global_id_rec.id, "generation"])
+    else:
+        subscription = None
 
-    updates = []
-    latest  = None
-    for view in query:
-        date_time = utils.utc_and_timezone_to_datetime(view.timestamp,
-                                                       view.tz_offset)
-        updates.append(
-                {'global_id' : view.issuing_global_id.global_id,
-                 'type'      : view.type.type,
-                 'timestamp' : utils.datetime_to_timestamp(date_time),
-                 'contents'  : view.contents})
-        if latest == None or view.timestamp > latest:
-            latest = view.timestamp
+    try:
+        etag,updates,latest = _check_for_updates(request, param_own,
+                                                 param_global_id, param_type,
+                                                 param_since)
+
+        if subscription != None:
+            # Wait for a notification, and then check again.  The notification
+            # may not have been meant for this caller (for example, any status
+            # update fanned out on read changes the generation), so we keep
+            # waiting until we find something or run out of time.  Note that
+            # the notification may have come from another server process, so
+            # we can't rely on our cached version of the status updates.
+            deadline = time.time() + param_wait
+            while updates == None or len(updates) == 0:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not subscription.wait(remaining):
+                    break
+                statusVersion.forget_versions(request.global_id_rec.id)
+                etag,updates,latest = _check_for_updates(request, param_own,
+                                                         param_global_id,
+                                                         param_type,
+                                                         param_since)
+    finally:
+        if subscription != None:
+            subscription.close()
+
+    # If the caller already has the current version of their status updates,
+    # tell them that nothing has changed.
+
+    if updates == None:
+        response = HttpResponse(status=304) # Not modified.
+        response['ETag'] = etag
+        return response
 
     # Calculate the 'since' value to use for retrieving only the new updates.
 
@@ -115,23 +133,16 @@ def get_status(request, global_id):
 
     # Finally, return the results back to the caller.
 
-    return JsonResponse({'updates' : updates,
-                         'since'   : since})
+    response = utils.json_fragments_response("updates", updates, since=since)
+    response['ETag'] = etag
+    return response
 
 #############################################################################
 
+@hmac.hmac_authenticated
 def post_status(request, global_id):
     """ Respond to an HTTP POST "<global_id>/status" API call.
     """
-    # Check the HMAC authentication.
-
-    access_id = utils.get_access_id(global_id)
-    if access_id == None:
-        return HttpResponseForbidden()
-
-    if not hmac.check_hmac_authentication(request, access_id.access_secret):
-        return HttpResponseForbidden()
-
     # Get our parameters from the body of the request.
 
     if request.META['CONTENT_TYPE'] != "application/json":
@@ -200,44 +211,66 @@ def post_status(request, global_id):
     utc_datetime,tz_offset = utils.datetime_to_utc_and_timezone(timestamp)
 
     update = StatusUpdate()
-    update.global_id = access_id.global_id
+    update.global_id = request.global_id_rec
     update.type      = status_update_type
     update.timestamp = utc_datetime
     update.tz_offset = tz_offset
     update.contents  = status_contents
-    update.save()
-
-    # Now, based upon the permissions, create a CurrentStatusUpdateView record
-    # for each global ID able to view this status update.
-
-    for permission in Permission.objects.filter(
-                                    issuing_global_id=access_id.global_id,
-                                    access_type=Permission.ACCESS_TYPE_CURRENT):
-        if permission.matches_status_type(status_type):
-            # Create a CurrentStatusUpdateView record for this recipient,
-            # replacing the existing one if it exists.
-            try:
-                view = CurrentStatusUpdateView.objects.get(
-                            issuing_global_id=access_id.global_id,
-                            recipient_global_id=permission.recipient_global_id,
-                            type=status_update_type)
-            except CurrentStatusUpdateView.DoesNotExist:
-                view = None
-
-            if view != None:
-                view.delete()
-
-            view = CurrentStatusUpdateView()
-            view.issuing_global_id   = access_id.global_id
-            view.recipient_global_id = permission.recipient_global_id
-            view.status_update       = update
-            view.type                = status_update_type
-            view.timestamp           = utc_datetime
-            view.tz_offset           = tz_offset
-            view.contents            = status_contents
-            view.save()
+
+    update.json_fragment = utils.status_update_to_json(
+                                    request.global_id_rec.global_id,
+                                    status_type, utc_datetime, tz_offset,
+                                    status_contents)
+
+    # Save the status update and, based upon the permissions, create or
+    # replace the CurrentStatusUpdateView record for each global ID able to
+    # view this status update.
+
+    with transaction.atomic():
+        update.save()
+        recipient_ids = fanout.fan_out(update)
+
+    fanout.publish(update, recipient_ids)
 
     # Finally, tell the caller that we created the new status update.
 
     return HttpResponse(status=201)
 
+#############################################################################
+
+def _check_for_updates(request, param_own, param_global_id, param_type,
+                       param_since):
+    """ Check for status updates matching the given request parameters.
+
+        We return an (etag, updates, latest) tuple, where 'etag' is the ETag
+        for the caller's current status updates, 'updates' is a list of the
+        JSON representations of the matching status updates, and 'latest' is
+        the most recent timestamp of the matching status updates, or None if
+        there are no matching status updates.  If the request's If-None-Match
+        header matches the ETag, 'updates' and 'latest' will both be None.
+    """
+    # Calculate the ETag for the caller's current status updates, and stop if
+    # the caller already has this version.  Note that we calculate the ETag
+    # before querying the status updates, so that a status update posted while
+    # we are querying results in a different ETag next time.
+
+    etag = statusVersion.calc_etag(request.global_id_rec, request.GET)
+
+    if request.META.get("HTTP_IF_NONE_MATCH") == etag:
+        return (etag, None, None)
+
+    # Retrieve the matching status updates.
+
+    updates = []
+    latest  = None
+    for status_update_id,timestamp,fragment in currentStatus.find_updates(
+                                                request.global_id_rec,
+                                                own=param_own,
+                                                issuer=param_global_id,
+                                                status_type=param_type,
+                                                since=param_since):
+        updates.append(fragment)
+        if latest == None or timestamp > latest:
+            latest = timestamp
+
+    return (etag, updates, latest)
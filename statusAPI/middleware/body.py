@@ -0,0 +1,36 @@
+""" middleware.body.py
+
+    This middleware component reads the body of each incoming request, making
+    sure it isn't too large.
+
+    The body is read in chunks directly from the request's input stream, and
+    its MD5 digest is calculated as it is read, so that the HMAC
+    authentication doesn't need to hash the body a second time.  If the body
+    is larger than the MAX_REQUEST_BODY_SIZE setting, we reject the request
+    with an HTTP 413 (Request Entity Too Large) response; where the request
+    has a Content-Length header, this is done before reading any of the body.
+
+    Request bodies compressed using a "Content-Encoding" of "gzip" or
+    "deflate" are decompressed as they are read.  The decompressed body is
+    also size-checked, against the MAX_DECOMPRESSED_BODY_SIZE setting.
+"""
+from django.http import HttpResponse, HttpResponseBadRequest
+
+from statusAPI.shared.lib import utils
+
+#############################################################################
+
+class RequestBodyMiddleware(object):
+    """ Middleware component to read and size-check each request's body.
+    """
+    def process_request(self, request):
+        """ Respond to an incoming HTTP request.
+        """
+        try:
+            utils.read_request_body(request)
+        except utils.RequestBodyTooLarge:
+            return HttpResponse(status=413) # Request entity too large.
+        except utils.UnsupportedContentEncoding:
+            return HttpResponse(status=415) # Unsupported media type.
+        except utils.InvalidRequestBody:
+            return HttpResponseBadRequest("Invalid compressed body")
@@ -19,6 +19,11 @@
             A comma-separated list of HTTP headers allowed by the CORS
             middleware.  Defaults to "Content-Type" if not specified.
 
+        CORS_EXPOSED_HEADERS
+
+            A comma-separated list of HTTP response headers which the client
+            is allowed to access.  Defaults to "" if not specified.
+
     You should override these in your settings.py module if your application
     accepts a different set of HTTP methods or headers.
 """
@@ -56,5 +61,9 @@ class CORSMiddleware(object):
             response['Access-Control-Allow-Origin']  = origin
             response['Access-Control-Allow-Methods'] = allowed_methods
             response['Access-Control-Allow-Headers'] = allowed_headers
+
+            exposed_headers = getattr(settings, "CORS_EXPOSED_HEADERS", "")
+            if exposed_headers:
+                response['Access-Control-Expose-Headers'] = exposed_headers
         return response
 
@@ -36,6 +36,130 @@ import_setting("DATABASE_URL",                  None)
 import_setting("KEEP_NONCE_VALUES_FOR", None)
 # NOTE: KEEP_NONCE_VALUES_FOR is measured in days.  If this has the value
 #       "none", the None values are kept forever.
+import_setting("HMAC_MAX_CLOCK_SKEW",           300)
+# NOTE: HMAC_MAX_CLOCK_SKEW is the maximum number of seconds a version 2
+#       HMAC-signed request's timestamp can differ from the server's clock.
+import_setting("HMAC_ACCEPT_V1",                True)
+# NOTE: HMAC_ACCEPT_V1 should be set to False once all clients have been
+#       migrated to version 2 of the HMAC signing scheme.  The nonce values
+#       will then only be kept for twice HMAC_MAX_CLOCK_SKEW, rather than for
+#       KEEP_NONCE_VALUES_FOR days.
+import_setting("NONCE_STORE",                   "database")
+# NOTE: NONCE_STORE selects where the used nonce values are remembered.  This
+#       can be one of "memory" (within each process), "sqlite" (a local file
+#       shared by all the processes on this machine), or "database" (the
+#       NonceValue table).
+import_setting("NONCE_STORE_PATH",              None)
+# NOTE: NONCE_STORE_PATH is the path to the SQLite database file used by the
+#       "sqlite" nonce store.  If this is None, the file will be placed in the
+#       top-level directory for our server.
+import_setting("NONCE_STORE_MAX_ENTRIES",       1000000)
+# NOTE: NONCE_STORE_MAX_ENTRIES is the maximum number of nonce values which
+#       the "memory" nonce store will remember.  Nonces are only forgotten
+#       once they fall outside the replay window, so once this many requests
+#       have been made within the window, further requests are rejected.
+#       With the default settings the window never ends, so the "memory"
+#       store is only suitable once HMAC_ACCEPT_V1 is False, or if
+#       KEEP_NONCE_VALUES_FOR is short enough for this limit to hold every
+#       request made within that many days.
+import_setting("NONCE_PURGE_CHUNK_SIZE",        1000)
+import_setting("NONCE_PURGE_PAUSE",             0.1)
+# NOTE: NONCE_PURGE_CHUNK_SIZE and NONCE_PURGE_PAUSE are the default number of
+#       nonce values to delete at once, and the number of seconds to wait
+#       between each chunk, when running the "purge_nonces" command.
+import_setting("NONCE_FILTER",                  False)
+# NOTE: If NONCE_FILTER is True, a rotating Bloom filter is used to prove that
+#       a nonce is new before it is added to the nonce store.
+import_setting("NONCE_FILTER_PATH",             None)
+# NOTE: NONCE_FILTER_PATH is the directory to store the nonce filter's bit
+#       arrays in.  If this is None, the bit arrays are only kept in memory.
+import_setting("NONCE_FILTER_BUCKETS",          8)
+import_setting("NONCE_FILTER_CAPACITY",         100000)
+import_setting("NONCE_FILTER_ERROR_RATE",       0.001)
+# NOTE: The nonce filter splits the nonce replay window into
+#       NONCE_FILTER_BUCKETS buckets, each sized to hold NONCE_FILTER_CAPACITY
+#       nonces with a false-positive rate of NONCE_FILTER_ERROR_RATE.
+import_setting("MAX_REQUEST_BODY_SIZE",         10 * 1024 * 1024)
+# NOTE: MAX_REQUEST_BODY_SIZE is the maximum size of a request body, in bytes.
+#       Larger requests are rejected.  Set this to None to disable the check.
+import_setting("MAX_DECOMPRESSED_BODY_SIZE",    10 * 1024 * 1024)
+# NOTE: MAX_DECOMPRESSED_BODY_SIZE is the maximum size of a request body
+#       after it has been decompressed, for requests sent with a
+#       "Content-Encoding" of "gzip" or "deflate".  Set this to None to
+#       disable the check.
+import_setting("CACHE_ALIAS",                   "default")
+# NOTE: CACHE_ALIAS is the name of the Django cache used by any of our caches
+#       which are configured to use the "django" backend.
+import_setting("ACCESS_ID_CACHE",               "local")
+import_setting("ACCESS_ID_CACHE_SIZE",          10000)
+import_setting("ACCESS_ID_CACHE_TTL",           30)
+# NOTE: ACCESS_ID_CACHE is the backend used to cache the access ID for each
+#       global ID.  This can be "local", "django" or "none".  See the
+#       statusAPI.shared.lib.cache module for more information.
+#
+#       When an access ID is created or deleted, every "local" cache is told
+#       to drop its entries using the notification bus.  With the default
+#       "local" NOTIFICATION_BUS this only reaches the current process, so if
+#       you run more than one server process, either use the "postgresql"
+#       notification bus, or use the "django" backend with a shared Django
+#       cache.  Otherwise, a deleted access ID will still be accepted by the
+#       other processes for up to ACCESS_ID_CACHE_TTL seconds.
+import_setting("PERMISSION_CACHE",              "local")
+import_setting("PERMISSION_CACHE_SIZE",         10000)
+import_setting("PERMISSION_CACHE_TTL",          30)
+# NOTE: PERMISSION_CACHE is the backend used to cache the compiled permission
+#       matcher for each issuer.  As with ACCESS_ID_CACHE, changes to an
+#       issuer's permissions only reach the "local" caches in other server
+#       processes when the "postgresql" notification bus is used.  Otherwise,
+#       the other processes may go on sending status updates to, and showing
+#       history to, a recipient whose permission has been revoked for up to
+#       PERMISSION_CACHE_TTL seconds.
+import_setting("LOCATION_SESSION_CACHE",        "local")
+import_setting("LOCATION_SESSION_CACHE_SIZE",   10000)
+import_setting("LOCATION_SESSION_CACHE_TTL",    30)
+# NOTE: LOCATION_SESSION_CACHE is the backend used to cache the global ID for
+#       each location session ID, including the session IDs which don't
+#       exist.  As with ACCESS_ID_CACHE, creating or deleting a session only
+#       reaches the "local" caches in other server processes when the
+#       "postgresql" notification bus is used.  Otherwise, the other processes
+#       may go on accepting a deleted session, or rejecting a new one, for up
+#       to LOCATION_SESSION_CACHE_TTL seconds.
+import_setting("FANOUT_ON_READ_THRESHOLD",      10000)
+# NOTE: FANOUT_ON_READ_THRESHOLD is the number of recipients at which a status
+#       update is no longer written out to each recipient's current status
+#       updates, but is instead found by the recipients when they read them.
+#       Set this to None to always write the status updates to each recipient.
+import_setting("STATUS_VERSION_CACHE",          "local")
+import_setting("STATUS_VERSION_CACHE_SIZE",     100000)
+import_setting("STATUS_VERSION_CACHE_TTL",      10)
+# NOTE: STATUS_VERSION_CACHE is the backend used to cache the version of each
+#       global ID's current status updates, used to calculate the ETag for
+#       the "<global_id>/status" endpoint.  When running multiple server
+#       processes, a "local" cache may return an out-of-date version for up to
+#       STATUS_VERSION_CACHE_TTL seconds; use the "django" backend with a
+#       shared Django cache to avoid this.
+import_setting("NOTIFICATION_BUS",              "local")
+# NOTE: NOTIFICATION_BUS is used to wake up requests waiting for new status
+#       updates.  This can be "local" (a single server process) or
+#       "postgresql" (multiple server processes sharing a PostgreSQL database).
+import_setting("MAX_STATUS_WAIT",               60)
+# NOTE: MAX_STATUS_WAIT is the maximum number of seconds a request to the
+#       "<global_id>/status" endpoint can wait for new status updates.
+#       Waiting requests tie up a server worker, so use threaded or
+#       asynchronous workers when clients use this feature.
+import_setting("LOCATION_QUEUE",                False)
+import_setting("LOCATION_QUEUE_BATCH_SIZE",     100)
+# NOTE: If LOCATION_QUEUE is True, the "/location" endpoint adds each batch of
+#       locations to a queue and returns straight away, leaving the
+#       "drain_location_queue" command to write them out.
+#       LOCATION_QUEUE_BATCH_SIZE is the number of queued batches written out
+#       using each transaction.
+import_setting("STREAM_KEEPALIVE",              15)
+import_setting("STREAM_DB_THREADS",             10)
+# NOTE: STREAM_KEEPALIVE is the number of seconds between the keep-alive
+#       comments sent to each idle client by the status update streaming
+#       gateway, and STREAM_DB_THREADS is the number of threads the gateway
+#       uses to access the database.
 
 #############################################################################
 
@@ -65,6 +189,10 @@ MIDDLEWARE_CLASSES = (
     # Enable CORS support.
 
     "statusAPI.middleware.cors.CORSMiddleware",
+
+    # Read and size-check the body of each request.
+
+    "statusAPI.middleware.body.RequestBodyMiddleware",
 )
 
 ROOT_URLCONF = 'statusAPI.urls'
@@ -114,4 +242,6 @@ else:
 # Configure the CORS middleware.
 
 CORS_ALLOWED_METHODS = "POST, GET, PUT, DELETE, OPTIONS"
-CORS_ALLOWED_HEADERS = "Content-Type, Authorization, Content-MD5, Nonce"
+CORS_ALLOWED_HEADERS = "Content-Type, Authorization, Content-MD5, Nonce, " \
+                     + "Timestamp, If-None-Match, Content-Encoding"
+CORS_EXPOSED_HEADERS = "ETag"
@@ -0,0 +1,286 @@
+""" statusAPI.shared.lib.bloomFilter
+
+    This module implements a rotating, time-bucketed Bloom filter.
+
+    A Bloom filter is a compact probabilistic set: asking whether a value is
+    in the set either answers "definitely not", or "possibly".  We use this to
+    quickly prove that a nonce value has never been seen before, so that the
+    nonce store doesn't have to check for it.
+
+    Because a Bloom filter can't have values removed from it, we split the
+    replay window into a number of time buckets, each with its own filter.
+    New values are added to the filter for the current bucket, and a value
+    is possibly present if any of the live buckets might contain it.  As time
+    passes, the oldest bucket falls outside the replay window and is thrown
+    away.
+
+    The filters' bit arrays can optionally be kept in files, which are mapped
+    into memory using mmap.  This allows the filters to survive a restart of
+    the server, and to be shared between the worker processes running on the
+    same machine.
+"""
+import hashlib
+import math
+import mmap
+import os
+import os.path
+import struct
+import threading
+import time
+
+#############################################################################
+
+class BloomFilter:
+    """ A single Bloom filter, backed by a bytearray or a memory-mapped file.
+    """
+    def __init__(self, num_bits, num_hashes, path=None):
+        """ Standard initialiser.
+
+            The parameters are as follows:
+
+                'num_bits'
+
+                    The number of bits in the filter's bit array.
+
+                'num_hashes'
+
+                    The number of bits to set for each value added to the
+                    filter.
+
+                'path'
+
+                    If given, this is the path to a file to store the filter's
+                    bit array in.  The file will be created if it doesn't
+                    exist, or reset if it isn't the expected size.  If 'path'
+                    is None, the bit array is only kept in memory.
+        """
+        self._num_bits   = num_bits
+        self._num_hashes = num_hashes
+        self._path       = path
+
+        num_bytes = (num_bits + 7) // 8
+
+        if path == None:
+            self._bits = bytearray(num_bytes)
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size != num_bytes:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, num_bytes)
+                self._bits = mmap.mmap(fd, num_bytes)
+            finally:
+                os.close(fd)
+
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate, path=None):
+        """ Create a Bloom filter sized for the given capacity.
+
+            'capacity' is the number of values we expect to add to the filter,
+            and 'error_rate' is the desired probability of a false positive
+            once that many values have been added.
+        """
+        num_bits   = int(math.ceil(-capacity * math.log(error_rate) /
+                                   (math.log(2) ** 2)))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        return cls(num_bits, num_hashes, path)
+
+
+    def add(self, value):
+        """ Add the given string value to the filter.
+        """
+        for bit in self._bit_positions(value):
+            self._bits[bit >> 3] |= (1 << (bit & 7))
+
+
+    def might_contain(self, value):
+        """ Return True if the given string value might be in the filter.
+
+            If we return False, the value has definitely never been added.
+        """
+        for bit in self._bit_positions(value):
+            if not self._bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+
+    def close(self):
+        """ Release the filter's bit array.
+        """
+        if isinstance(self._bits, mmap.mmap):
+            self._bits.close()
+
+
+    def delete(self):
+        """ Release the filter's bit array, and delete its file if it has one.
+        """
+        self.close()
+        if self._path != None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass # Already deleted by another process.
+
+    # =====================
+    # == PRIVATE METHODS ==
+    # =====================
+
+    def _bit_positions(self, value):
+        """ Return the positions of the bits used by the given string value.
+
+            We use double hashing to derive all the bit positions from a single
+            MD5 digest of the value.
+        """
+        digest = hashlib.md5(value.encode("utf-8")).digest()
+        h1,h2  = struct.unpack("<QQ", digest)
+        h2     = h2 | 1 # Ensure the step size is never zero.
+        return [(h1 + i * h2) % self._num_bits
+                for i in range(self._num_hashes)]
+
+#############################################################################
+
+class RotatingBloomFilter:
+    """ A set of time-bucketed Bloom filters covering a sliding time window.
+    """
+    def __init__(self, window, num_buckets, capacity, error_rate,
+                 directory=None):
+        """ Standard initialiser.
+
+            The parameters are as follows:
+
+                'window'
+
+                    The length of the sliding time window, as a
+                    datetime.timedelta object.  If this is None, the values
+                    are remembered forever, using a single Bloom filter.
+
+                'num_buckets'
+
+                    The number of time buckets to split the window into.
+
+                'capacity'
+
+                    The number of values we expect to add to each bucket.
+
+                'error_rate'
+
+                    The desired false-positive rate for each bucket.
+
+                'directory'
+
+                    If given, the directory to store the buckets' bit arrays
+                    in.  Otherwise, the bit arrays are only kept in memory.
+        """
+        if window == None:
+            self._bucket_seconds = None
+        else:
+            self._bucket_seconds = window.total_seconds() / num_buckets
+
+        self._num_buckets = num_buckets
+        self._capacity    = capacity
+        self._error_rate  = error_rate
+        self._directory   = directory
+        self._buckets     = {} # Maps bucket number to BloomFilter.
+        self._current     = None
+        self._lock        = threading.Lock()
+
+        if directory != None and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+
+    def add(self, value):
+        """ Add the given string value to the filter for the current bucket.
+        """
+        with self._lock:
+            current = self._rotate()
+            self._buckets[current].add(value)
+
+
+    def might_contain(self, value):
+        """ Return True if the given value might be in any live bucket.
+
+            If we return False, the value has definitely not been added within
+            the current time window.
+        """
+        with self._lock:
+            self._rotate()
+            for bucket in self._buckets.values():
+                if bucket.might_contain(value):
+                    return True
+            return False
+
+    # =====================
+    # == PRIVATE METHODS ==
+    # =====================
+
+    def _rotate(self):
+        """ Open the live buckets, and discard the expired ones.
+
+            Note that the caller must hold our lock.  We return the number of
+            the current bucket.
+        """
+        if self._bucket_seconds == None:
+            current = 0
+        else:
+            current = int(time.time() // self._bucket_seconds)
+
+        if current == self._current:
+            return current # Nothing has changed.
+
+        # We keep one more bucket than the window strictly needs, so that the
+        # oldest part of the window is still covered while the current bucket
+        # is only partly used.
+
+        live = range(current - self._num_buckets, current + 1)
+
+        for number in list(self._buckets.keys()):
+            if number not in live:
+                self._buckets.pop(number).delete()
+
+        if self._directory != None:
+            for number in self._saved_buckets():
+                if number not in live:
+                    try:
+                        os.remove(self._bucket_path(number))
+                    except OSError:
+                        pass # Already deleted by another process.
+                elif number not in self._buckets:
+                    self._buckets[number] = self._open_bucket(number)
+
+        if current not in self._buckets:
+            self._buckets[current] = self._open_bucket(current)
+
+        self._current = current
+        return current
+
+
+    def _saved_buckets(self):
+        """ Return the numbers of the buckets saved in our directory.
+        """
+        numbers = []
+        for name in os.listdir(self._directory):
+            if name.startswith("bucket-") and name.endswith(".bloom"):
+                try:
+                    numbers.append(int(name[len("bucket-"):-len(".bloom")]))
+                except ValueError:
+                    pass
+        return numbers
+
+
+    def _open_bucket(self, number):
+        """ Create or open the Bloom filter for the given bucket.
+        """
+        if self._directory == None:
+            path = None
+        else:
+            path = self._bucket_path(number)
+
+        return BloomFilter.for_capacity(self._capacity, self._error_rate,
+                                        path)
+
+
+    def _bucket_path(self, number):
+        """ Return the path to the file used to store the given bucket.
+        """
+        return os.path.join(self._directory, "bucket-{}.bloom".format(number))
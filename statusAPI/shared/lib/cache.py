@@ -0,0 +1,304 @@
+""" statusAPI.shared.lib.cache
+
+    This module implements the caches used to avoid repeating database
+    queries for information which rarely changes.
+
+    Each cache has a name, and is configured using the following settings,
+    where <NAME> is the cache's name in uppercase:
+
+        <NAME>_CACHE
+
+            The cache backend to use.  This can be one of:
+
+                "local"
+
+                    A size-bounded LRU cache within the current process.
+
+                "django"
+
+                    Django's cache framework, using the cache given by the
+                    CACHE_ALIAS setting.  This allows the cached values to be
+                    shared by all the worker processes, if the Django cache
+                    is set up to use a shared backend such as memcached.
+
+                "none"
+
+                    Don't cache anything.
+
+        <NAME>_CACHE_SIZE
+
+            The maximum number of entries to hold in a "local" cache.
+
+        <NAME>_CACHE_TTL
+
+            The number of seconds an entry remains valid for.
+
+    Use the get_cache() function to obtain the cache with a given name.  Each
+    cache object counts the number of cache hits and misses made by the
+    current process; call the cache's stats() method to retrieve these.
+
+    When a cached value is changed, call invalidate() to remove it.  As well
+    as removing the entry from this process's cache, this publishes a
+    notification with the key "cache:<name>" on the notification bus (see the
+    statusAPI.shared.lib.notificationBus module).  Every "local" cache clears
+    itself whenever it receives such a notification, so that, when the
+    "postgresql" notification bus is used, the change reaches every server
+    process rather than only the one which made it.
+"""
+import collections
+import threading
+import time
+
+from django.conf       import settings
+from django.core.cache import caches
+
+from statusAPI.shared.lib import notificationBus
+
+#############################################################################
+
+class LocalCache:
+    """ A size-bounded, time-limited LRU cache held in the current process.
+    """
+    def __init__(self, max_size, ttl):
+        """ Standard initialiser.
+
+            'max_size' is the maximum number of entries to keep, and 'ttl' is
+            the number of seconds each entry remains valid for.
+        """
+        self._entries  = collections.OrderedDict() # key -> (expiry, value).
+        self._max_size = max_size
+        self._ttl      = ttl
+        self._lock     = threading.Lock()
+        self._hits     = 0
+        self._misses   = 0
+
+
+    def get(self, key, default=None):
+        """ Return the cached value for the given key.
+
+            If there is no cached value, or it has expired, we return
+            'default'.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry != None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self._hits = self._hits + 1
+                return entry[1]
+
+            if entry != None:
+                del self._entries[key]
+            self._misses = self._misses + 1
+            return default
+
+
+    def set(self, key, value):
+        """ Store the given value into the cache.
+        """
+        with self._lock:
+            self._entries[key] = (time.time() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+
+    def delete(self, key):
+        """ Remove the given key from the cache, if it is present.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+    def clear(self):
+        """ Remove all the entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+    def stats(self):
+        """ Return a dictionary with statistics about this cache.
+        """
+        with self._lock:
+            return {'hits'   : self._hits,
+                    'misses' : self._misses,
+                    'size'   : len(self._entries)}
+
+#############################################################################
+
+class DjangoCache:
+    """ A cache which stores its entries using Django's cache framework.
+    """
+    def __init__(self, prefix, ttl, alias="default"):
+        """ Standard initialiser.
+
+            'prefix' is added to the start of each key, to keep the entries
+            for this cache separate from the other entries in the Django
+            cache.  'ttl' is the number of seconds each entry remains valid
+            for, and 'alias' is the name of the Django cache to use.
+        """
+        self._prefix = prefix
+        self._ttl    = ttl
+        self._alias  = alias
+        self._lock   = threading.Lock()
+        self._hits   = 0
+        self._misses = 0
+
+
+    def get(self, key, default=None):
+        """ Return the cached value for the given key.
+
+            If there is no cached value, or it has expired, we return
+            'default'.
+        """
+        value = caches[self._alias].get(self._key(key), _MISSING)
+        with self._lock:
+            if value is _MISSING:
+                self._misses = self._misses + 1
+                return default
+            else:
+                self._hits = self._hits + 1
+                return value
+
+
+    def set(self, key, value):
+        """ Store the given value into the cache.
+        """
+        caches[self._alias].set(self._key(key), value, self._ttl)
+
+
+    def delete(self, key):
+        """ Remove the given key from the cache, if it is present.
+        """
+        caches[self._alias].delete(self._key(key))
+
+
+    def clear(self):
+        """ Remove all the entries from the cache.
+
+            Note that this clears the entire Django cache, not just the
+            entries with our prefix.
+        """
+        caches[self._alias].clear()
+
+
+    def stats(self):
+        """ Return a dictionary with statistics about this cache.
+
+            Note that the size of a shared cache is not known, so we only
+            return the number of hits and misses made by this process.
+        """
+        with self._lock:
+            return {'hits'   : self._hits,
+                    'misses' : self._misses}
+
+    # =====================
+    # == PRIVATE METHODS ==
+    # =====================
+
+    def _key(self, key):
+        """ Return the Django cache key to use for the given key.
+        """
+        return self._prefix + ":" + str(key)
+
+#############################################################################
+
+class NullCache:
+    """ A cache which never caches anything.
+    """
+    def get(self, key, default=None):
+        """ Return 'default', as nothing is ever cached.
+        """
+        return default
+
+
+    def set(self, key, value):
+        """ Ignore the given value.
+        """
+        pass
+
+
+    def delete(self, key):
+        """ Do nothing, as nothing is ever cached.
+        """
+        pass
+
+
+    def clear(self):
+        """ Do nothing, as nothing is ever cached.
+        """
+        pass
+
+
+    def stats(self):
+        """ Return an empty dictionary, as we don't keep any statistics.
+        """
+        return {}
+
+#############################################################################
+
+_MISSING = object() # Marker for a missing cache entry.
+
+_caches     = {} # Maps cache name to cache object.
+_cache_lock = threading.Lock()
+
+def get_cache(name):
+    """ Return the cache with the given name.
+
+        The cache is created, based upon our settings, the first time this
+        function is called with the given name, and then re-used for the
+        lifetime of the process.
+    """
+    cache = _caches.get(name)
+    if cache == None:
+        with _cache_lock:
+            cache = _caches.get(name)
+            if cache == None:
+                cache = _create_cache(name)
+                _caches[name] = cache
+    return cache
+
+#############################################################################
+
+def invalidate(name, *keys):
+    """ Remove the given keys from the cache with the given name.
+
+        The entries are removed from this process's cache straight away.  We
+        then ask every server process to clear its own copy of the cache, in
+        case it is holding an old value.  Note that, if this is called within
+        a transaction, the other processes are only told once the transaction
+        has been committed.
+    """
+    cache = get_cache(name)
+    for key in keys:
+        cache.delete(key)
+    if isinstance(cache, LocalCache):
+        notificationBus.get_bus().publish([_notification_key(name)])
+
+#############################################################################
+
+def _create_cache(name):
+    """ Create and return a new cache object based on our settings.
+    """
+    setting = name.upper() + "_CACHE"
+    backend = getattr(settings, setting)
+    ttl     = getattr(settings, setting + "_TTL")
+
+    if backend == "local":
+        cache = LocalCache(getattr(settings, setting + "_SIZE"), ttl)
+        notificationBus.get_bus().subscribe([_notification_key(name)],
+                                            cache.clear)
+        return cache
+    elif backend == "django":
+        return DjangoCache(name, ttl, settings.CACHE_ALIAS)
+    elif backend == "none":
+        return NullCache()
+    else:
+        raise RuntimeError("Unknown " + setting + ": " + repr(backend))
+
+#############################################################################
+
+def _notification_key(name):
+    """ Return the notification key used to invalidate the given cache.
+    """
+    return "cache:" + name
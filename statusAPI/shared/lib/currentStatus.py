@@ -0,0 +1,194 @@
+""" statusAPI.shared.lib.currentStatus
+
+    This module implements the logic for retrieving the current status
+    updates visible to a global ID.
+
+    A global ID's current status updates are made up of the
+    CurrentStatusUpdateView records written for that global ID by the
+    fan-out, plus the LatestStatusUpdate records for any issuers whose status
+    updates were fanned out on read (see the statusAPI.shared.lib.fanout
+    module).  This is used by both the "<global_id>/status" endpoint and the
+    status update streaming gateway.
+"""
+from statusAPI.shared.models import *
+from statusAPI.shared.lib    import fanout, utils
+
+#############################################################################
+
+def find_updates(global_id_rec, own=False, issuer=None, status_type=None,
+                 since=None):
+    """ Return the current status updates matching the given parameters.
+
+        The parameters are as follows:
+
+            'global_id_rec'
+
+                The GlobalID record for the global ID whose current status
+                updates we want to retrieve.
+
+            'own'
+
+                If True, we return the status updates issued by this global
+                ID, rather than the status updates it can view.
+
+            'issuer'
+
+                If given, only return the status updates issued by this
+                global ID, as a string.
+
+            'status_type'
+
+                If given, only return status updates of this type, as a
+                string.
+
+            'since'
+
+                If given, only return status updates with a timestamp later
+                than this datetime.
+
+        We return a list of (status_update_id, timestamp, json) tuples, one
+        for each matching status update, where 'status_update_id' is the
+        record ID of the StatusUpdate, 'timestamp' is its timestamp in UTC,
+        and 'json' is the status update's JSON representation, as a string.
+        Note that the values are retrieved directly, rather than creating
+        model objects and following their foreign keys.
+    """
+    # Build the database query to retrieve the desired set of
+    # CurrentStatusUpdateView records.
+
+    query = CurrentStatusUpdateView.objects.all()
+
+    if own:
+        query = query.filter(issuing_global_id=global_id_rec)
+    else:
+        query = query.filter(recipient_global_id=global_id_rec)
+
+    if issuer != None:
+        query = query.filter(issuing_global_id__global_id=issuer)
+
+    if status_type != None:
+        query = query.filter(type__type=status_type)
+
+    if since != None:
+        query = query.filter(timestamp__gt=since)
+
+    # Build a second query to retrieve the latest status updates from issuers
+    # whose audience was too large to write a CurrentStatusUpdateView record
+    # for each recipient.
+
+    if own:
+        unfanned_query = LatestStatusUpdate.objects.filter(
+                                            fanned_out=False,
+                                            global_id=global_id_rec)
+    else:
+        unfanned_query = fanout.find_unfanned_updates(global_id_rec)
+
+    if issuer != None:
+        unfanned_query = unfanned_query.filter(global_id__global_id=issuer)
+
+    if status_type != None:
+        unfanned_query = unfanned_query.filter(type__type=status_type)
+
+    if since != None:
+        unfanned_query = unfanned_query.filter(timestamp__gt=since)
+
+    # Collect the (status_update_id, json_fragment, issuer, type, timestamp,
+    # tz_offset, contents) values for each status update which matches our
+    # database queries.
+
+    fields = ["timestamp", "tz_offset", "contents"]
+
+    matches = list(query.values_list("status_update", "json_fragment",
+                                     "issuing_global_id__global_id",
+                                     "type__type", *fields))
+
+    for match in unfanned_query.values_list("status_update", "json_fragment",
+                                            "global_id__global_id",
+                                            "type__type", *fields):
+        if not own:
+            if not fanout.can_view_unfanned_update(global_id_rec,
+                                                   match[2], match[3]):
+                continue
+        matches.append(match)
+
+    # Assemble the list of status updates.  Each status update is normally
+    # stored with its JSON representation, so we only need to serialize the
+    # status updates without one.
+
+    updates = []
+    for (status_update_id, fragment, update_issuer, update_type, timestamp,
+         tz_offset, contents) in matches:
+        fragment = _fragment(fragment, update_issuer, update_type, timestamp,
+                             tz_offset, contents)
+        updates.append((status_update_id, timestamp, fragment))
+
+    return updates
+
+#############################################################################
+
+def find_stream_updates(global_id_rec, after_sequence=None):
+    """ Return the current status updates to send to a streaming client.
+
+        'global_id_rec' is the GlobalID record for the global ID receiving the
+        stream, and 'after_sequence', if given, is the sequence number of the
+        last CurrentStatusUpdateView which was sent to the client.
+
+        We return a (views, unfanned) tuple, where 'views' is a list of
+        (sequence, json) tuples for the global ID's CurrentStatusUpdateView
+        records with a sequence number greater than 'after_sequence', in
+        order of sequence number, and 'unfanned' is a list of (issuer, type,
+        status_update_id, json) tuples for every status update which was
+        fanned out on read and which the global ID can currently view.
+
+        Note that the views are selected by sequence number rather than by
+        StatusUpdate record ID, as the sequence numbers for each recipient are
+        assigned in the order the views were committed.  The status updates
+        which were fanned out on read have no sequence number, so all of them
+        are returned each time and the caller has to check for changes.
+    """
+    fields = ["timestamp", "tz_offset", "contents"]
+
+    query = CurrentStatusUpdateView.objects.filter(
+                                        recipient_global_id=global_id_rec)
+    if after_sequence != None:
+        query = query.filter(sequence__gt=after_sequence)
+
+    views = []
+    for (sequence, fragment, update_issuer, update_type, timestamp,
+         tz_offset, contents) in query.order_by("sequence").values_list(
+                                        "sequence", "json_fragment",
+                                        "issuing_global_id__global_id",
+                                        "type__type", *fields):
+        views.append((sequence,
+                      _fragment(fragment, update_issuer, update_type,
+                                timestamp, tz_offset, contents)))
+
+    unfanned_query = fanout.find_unfanned_updates(global_id_rec)
+
+    unfanned = []
+    for (status_update_id, fragment, update_issuer, update_type, timestamp,
+         tz_offset, contents) in unfanned_query.values_list(
+                                        "status_update", "json_fragment",
+                                        "global_id__global_id",
+                                        "type__type", *fields):
+        if fanout.can_view_unfanned_update(global_id_rec, update_issuer,
+                                           update_type):
+            unfanned.append((update_issuer, update_type, status_update_id,
+                             _fragment(fragment, update_issuer, update_type,
+                                       timestamp, tz_offset, contents)))
+
+    return (views, unfanned)
+
+#############################################################################
+
+def _fragment(fragment, issuer, status_type, timestamp, tz_offset, contents):
+    """ Return the JSON representation of a status update.
+
+        Each status update is normally stored with its JSON representation,
+        as 'fragment', so we only need to serialize the status updates
+        without one.
+    """
+    if fragment == "":
+        fragment = utils.status_update_to_json(issuer, status_type, timestamp,
+                                               tz_offset, contents)
+    return fragment
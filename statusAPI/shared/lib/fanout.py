@@ -0,0 +1,378 @@
+""" statusAPI.shared.lib.fanout
+
+    This module implements the "fan-out" of a newly-posted status update to
+    the global IDs which are allowed to see it.
+
+    For each status update, the issuer's CURRENT permissions are used to find
+    the recipients who can view the update (using the issuer's compiled
+    PermissionMatcher), and a CurrentStatusUpdateView
+    record is written for each of these recipients, replacing the recipient's
+    existing view of that issuer's status updates of the same type.
+
+    Rather than processing each recipient in turn, the recipients are found
+    using a single lookup, and the views are all written using a
+    bulk "upsert" within a single transaction.  This relies on the unique
+    constraint on the issuer, recipient and type of each view.
+
+    Writing a view for every recipient makes each status update cost
+    O(recipients) database work.  For issuers whose audience for a given type
+    of status update reaches the FANOUT_ON_READ_THRESHOLD setting, we instead
+    "fan out on read": no views are written, and the recipients see the
+    update by joining their inbound permissions against the
+    LatestStatusUpdate table when they read their current status updates
+    (see find_unfanned_updates(), below).  The LatestStatusUpdate record for
+    each issuer and type is always kept up to date, and its 'fanned_out'
+    field records which of the two strategies was used.
+"""
+import sqlite3
+
+from django.conf      import settings
+from django.db        import connection, transaction
+from django.db.models import F
+
+from statusAPI.shared.models import *
+from statusAPI.shared.lib    import (notificationBus, permissionMatcher,
+                                     statusVersion)
+
+#############################################################################
+
+UPSERT_BATCH_SIZE = 100 # Maximum number of views to write in one statement.
+
+#############################################################################
+
+def fan_out(update):
+    """ Write the CurrentStatusUpdateView records for a status update.
+
+        'update' should be a StatusUpdate object which has been saved to the
+        database.  We record the update as the issuer's latest status update
+        of its type, and then create or replace a CurrentStatusUpdateView
+        record for each global ID which is allowed to view this update.  If
+        the number of recipients reaches our FANOUT_ON_READ_THRESHOLD, we
+        remove the issuer's existing views instead, and leave the recipients
+        to find the update when they read their current status updates.  The
+        StatusVersion records for the issuer and the recipients whose views
+        were written are then incremented, and each view's sequence number is
+        set to its recipient's new version.
+
+        Upon completion, we return a list of the IDs of the GlobalID records
+        for the recipients whose views were written, or None if the status
+        update was fanned out on read.  Once the caller's transaction has been
+        committed, this should be passed to publish().
+    """
+    recipient_ids = find_recipients(update.global_id.global_id,
+                                    update.type.type)
+
+    threshold  = settings.FANOUT_ON_READ_THRESHOLD
+    fanned_out = (threshold == None or len(recipient_ids) < threshold)
+
+    with transaction.atomic():
+        upsert_latest(update, fanned_out)
+        if fanned_out:
+            upsert_views(update, recipient_ids)
+            record_versions(set(recipient_ids) | set([update.global_id_id]))
+            _stamp_sequences(update)
+        else:
+            CurrentStatusUpdateView.objects.filter(
+                            issuing_global_id_id=update.global_id_id,
+                            type_id=update.type_id).delete()
+            record_versions([update.global_id_id])
+
+    if fanned_out:
+        return recipient_ids
+    else:
+        return None
+
+#############################################################################
+
+def publish(update, recipient_ids):
+    """ Publish the results of a fan-out once it has been committed.
+
+        'update' is the StatusUpdate which was fanned out, and
+        'recipient_ids' is the value returned by fan_out().  We update the
+        cached status versions so that polling clients see the new update,
+        and then publish a notification to wake up any requests waiting for
+        the update.
+    """
+    if recipient_ids == None:
+        statusVersion.publish_versions([update.global_id_id],
+                                       generation=update.id)
+        keys = ["generation", update.global_id_id]
+    else:
+        keys = set(recipient_ids) | set([update.global_id_id])
+        statusVersion.publish_versions(keys)
+
+    notificationBus.get_bus().publish(keys)
+
+#############################################################################
+
+def permission_changed(issuer, recipient_id):
+    """ Respond to a change in one of an issuer's CURRENT permissions.
+
+        'issuer' is the GlobalID record for the issuer, and 'recipient_id' is
+        the record ID of the GlobalID the permission applies to.  This
+        should be called once the permission change has been committed.
+
+        Views which have already been written aren't affected by permission
+        changes, but the issuer's status updates which were fanned out on read
+        are checked against the recipient's permissions whenever they are
+        read.  If there are any of these, the recipient's current status
+        updates may have changed, so we increment the recipient's version and
+        wake up any requests waiting for the recipient's status updates.
+    """
+    if not LatestStatusUpdate.objects.filter(global_id=issuer,
+                                             fanned_out=False).exists():
+        return
+
+    with transaction.atomic():
+        record_versions([recipient_id])
+
+    statusVersion.publish_versions([recipient_id])
+    notificationBus.get_bus().publish([recipient_id])
+
+#############################################################################
+
+def find_recipients(global_id, status_type):
+    """ Return the recipients who can currently see the given type of status.
+
+        'global_id' is the issuer's global ID, as a string, and 'status_type'
+        is the type of status update, also as a string.  We return a sorted
+        list of record IDs for the GlobalIDs of the recipients.
+    """
+    matcher = permissionMatcher.get_matcher(global_id,
+                                            Permission.ACCESS_TYPE_CURRENT)
+    return sorted(matcher.recipients(status_type))
+
+#############################################################################
+
+def upsert_latest(update, fanned_out):
+    """ Record the given status update as the issuer's latest of its type.
+
+        'update' is the StatusUpdate object, and 'fanned_out' indicates
+        whether CurrentStatusUpdateView records are being written for this
+        update.  We create or replace the LatestStatusUpdate record for the
+        update's issuer and type.
+    """
+    if _supports_upsert():
+        _upsert_rows(LatestStatusUpdate,
+                     ["global_id", "type"],
+                     ["status_update", "timestamp", "tz_offset", "contents",
+                      "json_fragment", "fanned_out"],
+                     [[update.global_id_id, update.type_id, update.id,
+                       update.timestamp, update.tz_offset, update.contents,
+                       update.json_fragment, fanned_out]])
+    else:
+        LatestStatusUpdate.objects.update_or_create(
+                        global_id_id=update.global_id_id,
+                        type_id=update.type_id,
+                        defaults={'status_update_id' : update.id,
+                                  'timestamp'        : update.timestamp,
+                                  'tz_offset'        : update.tz_offset,
+                                  'contents'         : update.contents,
+                                  'json_fragment'    : update.json_fragment,
+                                  'fanned_out'       : fanned_out})
+
+#############################################################################
+
+def upsert_views(update, recipient_ids):
+    """ Create or replace the views of a status update for the given recipients.
+
+        'update' is the StatusUpdate object, and 'recipient_ids' is a list of
+        GlobalID record IDs for the recipients who can view this update.
+
+        Where the database supports "INSERT ... ON CONFLICT", we use this to
+        write the views in batches of UPSERT_BATCH_SIZE records.  Otherwise,
+        we delete the recipients' existing views and then bulk-insert the new
+        ones.  Either way, the caller should wrap this in a transaction.
+    """
+    if len(recipient_ids) == 0:
+        return
+
+    if _supports_upsert():
+        for i in range(0, len(recipient_ids), UPSERT_BATCH_SIZE):
+            _upsert_rows(CurrentStatusUpdateView,
+                         ["issuing_global_id", "recipient_global_id", "type"],
+                         ["status_update", "timestamp", "tz_offset",
+                          "contents", "json_fragment", "sequence"],
+                         [[update.global_id_id, recipient_id, update.type_id,
+                           update.id, update.timestamp, update.tz_offset,
+                           update.contents, update.json_fragment, 0]
+                          for recipient_id
+                          in recipient_ids[i:i+UPSERT_BATCH_SIZE]])
+    else:
+        CurrentStatusUpdateView.objects.filter(
+                        issuing_global_id_id=update.global_id_id,
+                        recipient_global_id_id__in=recipient_ids,
+                        type_id=update.type_id).delete()
+
+        CurrentStatusUpdateView.objects.bulk_create(
+            [_make_view(update, recipient_id)
+             for recipient_id in recipient_ids],
+            batch_size=UPSERT_BATCH_SIZE)
+
+#############################################################################
+
+def record_versions(global_id_ids):
+    """ Increment the StatusVersion for each of the given global IDs.
+
+        'global_id_ids' is a collection of GlobalID record IDs whose current
+        status updates have changed.  Global IDs without a StatusVersion
+        record are given one, starting at version 1.  The records are updated
+        in order of global ID, so that concurrent fan-outs can't deadlock, and
+        this should be called within the fan-out's transaction.
+    """
+    global_id_ids = sorted(global_id_ids)
+
+    if _supports_upsert():
+        for i in range(0, len(global_id_ids), UPSERT_BATCH_SIZE):
+            _upsert_rows(StatusVersion, ["global_id"], ["version"],
+                         [[global_id_id, 1] for global_id_id
+                          in global_id_ids[i:i+UPSERT_BATCH_SIZE]],
+                         increment=True)
+    else:
+        StatusVersion.objects.filter(global_id_id__in=global_id_ids) \
+                             .update(version=F("version") + 1)
+
+        existing = set(StatusVersion.objects.filter(
+                                        global_id_id__in=global_id_ids)
+                                    .values_list("global_id_id", flat=True))
+
+        StatusVersion.objects.bulk_create(
+            [StatusVersion(global_id_id=global_id_id, version=1)
+             for global_id_id in global_id_ids
+             if global_id_id not in existing],
+            batch_size=UPSERT_BATCH_SIZE)
+
+#############################################################################
+
+def find_unfanned_updates(recipient):
+    """ Return the latest status updates which weren't fanned out to a viewer.
+
+        'recipient' is the GlobalID record for the global ID reading their
+        current status updates.  We return a LatestStatusUpdate queryset
+        containing the updates which were not written as
+        CurrentStatusUpdateView records, and which were issued by a global ID
+        that has given the recipient a CURRENT permission.  Note that the
+        permission's status type isn't checked by this query; use
+        can_view_unfanned_update() to check each of the returned updates.
+    """
+    issuer_ids = Permission.objects.filter(
+                            recipient_global_id=recipient,
+                            access_type=Permission.ACCESS_TYPE_CURRENT) \
+                    .values("issuing_global_id")
+
+    return LatestStatusUpdate.objects.filter(fanned_out=False,
+                                             global_id__in=issuer_ids)
+
+#############################################################################
+
+def can_view_unfanned_update(recipient, issuer, status_type):
+    """ Return True if a recipient can view an issuer's latest status update.
+
+        'recipient' is the GlobalID record for the global ID reading their
+        current status updates, 'issuer' is the global ID which issued the
+        status update, as a string, and 'status_type' is the type of status
+        update, also as a string.
+    """
+    matcher = permissionMatcher.get_matcher(issuer,
+                                            Permission.ACCESS_TYPE_CURRENT)
+    return recipient.id in matcher.recipients(status_type)
+
+#############################################################################
+
+def _supports_upsert():
+    """ Return True if our database supports "INSERT ... ON CONFLICT".
+    """
+    if connection.vendor == "postgresql":
+        return connection.pg_version >= 90500
+    elif connection.vendor == "sqlite":
+        return sqlite3.sqlite_version_info >= (3, 24, 0)
+    else:
+        return False
+
+#############################################################################
+
+def _make_view(update, recipient_id):
+    """ Return a new (unsaved) CurrentStatusUpdateView for the given update.
+    """
+    view = CurrentStatusUpdateView()
+    view.issuing_global_id_id   = update.global_id_id
+    view.recipient_global_id_id = recipient_id
+    view.status_update_id       = update.id
+    view.type_id                = update.type_id
+    view.timestamp              = update.timestamp
+    view.tz_offset              = update.tz_offset
+    view.contents               = update.contents
+    view.json_fragment          = update.json_fragment
+    return view
+
+#############################################################################
+
+def _stamp_sequences(update):
+    """ Set the sequence number of each view of the given status update.
+
+        Each CurrentStatusUpdateView written for 'update' has its sequence
+        number set to its recipient's current StatusVersion.  This must be
+        called within the fan-out's transaction, after record_versions() has
+        locked and incremented the recipients' versions.
+    """
+    qn       = connection.ops.quote_name
+    views    = CurrentStatusUpdateView._meta
+    versions = StatusVersion._meta
+
+    views_table    = qn(views.db_table)
+    versions_table = qn(versions.db_table)
+
+    sql = ("UPDATE " + views_table + " SET " +
+           qn(views.get_field("sequence").column) + " = " +
+           "(SELECT " + qn(versions.get_field("version").column) +
+           " FROM " + versions_table + " WHERE " +
+           versions_table + "." + qn(versions.get_field("global_id").column) +
+           " = " + views_table + "." +
+           qn(views.get_field("recipient_global_id").column) + ") " +
+           "WHERE " + qn(views.get_field("status_update").column) + " = %s")
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [update.id])
+
+#############################################################################
+
+def _upsert_rows(model, key_fields, value_fields, rows, increment=False):
+    """ Insert or update a batch of rows using "INSERT ... ON CONFLICT".
+
+        'model' is the Django model to write to, 'key_fields' is a list of the
+        names of the fields making up the model's unique key, 'value_fields'
+        is a list of the other fields to write, and 'rows' is a list of rows,
+        where each row is a list of field values in the order given by
+        'key_fields' followed by 'value_fields'.  For foreign keys, the value
+        should be the ID of the related record.
+
+        If 'increment' is True, the values are added to an existing row's
+        values rather than replacing them.
+    """
+    meta   = model._meta
+    qn     = connection.ops.quote_name
+    table  = qn(meta.db_table)
+    fields = [meta.get_field(name) for name in key_fields + value_fields]
+
+    key_columns   = [qn(field.column) for field in fields[:len(key_fields)]]
+    value_columns = [qn(field.column) for field in fields[len(key_fields):]]
+    columns       = key_columns + value_columns
+
+    placeholders = []
+    params       = []
+    for row in rows:
+        placeholders.append("(" + ", ".join(["%s"] * len(columns)) + ")")
+        for field,value in zip(fields, row):
+            # Convert the field values into the form the database expects.
+            params.append(field.get_db_prep_value(value, connection))
+
+    sql = ("INSERT INTO " + table + " (" + ", ".join(columns) + ") " +
+           "VALUES " + ", ".join(placeholders) + " " +
+           "ON CONFLICT (" + ", ".join(key_columns) + ") DO UPDATE SET " +
+           ", ".join([column + " = " +
+                      (table + "." + column + " + " if increment else "") +
+                      "EXCLUDED." + column
+                      for column in value_columns]))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
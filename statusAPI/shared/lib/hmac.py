@@ -2,18 +2,46 @@
 
     This module define various utility functions for working with HMAC
     authentication.
+
+    Two versions of the HMAC signing scheme are supported:
+
+        Version 1
+
+            The "Authorization" header has the form "HMAC <digest>", where the
+            digest is calculated from the HTTP method, the URL, the Content-MD5
+            value, the nonce and the access secret.  Because the request isn't
+            timestamped, the nonce values must be remembered for a long time
+            to prevent the request from being replayed.
+
+        Version 2
+
+            The "Authorization" header has the form "HMAC2 <digest>", and the
+            request includes a "Timestamp" header holding the time at which the
+            request was made, in RFC-3339 format.  The timestamp is included in
+            the digest, and requests whose timestamp is more than
+            settings.HMAC_MAX_CLOCK_SKEW seconds away from the server's clock
+            are rejected.  This means the nonce values only need to be
+            remembered for a few minutes.
+
+    Version 1 requests are accepted for as long as settings.HMAC_ACCEPT_V1 is
+    True, so that existing clients can be migrated to version 2.
 """
 import base64
+import functools
 import hashlib
+import time
 import uuid
 
+from django.conf  import settings
+from django.http  import (HttpResponse, HttpResponseBadRequest,
+                          HttpResponseForbidden)
 from django.utils import timezone
 
-from statusAPI.shared.models import *
+from statusAPI.shared.lib import nonceStore, utils
 
 #############################################################################
 
-def calc_hmac_headers(method, url, body, access_secret):
+def calc_hmac_headers(method, url, body, access_secret, version=2):
     """ Return the HTTP headers to use for an HMAC-authenticated request.
 
         The parameters are as follows:
@@ -29,26 +57,43 @@ def calc_hmac_headers(method, url, body, access_secret):
 
             'body'
 
-                The body of the HTTP request, as a string.
+                The body of the HTTP request, as a string or as bytes.  If the
+                body is to be sent compressed using a "Content-Encoding"
+                header, this must be the compressed body as bytes (see
+                utils.compress_body()), as the Content-MD5 value covers the
+                body exactly as it is sent.
 
             'access_secret'
 
                 The access secret for the user we are making an authenticated
                 request for.
 
+            'version'
+
+                The version of the HMAC signing scheme to use.
+
         We calculate the HMAC authentication headers to use for making an
         authenticated request to the server.  The headers are returned in the
         form of a dictionary mapping header fields to values.
     """
     nonce       = uuid.uuid4().hex
-    content_md5 = hashlib.md5(body.encode("utf-8")).hexdigest()
-    parts       = [method, url, content_md5, nonce, access_secret]
-    hmac_digest = hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
-    hmac_base64 = base64.b64encode(hmac_digest.encode("utf-8"))
-
-    return {'Authorization' : "HMAC " + hmac_base64.decode("utf-8"),
-            'Content_MD5'   : content_md5,
-            'Nonce'         : nonce}
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    content_md5 = hashlib.md5(body).hexdigest()
+
+    if version == 1:
+        parts = [method, url, content_md5, nonce, access_secret]
+        return {'Authorization' : "HMAC " + _calc_digest(parts),
+                'Content_MD5'   : content_md5,
+                'Nonce'         : nonce}
+    else:
+        timestamp = utils.current_utc_timestamp()
+        parts = [method, url, content_md5, nonce, timestamp, access_secret]
+        return {'Authorization' : "HMAC2 " + _calc_digest(parts),
+                'Content_MD5'   : content_md5,
+                'Nonce'         : nonce,
+                'Timestamp'     : timestamp}
 
 #############################################################################
 
@@ -76,15 +121,90 @@ def normalize_request_headers(request):
 def has_hmac_headers(request):
     """ Return True if the given request includes HMAC-authentication headers.
     """
-    headers = normalize_request_headers(request)
-    if "AUTHORIZATION" not in headers: return False
-    if "CONTENT_MD5"   not in headers: return False
-    if "NONCE"         not in headers: return False
+    if get_hmac_header(request, "AUTHORIZATION") == None: return False
+    if get_hmac_header(request, "CONTENT_MD5")   == None: return False
+    if get_hmac_header(request, "NONCE")         == None: return False
     return True
 
 #############################################################################
 
-def check_hmac_authentication(request, access_secret):
+def get_hmac_header(request, header):
+    """ Return the value of one of the HMAC-authentication headers.
+
+        'header' is the normalized name of the desired header, for example
+        "CONTENT_MD5".  Rather than normalizing every request header, as
+        normalize_request_headers() does, we look for the header under the
+        names it might have while running the live system or while unit
+        testing.  If the header isn't present, we return None.
+    """
+    value = request.META.get("HTTP_" + header)
+    if value == None:
+        value = request.META.get(header)
+    if value == None and header in _HEADER_NAMES:
+        value = request.META.get(_HEADER_NAMES[header])
+    return value
+
+#############################################################################
+
+def hmac_authenticated(view):
+    """ Decorator for a view function which requires HMAC authentication.
+
+        The decorated view function must accept a 'global_id' parameter.  We
+        look up the access ID for that global ID and check the request's HMAC
+        authentication, returning an HTTP 403 (Forbidden) response if this
+        fails.  Otherwise, the following attributes are added to the request
+        before the view function is called:
+
+            'access_id'
+
+                The AccessID object for the authenticated global ID.
+
+            'global_id_rec'
+
+                The GlobalID object for the authenticated global ID.
+
+            'auth_timings'
+
+                A dictionary mapping each stage of the authentication process
+                ("credentials", "content_md5", "signature" and "nonce") to the
+                number of seconds that stage took.
+    """
+    @functools.wraps(view)
+    def wrapper(request, global_id, *args, **kwargs):
+        timings = {}
+
+        start     = time.time()
+        access_id = utils.get_access_id(global_id)
+        timings['credentials'] = time.time() - start
+
+        if access_id == None:
+            return HttpResponseForbidden()
+
+        try:
+            authenticated = check_hmac_authentication(request,
+                                                      access_id.access_secret,
+                                                      timings)
+        except utils.RequestBodyTooLarge:
+            return HttpResponse(status=413) # Request entity too large.
+        except utils.UnsupportedContentEncoding:
+            return HttpResponse(status=415) # Unsupported media type.
+        except utils.InvalidRequestBody:
+            return HttpResponseBadRequest("Invalid compressed body")
+
+        if not authenticated:
+            return HttpResponseForbidden()
+
+        request.access_id     = access_id
+        request.global_id_rec = access_id.global_id
+        request.auth_timings  = timings
+
+        return view(request, global_id, *args, **kwargs)
+
+    return wrapper
+
+#############################################################################
+
+def check_hmac_authentication(request, access_secret, timings=None):
     """ Return True if the given request's HMAC-authentication is correct.
 
         The parameters are as follows:
@@ -99,60 +219,136 @@ def check_hmac_authentication(request, access_secret):
                 The access secret that should have been used to calculate the
                 HMAC authentication headers.
 
+            'timings'
+
+                If given, this should be a dictionary.  The number of seconds
+                taken by each stage of the authentication process will be
+                stored into this dictionary.
+
         If the given request's HMAC-authentication headers are correct for the
         given access secret, we return True.
-    """
-    headers = normalize_request_headers(request)
-
-    NonceValue.objects.purge()
 
-    http_method      = request.method
-    url              = request.path
+        Note that the request's body is read using utils.read_request_body(),
+        which will raise a utils.RequestBodyTooLarge exception if the body is
+        too large, or one of the other exceptions described there if a
+        compressed body can't be decompressed.
+    """
+    if timings == None:
+        timings = {}
 
-    hmac_auth_string = headers.get("AUTHORIZATION")
-    content_md5      = headers.get("CONTENT_MD5")
-    nonce            = headers.get("NONCE")
+    hmac_auth_string = get_hmac_header(request, "AUTHORIZATION")
+    content_md5      = get_hmac_header(request, "CONTENT_MD5")
+    nonce            = get_hmac_header(request, "NONCE")
 
     if hmac_auth_string == None or content_md5 == None or nonce == None:
 #        print("HMAC auth failed due to missing HTTP headers.")
         return False
 
-    if content_md5 != hashlib.md5(request.body).hexdigest():
+    start = time.time()
+    body_md5 = utils.read_request_body(request)
+    timings['content_md5'] = time.time() - start
+
+    if content_md5 != body_md5:
 #        print("HMAC auth failed due to incorrect Content-MD5 value.")
         return False
 
+    # Calculate the HMAC-authentication digest, and check that it mathes the
+    # digest value from the header.  The digest depends on which version of
+    # the signing scheme the client used.
+
+    start = time.time()
+
+    if hmac_auth_string.startswith("HMAC2 "):
+        timestamp = get_hmac_header(request, "TIMESTAMP")
+        if timestamp == None:
+#            print("HMAC auth failed due to missing timestamp.")
+            return False
+
+        if not _is_timestamp_current(timestamp):
+#            print("HMAC auth failed because timestamp is out of range.")
+            return False
+
+        parts    = [request.method, request.path, content_md5,
+                    nonce, timestamp, access_secret]
+        expected = "HMAC2 " + _calc_digest(parts)
+    elif settings.HMAC_ACCEPT_V1:
+        parts    = [request.method, request.path, content_md5,
+                    nonce, access_secret]
+        expected = "HMAC " + _calc_digest(parts)
+    else:
+#        print("HMAC auth failed because version 1 is no longer accepted.")
+        return False
+
+    timings['signature'] = time.time() - start
+
+    if hmac_auth_string != expected:
+#        print("HMAC auth failed because authorization hash doesn't match.")
+        return False
+
     # Check that the nonce value hasn't already been used, and remember it for
-    # later.
+    # later.  Note that we do this after checking the digest, so that requests
+    # with an invalid signature don't cause any writes to the nonce store.  If
+    # we have a nonce filter, we use it to find out if the nonce is definitely
+    # new; the nonce store can then skip its own check for a reused nonce.
 
-    NonceValue.objects.purge()
+    start = time.time()
 
-    try:
-        existing_nonce = NonceValue.objects.get(nonce=nonce)
-    except NonceValue.DoesNotExist:
-        existing_nonce = None
+    nonce_filter = nonceStore.get_nonce_filter()
+    if nonce_filter != None:
+        known_new = not nonce_filter.might_contain(nonce)
+    else:
+        known_new = False
 
-    if existing_nonce != None:
+    if not nonceStore.get_nonce_store().add(nonce, known_new):
 #        print("HMAC auth failed because nonce value was reused.")
         return False
 
-    nonce_value = NonceValue()
-    nonce_value.nonce     = nonce
-    nonce_value.timestamp = timezone.now()
-    nonce_value.save()
+    if nonce_filter != None:
+        nonce_filter.add(nonce)
 
-    # Calculate the HMAC-authentication digest, and check that it mathes the
-    # digest value from the header.
+    timings['nonce'] = time.time() - start
 
-    parts       = [request.method, request.path, content_md5,
-                   nonce, access_secret]
+    # If we get here, the HMAC authentication succeeded.  Whew!
+
+    return True
+
+#############################################################################
+
+# The names used for the HMAC-authentication headers by calc_hmac_headers(),
+# indexed by normalized header name.  When unit testing, the headers appear
+# in request.META under these names rather than with an "HTTP_" prefix.
+
+_HEADER_NAMES = {"AUTHORIZATION" : "Authorization",
+                 "CONTENT_MD5"   : "Content_MD5",
+                 "NONCE"         : "Nonce",
+                 "TIMESTAMP"     : "Timestamp"}
+
+#############################################################################
+
+def _calc_digest(parts):
+    """ Calculate the HMAC digest for the given list of strings.
+
+        We return the base64-encoded digest, as a string.
+    """
     hmac_digest = hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
     hmac_base64 = base64.b64encode(hmac_digest.encode("utf-8"))
+    return hmac_base64.decode("utf-8")
 
-    if hmac_auth_string != "HMAC " + hmac_base64.decode("utf-8"):
-#        print("HMAC auth failed because authorization hash doesn't match.")
-        return False
+#############################################################################
 
-    # If we get here, the HMAC authentication succeeded.  Whew!
+def _is_timestamp_current(timestamp):
+    """ Return True if the given RFC-3339 timestamp is close to the current time.
 
-    return True
+        We return False if the timestamp is invalid, or if it is more than
+        settings.HMAC_MAX_CLOCK_SKEW seconds before or after the current time.
+    """
+    try:
+        date_time = utils.timestamp_to_datetime(timestamp)
+    except ValueError:
+        return False
+
+    if date_time == None or date_time.tzinfo == None:
+        return False
 
+    skew = abs((timezone.now() - date_time).total_seconds())
+    return skew <= settings.HMAC_MAX_CLOCK_SKEW
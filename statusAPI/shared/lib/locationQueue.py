@@ -0,0 +1,204 @@
+""" statusAPI.shared.lib.locationQueue
+
+    This module implements the writing of uploaded locations to the database,
+    and the queue used to do this asynchronously.
+
+    Normally, the "/location" endpoint writes each batch of locations, and
+    fans out the most recent one, before responding to the client.  When the
+    LOCATION_QUEUE setting is True, the endpoint instead checks the batch and
+    appends it to a queue of LocationQueueEntry records, and then returns an
+    HTTP 202 (Accepted) response straight away.  The queue is drained by the
+    "drain_location_queue" management command, which writes out many batches
+    at once using a single transaction (a "group commit"), so that the cost
+    of each commit and fan-out is shared between the batches.  This keeps
+    the endpoint's response time steady when the database is busy.
+
+    On PostgreSQL, each drain claims its entries using "FOR UPDATE SKIP
+    LOCKED", so any number of workers can drain the queue at once.  Other
+    databases should only use a single worker.
+"""
+import json
+
+from django.db        import connection, transaction
+from django.db.models import Count, Min
+from django.utils     import timezone
+
+from statusAPI.shared.models import *
+from statusAPI.shared.lib    import fanout, utils
+
+#############################################################################
+
+STATUS_TYPE = "location/latlong" # The type of status update to create.
+
+BATCH_SIZE = 100 # Maximum number of status updates to insert at once.
+
+#############################################################################
+
+def enqueue(global_id_rec, points):
+    """ Add a batch of locations to the queue.
+
+        'global_id_rec' is the GlobalID record for the global ID which
+        uploaded the locations, and 'points' is a list of (utc_datetime,
+        tz_offset, latitude, longitude) tuples, one for each location.
+    """
+    entry = LocationQueueEntry()
+    entry.global_id   = global_id_rec
+    entry.received_at = timezone.now()
+    entry.points      = json.dumps(
+                            [[utils.datetime_to_timestamp(utc_datetime),
+                              tz_offset, latitude, longitude]
+                             for utc_datetime,tz_offset,latitude,longitude
+                             in points])
+    entry.save()
+
+#############################################################################
+
+def drain(max_entries):
+    """ Write out the batches of locations at the head of the queue.
+
+        'max_entries' is the maximum number of LocationQueueEntry records to
+        write out at once.  All the claimed entries are written, and then
+        deleted, using a single transaction.  Upon completion, we return the
+        number of entries which were written out.
+    """
+    status_update_type = StatusUpdateType.objects.get(type=STATUS_TYPE)
+
+    with transaction.atomic():
+        entry_ids = _claim_entries(max_entries)
+        if len(entry_ids) == 0:
+            return 0
+
+        batches = []
+        for entry in LocationQueueEntry.objects.filter(id__in=entry_ids) \
+                                               .select_related("global_id") \
+                                               .order_by("id"):
+            points = []
+            for timestamp,tz_offset,latitude,longitude in \
+                    json.loads(entry.points):
+                points.append((utils.timestamp_to_datetime(timestamp),
+                               tz_offset, latitude, longitude))
+            batches.append((entry.global_id, points))
+
+        fanned_out = write_locations(status_update_type, batches)
+
+        LocationQueueEntry.objects.filter(id__in=entry_ids).delete()
+
+    for update,recipient_ids in fanned_out:
+        fanout.publish(update, recipient_ids)
+
+    return len(entry_ids)
+
+#############################################################################
+
+def write_locations(status_update_type, batches):
+    """ Write the given batches of locations to the database.
+
+        'status_update_type' is the StatusUpdateType for our status updates,
+        and 'batches' is a list of (global_id_rec, points) tuples, where
+        'global_id_rec' is the GlobalID record for the global ID which
+        uploaded a batch of locations, and 'points' is a list of
+        (utc_datetime, tz_offset, latitude, longitude) tuples, one for each
+        location in the batch.
+
+        A "presence" status update is written to each global ID's history for
+        every location.  The status updates are inserted in bulk, except for
+        each global ID's most recent location, which is saved last, so that
+        it has the highest record ID, and then fanned out to the recipients.
+        If several locations have the same timestamp, the last one wins.
+
+        This should be called within a transaction.  We return a list of
+        (update, recipient_ids) tuples, one for each fanned-out status
+        update, which should be passed to fanout.publish() once the
+        transaction has been committed.
+    """
+    updates = []
+    latest  = {} # Maps GlobalID record ID to index into 'updates'.
+
+    for global_id_rec,points in batches:
+        for utc_datetime,tz_offset,latitude,longitude in points:
+            contents = json.dumps({'latitude'  : latitude,
+                                   'longitude' : longitude,
+                                   'type'      : "presence"})
+
+            update = StatusUpdate()
+            update.global_id = global_id_rec
+            update.type      = status_update_type
+            update.timestamp = utc_datetime
+            update.tz_offset = tz_offset
+            update.contents  = contents
+
+            update.json_fragment = utils.status_update_to_json(
+                                            global_id_rec.global_id,
+                                            status_update_type.type,
+                                            utc_datetime, tz_offset, contents)
+
+            i = latest.get(global_id_rec.id)
+            if i == None or utc_datetime >= updates[i].timestamp:
+                latest[global_id_rec.id] = len(updates)
+            updates.append(update)
+
+    latest_indexes = set(latest.values())
+
+    StatusUpdate.objects.bulk_create(
+                    [update for i,update in enumerate(updates)
+                     if i not in latest_indexes],
+                    batch_size=BATCH_SIZE)
+
+    fanned_out = []
+    for i in sorted(latest_indexes):
+        update = updates[i]
+        update.save()
+        fanned_out.append((update, fanout.fan_out(update)))
+
+    return fanned_out
+
+#############################################################################
+
+def stats():
+    """ Return statistics about the current state of the queue.
+
+        We return a dictionary with the following entries:
+
+            'depth'
+
+                The number of batches of locations waiting in the queue.
+
+            'lag'
+
+                The number of seconds the oldest batch has been waiting, or
+                zero if the queue is empty.
+    """
+    result = LocationQueueEntry.objects.aggregate(
+                                    depth=Count("id"),
+                                    oldest=Min("received_at"))
+
+    if result['oldest'] == None:
+        lag = 0
+    else:
+        lag = (timezone.now() - result['oldest']).total_seconds()
+
+    return {'depth' : result['depth'],
+            'lag'   : lag}
+
+#############################################################################
+
+def _claim_entries(max_entries):
+    """ Claim the entries at the head of the queue.
+
+        This must be called within a transaction.  We lock and return the
+        record IDs of up to 'max_entries' of the oldest LocationQueueEntry
+        records.  On PostgreSQL, entries which have already been claimed by
+        another worker are skipped.
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id FROM " +
+                           LocationQueueEntry._meta.db_table +
+                           " ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED",
+                           [max_entries])
+            return [row[0] for row in cursor.fetchall()]
+    else:
+        return list(LocationQueueEntry.objects.order_by("id")
+                                      .select_for_update()
+                                      .values_list("id", flat=True)
+                                      [:max_entries])
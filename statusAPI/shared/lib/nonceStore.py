@@ -0,0 +1,352 @@
+""" statusAPI.shared.lib.nonceStore
+
+    This module implements the various "nonce stores" used to detect replayed
+    HMAC-authenticated requests.
+
+    A nonce store remembers each nonce value which has been used to make an
+    authenticated request, for as long as the replay window lasts.  Each store
+    provides a single atomic "insert-if-absent" operation, add(), which
+    records the nonce and tells the caller whether it has been seen before.
+
+    The following nonce stores are currently supported:
+
+        "memory"
+
+            The nonces are kept in a dictionary within the current process.
+            This is the fastest option, but only works if the API is served by
+            a single process.
+
+        "sqlite"
+
+            The nonces are kept in a local SQLite database file, as given by
+            the NONCE_STORE_PATH setting.  This can be shared by all the worker
+            processes running on a single machine.
+
+        "database"
+
+            The nonces are kept in the NonceValue database table.  This is the
+            default, and works no matter how many servers are involved.
+
+    The store to use is selected by the NONCE_STORE setting.  Use the
+    get_nonce_store() function to obtain the configured store.
+
+    If the NONCE_FILTER setting is True, a rotating Bloom filter is used as a
+    pre-check in front of the nonce store.  Use the get_nonce_filter()
+    function to obtain the filter, if there is one.
+"""
+import collections
+import datetime
+import os.path
+import sqlite3
+import threading
+import time
+
+from django.conf  import settings
+from django.db    import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from statusAPI.shared.models import *
+from statusAPI.shared.lib    import bloomFilter
+
+#############################################################################
+
+def nonce_window():
+    """ Return the length of time we need to remember nonce values for.
+
+        While version 1 HMAC-signed requests are accepted, this is given by
+        settings.KEEP_NONCE_VALUES_FOR.  Once only version 2 requests are
+        accepted, a request can only be replayed while its timestamp is within
+        the allowed clock skew, so we only need to remember the nonces for
+        twice the maximum clock skew.
+
+        We return a datetime.timedelta object, or None if the nonce values
+        should be remembered forever.
+    """
+    if not settings.HMAC_ACCEPT_V1:
+        return datetime.timedelta(seconds=2 * settings.HMAC_MAX_CLOCK_SKEW)
+    elif settings.KEEP_NONCE_VALUES_FOR == None:
+        return None
+    else:
+        return datetime.timedelta(days=settings.KEEP_NONCE_VALUES_FOR)
+
+#############################################################################
+
+class MemoryNonceStore:
+    """ A nonce store which keeps the nonce values in memory.
+
+        The nonces are kept in insertion order, so that expired nonces can be
+        discarded from the front of the store without having to scan it.  To
+        bound the amount of memory used, no more than 'max_entries' nonces
+        are kept.  A nonce within the replay window is never discarded, as
+        that would allow the request to be replayed; instead, once the store
+        is full, new nonces are rejected until the oldest ones expire.
+    """
+    def __init__(self, max_entries=None):
+        """ Standard initialiser.
+
+            'max_entries' is the maximum number of nonce values to remember,
+            or None if there is no limit.
+        """
+        self._nonces      = collections.OrderedDict() # Maps nonce -> time.
+        self._max_entries = max_entries
+        self._lock        = threading.Lock()
+
+
+    def add(self, nonce, known_new=False):
+        """ Remember the given nonce value.
+
+            We return True if the nonce was added, or False if the nonce has
+            already been used or the store is full.  Note that checking for an
+            existing nonce is as cheap as adding one, so we ignore the
+            'known_new' hint.
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if nonce in self._nonces:
+                return False
+            if self._max_entries != None:
+                if len(self._nonces) >= self._max_entries:
+                    return False # Full of nonces within the replay window.
+            self._nonces[nonce] = now
+            return True
+
+
+    def purge(self, chunk_size=None, pause=0):
+        """ Discard any nonce values which are outside the replay window.
+
+            Note that expired nonces are also discarded whenever a new nonce is
+            added, so the 'chunk_size' and 'pause' parameters are ignored.  We
+            return the number of nonce values which were discarded.
+        """
+        with self._lock:
+            return self._expire(time.time())
+
+    # =====================
+    # == PRIVATE METHODS ==
+    # =====================
+
+    def _expire(self, now):
+        """ Discard the nonces which were added before the replay window.
+
+            Note that the caller must hold our lock.  We return the number of
+            nonces which were discarded.
+        """
+        window = nonce_window()
+        if window == None:
+            return 0
+
+        cutoff  = now - window.total_seconds()
+        removed = 0
+        while self._nonces:
+            nonce,added_at = next(iter(self._nonces.items()))
+            if added_at > cutoff:
+                break
+            del self._nonces[nonce]
+            removed = removed + 1
+        return removed
+
+#############################################################################
+
+class SQLiteNonceStore:
+    """ A nonce store which keeps the nonce values in a local SQLite database.
+
+        Because the SQLite database is a file on disk, it can be shared by all
+        the worker processes running on the same machine.  SQLite serialises
+        the writes, and the primary key on the nonce column makes each add()
+        a single atomic "INSERT OR IGNORE" statement.
+    """
+    def __init__(self, path):
+        """ Standard initialiser.
+
+            'path' is the path to the SQLite database file to use.  The file
+            will be created if it doesn't already exist.
+        """
+        self._path  = path
+        self._local = threading.local()
+
+
+    def add(self, nonce, known_new=False):
+        """ Remember the given nonce value.
+
+            We return True if the nonce was added, or False if the nonce has
+            already been used.  Note that "INSERT OR IGNORE" costs the same as
+            a plain insert, so we ignore the 'known_new' hint.
+        """
+        connection = self._connection()
+        cursor = connection.execute("INSERT OR IGNORE INTO nonces " +
+                                    "(nonce, timestamp) VALUES (?, ?)",
+                                    (nonce, time.time()))
+        return cursor.rowcount == 1
+
+
+    def purge(self, chunk_size=None, pause=0):
+        """ Delete any nonce values which are outside the replay window.
+
+            If 'chunk_size' is not None, we delete at most that many nonce
+            values at once, waiting 'pause' seconds between each chunk.  We
+            return the number of nonce values which were deleted.
+        """
+        window = nonce_window()
+        if window == None:
+            return 0
+
+        cutoff     = time.time() - window.total_seconds()
+        connection = self._connection()
+
+        if chunk_size == None:
+            cursor = connection.execute(
+                                "DELETE FROM nonces WHERE timestamp <= ?",
+                                (cutoff,))
+            return cursor.rowcount
+
+        num_deleted = 0
+        while True:
+            cursor = connection.execute(
+                            "DELETE FROM nonces WHERE rowid IN " +
+                            "(SELECT rowid FROM nonces WHERE timestamp <= ? " +
+                            "ORDER BY timestamp LIMIT ?)",
+                            (cutoff, chunk_size))
+            num_deleted = num_deleted + cursor.rowcount
+            if cursor.rowcount < chunk_size:
+                break
+            elif pause > 0:
+                time.sleep(pause)
+        return num_deleted
+
+    # =====================
+    # == PRIVATE METHODS ==
+    # =====================
+
+    def _connection(self):
+        """ Return the SQLite connection to use for the current thread.
+
+            The connection is opened, and the nonce table created, the first
+            time this is called by each thread.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection == None:
+            connection = sqlite3.connect(self._path, timeout=30,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS nonces (" +
+                               "nonce TEXT PRIMARY KEY, " +
+                               "timestamp REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS " +
+                               "nonces_timestamp ON nonces (timestamp)")
+            self._local.connection = connection
+        return connection
+
+#############################################################################
+
+class DatabaseNonceStore:
+    """ A nonce store which keeps the nonce values in the NonceValue table.
+
+        Rather than checking for an existing nonce before inserting a new one,
+        we simply insert the nonce and rely on the unique index on the 'nonce'
+        column to reject duplicates.  Note that old nonces are not deleted as
+        part of the request cycle; use the "purge_nonces" management command
+        to do this.
+    """
+    def add(self, nonce, known_new=False):
+        """ Remember the given nonce value.
+
+            We return True if the nonce was added, or False if the nonce has
+            already been used.
+
+            If 'known_new' is True, the nonce filter has proven that this nonce
+            hasn't been seen before.  In this case we can insert the nonce as
+            a single autocommitted statement, rather than wrapping it in a
+            transaction so that a duplicate can be rolled back cleanly.  The
+            unique index still rejects a duplicate nonce, so this is safe even
+            if the filter is out of date.
+        """
+        if known_new and not connection.in_atomic_block:
+            try:
+                NonceValue.objects.create(nonce=nonce,
+                                          timestamp=timezone.now())
+            except IntegrityError:
+                return False
+            return True
+
+        try:
+            with transaction.atomic():
+                NonceValue.objects.create(nonce=nonce,
+                                          timestamp=timezone.now())
+        except IntegrityError:
+            return False
+        return True
+
+
+    def purge(self, chunk_size=None, pause=0):
+        """ Delete any nonce values which are outside the replay window.
+
+            If 'chunk_size' is not None, we delete at most that many nonce
+            values at once, waiting 'pause' seconds between each chunk.  We
+            return the number of nonce values which were deleted.
+        """
+        return NonceValue.objects.purge(chunk_size, pause)
+
+#############################################################################
+
+_store      = None
+_filter     = None
+_store_lock = threading.Lock()
+
+def get_nonce_store():
+    """ Return the nonce store to use, as selected by our settings.
+
+        The nonce store is created the first time this function is called,
+        and then re-used for the lifetime of the process.
+    """
+    global _store
+
+    if _store == None:
+        with _store_lock:
+            if _store == None:
+                _store = _create_nonce_store()
+    return _store
+
+#############################################################################
+
+def get_nonce_filter():
+    """ Return the Bloom filter to use as a nonce pre-check.
+
+        If the NONCE_FILTER setting is False, we return None.  Otherwise, the
+        filter is created the first time this function is called, and then
+        re-used for the lifetime of the process.
+    """
+    global _filter
+
+    if not settings.NONCE_FILTER:
+        return None
+
+    if _filter == None:
+        with _store_lock:
+            if _filter == None:
+                _filter = bloomFilter.RotatingBloomFilter(
+                                    nonce_window(),
+                                    settings.NONCE_FILTER_BUCKETS,
+                                    settings.NONCE_FILTER_CAPACITY,
+                                    settings.NONCE_FILTER_ERROR_RATE,
+                                    settings.NONCE_FILTER_PATH)
+    return _filter
+
+#############################################################################
+
+def _create_nonce_store():
+    """ Create and return a new nonce store based on our settings.
+    """
+    store_type = settings.NONCE_STORE
+
+    if store_type == "memory":
+        return MemoryNonceStore(settings.NONCE_STORE_MAX_ENTRIES)
+    elif store_type == "sqlite":
+        path = settings.NONCE_STORE_PATH
+        if path == None:
+            path = os.path.join(settings.ROOT_DIR, "nonces.sqlite3")
+        return SQLiteNonceStore(path)
+    elif store_type == "database":
+        return DatabaseNonceStore()
+    else:
+        raise RuntimeError("Unknown NONCE_STORE: " + repr(store_type))
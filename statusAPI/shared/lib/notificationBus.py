@@ -0,0 +1,286 @@
+""" statusAPI.shared.lib.notificationBus
+
+    This module implements a simple notification bus, used to wake up any
+    requests which are waiting for new status updates.
+
+    Notifications are identified by a set of keys.  Whenever a status update
+    is fanned out, the fan-out publishes a notification whose keys are the
+    record IDs of the GlobalIDs whose current status updates have changed, or
+    the special key "generation" if the status update was fanned out on read
+    (see the statusAPI.shared.lib.statusVersion module).  A request which
+    wants to wait for new status updates subscribes to the keys it is
+    interested in, and then waits on its subscription:
+
+        with notificationBus.get_bus().subscribe(keys) as subscription:
+            ...
+            if subscription.wait(timeout):
+                ...
+
+    Note that a notification published after the subscription was made, but
+    before wait() is called, will still cause wait() to return immediately,
+    so the caller can safely check for new status updates between subscribing
+    and waiting.
+
+    The bus is also used to invalidate cached values in every server process,
+    using keys of the form "cache:<name>" (see the statusAPI.shared.lib.cache
+    module).
+
+    Instead of waiting, a subscriber can supply a callback function when
+    subscribing.  The callback is called, without any parameters, whenever a
+    notification is received.  Note that the callback may be called from
+    another thread.
+
+    The backend to use is selected by the NOTIFICATION_BUS setting, which can
+    be one of:
+
+        "local"
+
+            Notifications are only delivered within the current process.
+            This is suitable when running a single server process.
+
+        "postgresql"
+
+            Notifications are sent using PostgreSQL's NOTIFY command, and
+            received by a background thread in each server process which
+            LISTENs for them.  This allows notifications to be delivered to
+            every server process using the same database.
+"""
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db   import connection
+
+#############################################################################
+
+class Subscription:
+    """ A subscription to notifications with a given set of keys.
+    """
+    def __init__(self, bus, keys, callback=None):
+        """ Standard initialiser.
+
+            'bus' is the LocalBus we are subscribed to, 'keys' is a set of the
+            keys we are subscribed to, as strings, and 'callback' is an
+            optional function to call whenever a notification is received.
+        """
+        self._bus      = bus
+        self._keys     = keys
+        self._callback = callback
+        self._event    = threading.Event()
+
+
+    def wait(self, timeout):
+        """ Wait until a notification is received, or the timeout expires.
+
+            'timeout' is the maximum number of seconds to wait for.  We return
+            True if a notification was received, or False if the timeout
+            expired.  Each notification only wakes up a single call to
+            wait(), so the caller can check for changes and then wait again.
+        """
+        if self._event.wait(timeout):
+            self._event.clear()
+            return True
+        else:
+            return False
+
+
+    def close(self):
+        """ Cancel this subscription.
+        """
+        self._bus._unsubscribe(self)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # =====================
+    # == PRIVATE METHODS ==
+    # =====================
+
+    def _notify(self):
+        """ Respond to a notification being published for this subscription.
+        """
+        self._event.set()
+        if self._callback != None:
+            self._callback()
+
+#############################################################################
+
+class LocalBus:
+    """ A notification bus which delivers notifications within this process.
+    """
+    def __init__(self):
+        """ Standard initialiser.
+        """
+        self._lock        = threading.Lock()
+        self._subscribers = {} # Maps key to set of Subscription objects.
+
+
+    def subscribe(self, keys, callback=None):
+        """ Subscribe to notifications with any of the given keys.
+
+            If 'callback' is given, it will be called whenever a notification
+            is received.  We return a new Subscription object.
+        """
+        subscription = Subscription(self, set([str(key) for key in keys]),
+                                    callback)
+        with self._lock:
+            for key in subscription._keys:
+                if key not in self._subscribers:
+                    self._subscribers[key] = set()
+                self._subscribers[key].add(subscription)
+        return subscription
+
+
+    def publish(self, keys):
+        """ Publish a notification with the given keys.
+
+            Every subscription to any of the given keys will be woken up.
+        """
+        with self._lock:
+            subscriptions = set()
+            for key in keys:
+                subscriptions.update(self._subscribers.get(str(key), []))
+
+        for subscription in subscriptions:
+            subscription._notify()
+
+    # =====================
+    # == PRIVATE METHODS ==
+    # =====================
+
+    def _unsubscribe(self, subscription):
+        """ Remove the given subscription from this bus.
+        """
+        with self._lock:
+            for key in subscription._keys:
+                subscribers = self._subscribers.get(key)
+                if subscribers != None:
+                    subscribers.discard(subscription)
+                    if len(subscribers) == 0:
+                        del self._subscribers[key]
+
+#############################################################################
+
+class PostgreSQLBus:
+    """ A notification bus which uses PostgreSQL's LISTEN and NOTIFY commands.
+    """
+    CHANNEL          = "status_updates" # The channel to send notifications on.
+    MAX_PAYLOAD_SIZE = 4000 # Maximum size of a single notification's payload.
+
+    def __init__(self):
+        """ Standard initialiser.
+        """
+        self._local    = LocalBus()
+        self._lock     = threading.Lock()
+        self._listener = None
+
+
+    def subscribe(self, keys, callback=None):
+        """ Subscribe to notifications with any of the given keys.
+
+            The first time this is called, we start a background thread to
+            listen for notifications from PostgreSQL.  If 'callback' is given,
+            it will be called whenever a notification is received.  We return
+            a new Subscription object.
+        """
+        with self._lock:
+            if self._listener == None:
+                self._listener = threading.Thread(target=self._listen,
+                                                  daemon=True)
+                self._listener.start()
+
+        return self._local.subscribe(keys, callback)
+
+
+    def publish(self, keys):
+        """ Publish a notification with the given keys.
+
+            The keys are sent to every listening server process, including
+            this one.  Note that, if this is called within a transaction, the
+            notification is only sent once the transaction is committed.
+        """
+        payloads = []
+        payload  = ""
+        for key in keys:
+            key = str(key)
+            if len(payload) + len(key) >= self.MAX_PAYLOAD_SIZE:
+                payloads.append(payload)
+                payload = ""
+            if payload != "":
+                payload = payload + ","
+            payload = payload + key
+        if payload != "":
+            payloads.append(payload)
+
+        with connection.cursor() as cursor:
+            for payload in payloads:
+                cursor.execute("SELECT pg_notify(%s, %s)",
+                               [self.CHANNEL, payload])
+
+    # =====================
+    # == PRIVATE METHODS ==
+    # =====================
+
+    def _listen(self):
+        """ Listen for notifications, passing them on to our local bus.
+
+            This runs in a background thread for the life of the process.  If
+            our database connection is lost, we wait a moment and reconnect.
+        """
+        import psycopg2
+        import psycopg2.extensions
+
+        while True:
+            try:
+                db_connection = psycopg2.connect(
+                                    **connection.get_connection_params())
+                db_connection.set_isolation_level(
+                            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+                cursor = db_connection.cursor()
+                cursor.execute("LISTEN " + self.CHANNEL)
+
+                while True:
+                    readable,writable,errors = select.select([db_connection],
+                                                             [], [], 60)
+                    if len(readable) == 0:
+                        continue # Timed out.
+
+                    db_connection.poll()
+                    while db_connection.notifies:
+                        notify = db_connection.notifies.pop(0)
+                        self._local.publish(notify.payload.split(","))
+            except psycopg2.Error:
+                time.sleep(1)
+
+#############################################################################
+
+_bus      = None # The notification bus for this process.
+_bus_lock = threading.Lock()
+
+def get_bus():
+    """ Return the notification bus to use for this process.
+
+        The bus is created, based upon the NOTIFICATION_BUS setting, the first
+        time this function is called.
+    """
+    global _bus
+
+    if _bus == None:
+        with _bus_lock:
+            if _bus == None:
+                if settings.NOTIFICATION_BUS == "local":
+                    _bus = LocalBus()
+                elif settings.NOTIFICATION_BUS == "postgresql":
+                    _bus = PostgreSQLBus()
+                else:
+                    raise RuntimeError("Unknown NOTIFICATION_BUS: " +
+                                       repr(settings.NOTIFICATION_BUS))
+
+    return _bus
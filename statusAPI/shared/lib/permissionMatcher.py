@@ -0,0 +1,134 @@
+""" statusAPI.shared.lib.permissionMatcher
+
+    This module implements a compiled, cached matcher for an issuer's
+    permissions.
+
+    A permission's status type may be an exact status type such as
+    "availability/text", or a wildcard such as "availability/*" or "*" which
+    matches every status type starting with the text before the "*".  Rather
+    than checking each of an issuer's Permission records in turn, we compile
+    all of the issuer's permissions of a given access type into a
+    PermissionMatcher.  This maps each status type pattern to the set of
+    recipients holding a permission with that pattern, and is effectively a
+    prefix trie where each node is found by a single dictionary lookup: to
+    match a status type, we look up the status type itself, and the wildcard
+    pattern for each of its prefixes.  The results for each status type are
+    remembered, so repeated lookups of the same status type are a single
+    dictionary lookup.
+
+    The compiled matchers are stored in the "permission" cache (see the
+    statusAPI.shared.lib.cache module).  Whenever an issuer's permissions are
+    changed, invalidate_matchers() must be called to remove that issuer's
+    matchers from the cache in every server process.
+"""
+from statusAPI.shared.models import *
+from statusAPI.shared.lib    import cache
+
+#############################################################################
+
+class PermissionMatcher:
+    """ A compiled set of permissions for a single issuer and access type.
+    """
+    def __init__(self, permissions):
+        """ Standard initialiser.
+
+            'permissions' should be a sequence of (recipient_id, status_type)
+            tuples, where 'recipient_id' is the record ID of the recipient's
+            GlobalID record, and 'status_type' is the permission's status type
+            pattern, which may include a wildcard.
+        """
+        self._patterns = {} # Maps pattern to set of recipient IDs.
+        self._results  = {} # Maps status type to (patterns, recipients).
+
+        for recipient_id,pattern in permissions:
+            if pattern not in self._patterns:
+                self._patterns[pattern] = set()
+            self._patterns[pattern].add(recipient_id)
+
+
+    def recipients(self, status_type):
+        """ Return the recipients with permission to see the given status type.
+
+            We return a frozenset of GlobalID record IDs.
+        """
+        return self._match(status_type)[1]
+
+
+    def patterns(self, status_type):
+        """ Return the permission patterns matching the given status type.
+
+            We return a frozenset of the 'status_type' values for the
+            Permission records which cover the given status type.
+        """
+        return self._match(status_type)[0]
+
+    # =====================
+    # == PRIVATE METHODS ==
+    # =====================
+
+    def _match(self, status_type):
+        """ Return the (patterns, recipients) tuple for the given status type.
+        """
+        result = self._results.get(status_type)
+        if result != None:
+            return result
+
+        candidates = [status_type]
+        for i in range(len(status_type) + 1):
+            candidates.append(status_type[:i] + "*")
+
+        patterns   = set()
+        recipients = set()
+        for candidate in candidates:
+            if candidate in self._patterns:
+                patterns.add(candidate)
+                recipients.update(self._patterns[candidate])
+
+        result = (frozenset(patterns), frozenset(recipients))
+        self._results[status_type] = result
+        return result
+
+#############################################################################
+
+def get_matcher(global_id, access_type):
+    """ Return the PermissionMatcher for the given issuer and access type.
+
+        'global_id' is the issuer's global ID, as a string, and 'access_type'
+        is the desired type of access.  If there is no cached matcher, we load
+        the issuer's permissions using a single query and compile them into a
+        new matcher.
+    """
+    matcher_cache = cache.get_cache("permission")
+    key           = _cache_key(global_id, access_type)
+
+    matcher = matcher_cache.get(key)
+    if matcher == None:
+        permissions = Permission.objects.filter(
+                                    issuing_global_id__global_id=global_id,
+                                    access_type=access_type)
+        matcher = PermissionMatcher(
+                        permissions.values_list("recipient_global_id",
+                                                "status_type"))
+        matcher_cache.set(key, matcher)
+
+    return matcher
+
+#############################################################################
+
+def invalidate_matchers(global_id):
+    """ Remove the cached matchers for the given issuer.
+
+        'global_id' is the issuer's global ID, as a string.  This must be
+        called whenever the issuer's permissions are changed.
+    """
+    keys = []
+    for access_type,label in Permission.ACCESS_TYPE_CHOICES:
+        keys.append(_cache_key(global_id, access_type))
+    cache.invalidate("permission", *keys)
+
+#############################################################################
+
+def _cache_key(global_id, access_type):
+    """ Return the cache key to use for the given issuer and access type.
+    """
+    return global_id + ":" + access_type
@@ -0,0 +1,125 @@
+""" statusAPI.shared.lib.statusVersion
+
+    This module keeps track of the version of each global ID's current status
+    updates, so that clients polling the "<global_id>/status" endpoint can be
+    told that nothing has changed without querying the current status updates
+    themselves.
+
+    Each global ID has a StatusVersion record, holding a counter which is
+    incremented whenever a status update is written to that global ID's
+    current status updates (or issued by that global ID), and whenever a
+    change to an issuer's permissions changes which of the issuer's status
+    updates the global ID can see.  These records are written by the fan-out,
+    within the same transaction as the CurrentStatusUpdateView records.  Once
+    the transaction has been committed, publish_versions() removes the old
+    versions from the "status_version" cache (see the
+    statusAPI.shared.lib.cache module); the next request reads the new
+    version from the database, and subsequent requests only need a cache
+    lookup to find it.
+
+    Status updates which are fanned out on read (see the
+    statusAPI.shared.lib.fanout module) are not written to each recipient's
+    current status updates, and so don't change the recipients' versions.
+    Instead, every such status update changes a single "generation" value,
+    which is the ID of the most recent StatusUpdate to be fanned out on read.
+    The ETag for a set of current status updates combines the global ID's
+    version with this generation, so a status update from an issuer with a
+    very large audience causes every client to re-read their status updates
+    once.
+"""
+import hashlib
+
+from django.db.models import Max
+
+from statusAPI.shared.models import *
+from statusAPI.shared.lib    import cache
+
+#############################################################################
+
+def calc_etag(global_id_rec, query_params):
+    """ Calculate the ETag for a global ID's current status updates.
+
+        'global_id_rec' is the GlobalID record for the global ID retrieving
+        their current status updates, and 'query_params' is the QueryDict
+        holding the request's query parameters.  We return the ETag to use
+        for this request, as a quoted string.
+    """
+    params = sorted([(name, value) for name in query_params
+                                   for value in query_params.getlist(name)])
+
+    key = "{}-{}-{}".format(get_version(global_id_rec.id), get_generation(),
+                            repr(params))
+
+    return '"' + hashlib.md5(key.encode("utf-8")).hexdigest() + '"'
+
+#############################################################################
+
+def get_version(global_id_id):
+    """ Return the version of the given global ID's current status updates.
+
+        'global_id_id' is the record ID of the desired GlobalID.  We return
+        the global ID's version, or zero if no status updates have ever been
+        written to the global ID's current status updates.
+    """
+    version_cache = cache.get_cache("status_version")
+
+    version = version_cache.get(global_id_id)
+    if version == None:
+        version = StatusVersion.objects.filter(global_id_id=global_id_id) \
+                                       .values_list("version", flat=True) \
+                                       .first()
+        if version == None:
+            version = 0
+        version_cache.set(global_id_id, version)
+
+    return version
+
+#############################################################################
+
+def get_generation():
+    """ Return the current generation of the status updates fanned out on read.
+
+        We return the ID of the most recent status update to be fanned out on
+        read, or zero if there are no such status updates.
+    """
+    version_cache = cache.get_cache("status_version")
+
+    generation = version_cache.get("generation")
+    if generation == None:
+        generation = LatestStatusUpdate.objects.filter(fanned_out=False) \
+                            .aggregate(max_id=Max("status_update"))['max_id']
+        if generation == None:
+            generation = 0
+        version_cache.set("generation", generation)
+
+    return generation
+
+#############################################################################
+
+def publish_versions(global_id_ids, generation=None):
+    """ Update our cache once new versions have been committed.
+
+        'global_id_ids' is a collection of GlobalID record IDs whose versions
+        have been incremented, and 'generation', if given, is the ID of a
+        StatusUpdate which was fanned out on read.  This should be called once
+        the transaction which changed the versions has been committed.
+    """
+    version_cache = cache.get_cache("status_version")
+
+    for global_id_id in global_id_ids:
+        version_cache.delete(global_id_id)
+
+    if generation != None:
+        version_cache.set("generation", generation)
+
+#############################################################################
+
+def forget_versions(global_id_id):
+    """ Remove the cached version and generation for the given global ID.
+
+        This is used after a request has been woken up by a notification from
+        another server process, as our own cached values may be out of date.
+    """
+    version_cache = cache.get_cache("status_version")
+    version_cache.delete(global_id_id)
+    version_cache.delete("generation")
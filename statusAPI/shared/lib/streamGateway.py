@@ -0,0 +1,294 @@
+""" statusAPI.shared.lib.streamGateway
+
+    This module implements a gateway which streams status updates to clients
+    using Server-Sent Events (SSE).
+
+    The gateway is a separate server process, started using the
+    "run_stream_gateway" management command, which uses asyncio so that it
+    can hold open a very large number of idle connections.  Clients connect
+    using:
+
+        GET /<global_id>/status/stream
+
+    The request is authenticated once, using the same HMAC authentication
+    headers as the rest of the API.  The gateway then sends each of the
+    client's current status updates as an SSE event, followed by each new
+    status update as it is fanned out to the client.  The data for each event
+    is the status update's JSON representation, in the same form as returned
+    by the "<global_id>/status" endpoint, and the event's ID is the sequence
+    number of the client's CurrentStatusUpdateView record.  These sequence
+    numbers increase in the order the status updates were committed, so a
+    client which reconnects with a "Last-Event-ID" header will receive every
+    status update committed after that event, and nothing earlier.
+
+    Status updates from issuers with very large audiences are fanned out on
+    read (see the statusAPI.shared.lib.fanout module), and so have no sequence
+    number.  These are sent without an event ID whenever they change; a
+    client which reconnects will receive all of them again.
+
+    The gateway is woken up by the notification bus (see the
+    statusAPI.shared.lib.notificationBus module).  As the gateway runs in its
+    own process, this requires NOTIFICATION_BUS to be set to "postgresql"; if
+    the "local" notification bus is used, the gateway instead checks for new
+    status updates each time it sends a keep-alive comment to the client.
+
+    All database access is done using a pool of worker threads, so that the
+    event loop is never blocked by a database query.
+"""
+import asyncio
+import concurrent.futures
+import re
+import urllib.parse
+
+from django      import db
+from django.http import HttpRequest
+
+from statusAPI.shared.lib import currentStatus, hmac, notificationBus, utils
+
+#############################################################################
+
+MAX_HEADER_LINES = 100 # Maximum number of header lines in a request.
+
+STREAM_PATH = re.compile(r"^/([^/]+)/status/stream$")
+
+#############################################################################
+
+class StreamGateway:
+    """ An asyncio-based server which streams status updates to clients.
+    """
+    def __init__(self, host, port, keepalive=15, num_threads=10,
+                 request_timeout=30):
+        """ Standard initialiser.
+
+            The parameters are as follows:
+
+                'host'
+
+                    The host name or IP address to listen on.
+
+                'port'
+
+                    The port number to listen on.
+
+                'keepalive'
+
+                    The number of seconds between the keep-alive comments sent
+                    to each idle client.
+
+                'num_threads'
+
+                    The number of worker threads to use for database access.
+
+                'request_timeout'
+
+                    The number of seconds a client has to send its request
+                    line and headers before we give up on it.
+        """
+        self._host        = host
+        self._port        = port
+        self._keepalive   = keepalive
+        self._num_threads = num_threads
+        self._timeout     = request_timeout
+        self._bus         = notificationBus.get_bus()
+        self._poll        = isinstance(self._bus, notificationBus.LocalBus)
+
+
+    def serve_forever(self):
+        """ Run the gateway until it is interrupted.
+        """
+        loop = asyncio.get_event_loop()
+        loop.set_default_executor(
+                concurrent.futures.ThreadPoolExecutor(self._num_threads))
+
+        server = loop.run_until_complete(
+                        asyncio.start_server(self._handle_connection,
+                                             self._host, self._port))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+
+    # =====================
+    # == PRIVATE METHODS ==
+    # =====================
+
+    async def _handle_connection(self, reader, writer):
+        """ Handle a single incoming connection.
+        """
+        try:
+            await self._stream(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass # The client went away.
+        finally:
+            writer.close()
+
+
+    async def _stream(self, reader, writer):
+        """ Authenticate the client, and then stream status updates to it.
+        """
+        try:
+            request = await asyncio.wait_for(self._read_request(reader),
+                                             self._timeout)
+        except asyncio.TimeoutError:
+            self._write_error(writer, 408, "Request Timeout")
+            return
+        except ValueError:
+            request = None # A line was longer than the reader's limit.
+
+        if request == None:
+            self._write_error(writer, 400, "Bad Request")
+            return
+
+        match = STREAM_PATH.match(request.path)
+        if request.method != "GET" or match == None:
+            self._write_error(writer, 404, "Not Found")
+            return
+
+        global_id_rec = await self._run(self._authenticate, request,
+                                        match.group(1))
+        if global_id_rec == None:
+            self._write_error(writer, 403, "Forbidden")
+            return
+
+        try:
+            cursor = int(request.META.get("HTTP_LAST_EVENT_ID"))
+        except (TypeError, ValueError):
+            cursor = None
+
+        # Subscribe to the notifications for this global ID before checking
+        # for status updates, so that we can't miss a status update posted
+        # while we are checking.
+
+        loop   = asyncio.get_event_loop()
+        wakeup = asyncio.Event()
+
+        subscription = self._bus.subscribe(
+                        [global_id_rec.id, "generation"],
+                        lambda: loop.call_soon_threadsafe(wakeup.set))
+        try:
+            headers = ["HTTP/1.1 200 OK",
+                       "Content-Type: text/event-stream",
+                       "Cache-Control: no-cache",
+                       "Connection: keep-alive"]
+            origin = request.META.get("HTTP_ORIGIN")
+            if origin:
+                headers.append("Access-Control-Allow-Origin: " + origin)
+
+            writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("utf-8"))
+
+            sent = {} # Maps (issuer, type) to the last unfanned update sent.
+
+            while True:
+                wakeup.clear()
+
+                views,unfanned = await self._run(
+                                        currentStatus.find_stream_updates,
+                                        global_id_rec, cursor)
+
+                for sequence,fragment in views:
+                    event = "id: {}\ndata: {}\n\n".format(sequence, fragment)
+                    writer.write(event.encode("utf-8"))
+                    cursor = sequence
+
+                if cursor == None:
+                    cursor = 0
+
+                # The status updates fanned out on read have no sequence
+                # number, so we send the ones which have changed since we
+                # last looked, without an event ID.
+
+                current = {}
+                for issuer,type,status_update_id,fragment in sorted(unfanned):
+                    current[(issuer, type)] = status_update_id
+                    if sent.get((issuer, type)) != status_update_id:
+                        event = "data: {}\n\n".format(fragment)
+                        writer.write(event.encode("utf-8"))
+                sent = current
+
+                await writer.drain()
+
+                # Wait until we are notified of a new status update, sending
+                # keep-alive comments to the client while we wait.
+
+                while not wakeup.is_set():
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), self._keepalive)
+                    except asyncio.TimeoutError:
+                        writer.write(b": keepalive\n\n")
+                        await writer.drain()
+                        if self._poll:
+                            break
+        finally:
+            subscription.close()
+
+
+    async def _read_request(self, reader):
+        """ Read the request line and headers for an incoming HTTP request.
+
+            We return an HttpRequest object for the request, or None if the
+            request is invalid.
+        """
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            return None
+
+        request = HttpRequest()
+        request.method = request_line[0]
+        request.path   = urllib.parse.unquote(request_line[1].split("?")[0])
+        request._body  = b""
+
+        for i in range(MAX_HEADER_LINES):
+            line = (await reader.readline()).decode("latin-1").strip()
+            if line == "":
+                return request
+
+            name,sep,value = line.partition(":")
+            if sep == "":
+                return None
+
+            name = "HTTP_" + name.strip().upper().replace("-", "_")
+            request.META[name] = value.strip()
+
+        return None # Too many headers.
+
+
+    def _authenticate(self, request, global_id):
+        """ Check the HMAC authentication for the given request.
+
+            This is called from a worker thread.  If the request is correctly
+            authenticated for the given global ID, we return the global ID's
+            GlobalID record.  Otherwise, we return None.
+        """
+        access_id = utils.get_access_id(global_id)
+        if access_id == None:
+            return None
+
+        if not hmac.check_hmac_authentication(request,
+                                              access_id.access_secret):
+            return None
+
+        return access_id.global_id
+
+
+    def _run(self, function, *args):
+        """ Call the given function from one of our worker threads.
+
+            We return a future which resolves to the function's return value.
+        """
+        def run():
+            db.close_old_connections()
+            return function(*args)
+
+        return asyncio.get_event_loop().run_in_executor(None, run)
+
+
+    def _write_error(self, writer, status, reason):
+        """ Send an error response back to the client.
+        """
+        writer.write("HTTP/1.1 {} {}\r\nContent-Length: 0\r\n"
+                     "Connection: close\r\n\r\n".format(status, reason)
+                     .encode("utf-8"))
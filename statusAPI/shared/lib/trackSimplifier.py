@@ -0,0 +1,124 @@
+""" statusAPI.shared.lib.trackSimplifier
+
+    This module implements the simplification of location tracks.
+
+    A track is a sequence of (latitude, longitude) points, such as a global
+    ID's "location/latlong" history.  Clients drawing a track as a polyline
+    don't need every point: points which lie close to the line between their
+    neighbours can be dropped without visibly changing the shape of the
+    track.
+
+    We use the Douglas-Peucker algorithm to decide which points to keep.  The
+    first and last points are always kept.  The point furthest from the line
+    joining them is then kept, splitting the track into two sections, and
+    each section is split in turn at its furthest point.  Rather than
+    recursing, we keep a heap of the sections which have yet to be split,
+    ordered by the distance of their furthest point.  This means the most
+    significant points are always kept first, so we can stop either once the
+    furthest remaining point is within a given tolerance, or once a given
+    number of points have been kept.
+"""
+import heapq
+import math
+
+#############################################################################
+
+EARTH_RADIUS = 6371000 # Mean radius of the Earth, in metres.
+
+#############################################################################
+
+def simplify(points, tolerance=None, max_points=None):
+    """ Simplify the given track.
+
+        The parameters are as follows:
+
+            'points'
+
+                A list of (latitude, longitude) tuples, in degrees, making up
+                the track to simplify.
+
+            'tolerance'
+
+                If given, points which are no more than this many metres away
+                from the simplified track will be dropped.
+
+            'max_points'
+
+                If given, the maximum number of points to keep.  This must be
+                at least two.
+
+        We return a sorted list of the indexes into 'points' of the points to
+        keep.  Note that distances are calculated using an equirectangular
+        projection centred on the track, which is accurate enough for tracks
+        covering a small part of the Earth's surface.
+    """
+    if len(points) <= 2:
+        return list(range(len(points)))
+
+    # Project the points onto a flat surface, in metres.
+
+    mid_latitude = math.radians(sum([lat for lat,long in points]) /
+                                len(points))
+    scale_x      = math.cos(mid_latitude) * math.radians(EARTH_RADIUS)
+    scale_y      = math.radians(EARTH_RADIUS)
+
+    coords = [(long * scale_x, lat * scale_y) for lat,long in points]
+
+    # Split the track at its most significant points until we have kept
+    # enough of them.
+
+    kept = set([0, len(points)-1])
+
+    sections = [] # Heap of (-distance, start, end, furthest) tuples.
+    _add_section(sections, coords, 0, len(points)-1)
+
+    while len(sections) > 0:
+        if max_points != None and len(kept) >= max_points:
+            break
+
+        distance,start,end,furthest = heapq.heappop(sections)
+        if tolerance != None and -distance <= tolerance:
+            break
+
+        kept.add(furthest)
+        _add_section(sections, coords, start, furthest)
+        _add_section(sections, coords, furthest, end)
+
+    return sorted(kept)
+
+#############################################################################
+
+def _add_section(sections, coords, start, end):
+    """ Add a section of the track to our heap of sections to split.
+
+        'sections' is the heap of sections, 'coords' is the list of projected
+        (x, y) coordinates for the track, and 'start' and 'end' are the
+        indexes of the points at either end of the section.  Sections without
+        any points between their ends are ignored.
+    """
+    if end - start < 2:
+        return
+
+    x1,y1 = coords[start]
+    x2,y2 = coords[end]
+    dx    = x2 - x1
+    dy    = y2 - y1
+    length_squared = dx*dx + dy*dy
+
+    max_distance = -1
+    furthest     = None
+    for i in range(start+1, end):
+        x,y = coords[i]
+        if length_squared == 0:
+            distance = math.hypot(x - x1, y - y1)
+        else:
+            # Find the distance from the point to the nearest point on the
+            # line segment between the two ends.
+            t = ((x - x1) * dx + (y - y1) * dy) / length_squared
+            t = max(0, min(1, t))
+            distance = math.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
+        if distance > max_distance:
+            max_distance = distance
+            furthest     = i
+
+    heapq.heappush(sections, (-max_distance, start, end, furthest))
@@ -4,25 +4,239 @@
 """
 import datetime
 import base64
+import binascii
 import hashlib
+import io
+import json
 import uuid
+import zlib
 
+from django.conf  import settings
+from django.http  import HttpResponse
 from django.utils import timezone, dateparse
 
 from statusAPI.shared.models import *
+from statusAPI.shared.lib    import cache
+
+#############################################################################
+
+READ_CHUNK_SIZE = 64 * 1024 # Number of bytes to read from a request at once.
+
+UNKNOWN_SESSION = "" # Cached for location sessions which don't exist.
 
 #############################################################################
 
 def get_access_id(global_id):
     """ Return the access ID currently associated with the given global ID.
+
+        The access IDs are cached, as they almost never change.  Note that the
+        returned AccessID object has its 'global_id' field already loaded.
     """
+    access_id_cache = cache.get_cache("access_id")
+
+    access_id = access_id_cache.get(global_id)
+    if access_id != None:
+        return access_id
+
     try:
-        return AccessID.objects.get(global_id__global_id=global_id)
+        access_id = AccessID.objects.select_related("global_id").get(
+                                            global_id__global_id=global_id)
     except AccessID.DoesNotExist:
         return None
     except AccessID.MultipleObjectsReturned:
         return None # Should never happen.
 
+    access_id_cache.set(global_id, access_id)
+    return access_id
+
+#############################################################################
+
+def invalidate_access_id(global_id):
+    """ Remove the cached access ID for the given global ID.
+
+        This must be called whenever the access ID for a global ID is created
+        or deleted.
+    """
+    cache.invalidate("access_id", global_id)
+
+#############################################################################
+
+def access_id_cache_stats():
+    """ Return the hit and miss counts for the access ID cache.
+
+        We return a dictionary with 'hits' and 'misses' entries, counting the
+        cache hits and misses made by the current process.
+    """
+    return cache.get_cache("access_id").stats()
+
+#############################################################################
+
+def get_location_session(session_id):
+    """ Return the global ID for the given location session.
+
+        'session_id' is the ID of the desired location session.  We return
+        the GlobalID record for the global ID which owns that location
+        session, or None if there is no such session.
+
+        The location sessions are cached, as they rarely change.  Unknown
+        session IDs are cached as well, so that repeated requests using an
+        invalid session ID don't each have to query the database.
+    """
+    session_cache = cache.get_cache("location_session")
+
+    global_id_rec = session_cache.get(session_id)
+    if global_id_rec == UNKNOWN_SESSION:
+        return None
+    elif global_id_rec != None:
+        return global_id_rec
+
+    try:
+        session = LocationSession.objects.select_related("global_id").get(
+                                                    session_id=session_id)
+    except LocationSession.DoesNotExist:
+        session_cache.set(session_id, UNKNOWN_SESSION)
+        return None
+    except LocationSession.MultipleObjectsReturned:
+        return None # Should never happen.
+
+    session_cache.set(session_id, session.global_id)
+    return session.global_id
+
+#############################################################################
+
+def invalidate_location_session(session_id):
+    """ Remove the cached global ID for the given location session.
+
+        This must be called whenever a location session is created or
+        deleted.
+    """
+    cache.invalidate("location_session", session_id)
+
+#############################################################################
+
+class RequestBodyTooLarge(Exception):
+    """ Raised when a request's body is larger than we are willing to accept.
+    """
+    pass
+
+#############################################################################
+
+class UnsupportedContentEncoding(Exception):
+    """ Raised when a request's body uses an unknown Content-Encoding.
+    """
+    pass
+
+#############################################################################
+
+class InvalidRequestBody(Exception):
+    """ Raised when a request's compressed body can't be decompressed.
+    """
+    pass
+
+#############################################################################
+
+def read_request_body(request):
+    """ Read the body of the given HTTP request, calculating its MD5 digest.
+
+        The body is read in chunks directly from the request's input stream,
+        and the MD5 digest is calculated as each chunk is read.  The body is
+        then stored into the request so that it can be accessed as
+        request.body without being read again.
+
+        If the request's body is larger than settings.MAX_REQUEST_BODY_SIZE,
+        we raise a RequestBodyTooLarge exception.  Where possible, this is
+        done based on the request's Content-Length header, before any of the
+        body has been read.
+
+        If the request has a "Content-Encoding" header of "gzip" or "deflate",
+        each chunk is decompressed as it is read, and request.body will hold
+        the decompressed body.  If the decompressed body is larger than
+        settings.MAX_DECOMPRESSED_BODY_SIZE, we raise a RequestBodyTooLarge
+        exception as soon as this limit is reached, without decompressing the
+        rest of the body.  An unknown content encoding raises an
+        UnsupportedContentEncoding exception, and a body which can't be
+        decompressed raises an InvalidRequestBody exception.
+
+        Upon completion, we return the MD5 digest of the body, as a string of
+        hex digits.  Note that the digest is calculated from the body as it
+        was sent, before it is decompressed, so a client using compression
+        must calculate its Content-MD5 value from the compressed body.
+        Calling this function again for the same request simply returns the
+        previously-calculated digest.
+    """
+    if hasattr(request, "body_md5"):
+        return request.body_md5
+
+    max_size   = settings.MAX_REQUEST_BODY_SIZE
+    encoding   = request.META.get("HTTP_CONTENT_ENCODING", "")
+    decompress = _body_decompressor(encoding)
+
+    if hasattr(request, "_body") and decompress == None:
+        # The body has already been read -> just calculate the digest.
+        if max_size != None and len(request._body) > max_size:
+            raise RequestBodyTooLarge()
+        request.body_md5 = hashlib.md5(request._body).hexdigest()
+        return request.body_md5
+
+    if hasattr(request, "_body"):
+        raw_chunks = [request._body]
+    else:
+        try:
+            content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            content_length = 0
+
+        if max_size != None and content_length > max_size:
+            raise RequestBodyTooLarge()
+
+        raw_chunks = iter(lambda: request.read(READ_CHUNK_SIZE), b"")
+
+    digest = hashlib.md5()
+    chunks = []
+    size   = 0
+
+    for chunk in raw_chunks:
+        size = size + len(chunk)
+        if max_size != None and size > max_size:
+            raise RequestBodyTooLarge()
+
+        digest.update(chunk)
+        if decompress != None:
+            chunks.extend(decompress(chunk))
+        else:
+            chunks.append(chunk)
+
+    if decompress != None:
+        chunks.extend(decompress(None))
+
+    request._body    = b"".join(chunks)
+    request._stream  = io.BytesIO(request._body)
+    request.body_md5 = digest.hexdigest()
+
+    return request.body_md5
+
+#############################################################################
+
+def compress_body(body, content_encoding):
+    """ Compress a request body for sending with the given Content-Encoding.
+
+        'body' is the body of the request, as a string or as bytes, and
+        'content_encoding' is either "gzip" or "deflate".  We return the
+        compressed body, as bytes.  This is the inverse of the decompression
+        done by read_request_body().
+    """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    if content_encoding == "gzip":
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    elif content_encoding == "deflate":
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS)
+    else:
+        raise ValueError("Unknown content encoding: " + repr(content_encoding))
+
+    return compressor.compress(body) + compressor.flush()
+
 #############################################################################
 
 def current_utc_timestamp():
@@ -74,4 +288,129 @@ def utc_and_timezone_to_datetime(utc_datetime, timezone_offset):
     date_time = utc_datetime.astimezone(timezone.FixedOffset(timezone_offset))
     return date_time
 
+#############################################################################
+
+def encode_cursor(timestamp, id):
+    """ Return an opaque cursor for the given (timestamp, id) position.
+
+        'timestamp' should be a datetime.datetime object in UTC, and 'id'
+        should be a record ID.  The returned cursor is a string which can be
+        passed back to us by the client, and decoded using decode_cursor().
+    """
+    position = datetime_to_timestamp(timestamp) + "|" + str(id)
+    return base64.urlsafe_b64encode(position.encode("utf-8")).decode("ascii")
+
+#############################################################################
+
+def decode_cursor(cursor):
+    """ Decode a cursor created by encode_cursor().
+
+        We return the (timestamp, id) position encoded in the cursor.  If the
+        cursor is invalid, we raise a ValueError.
+    """
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode("ascii"))
+        timestamp,id = position.decode("utf-8").split("|")
+    except (UnicodeError, TypeError, binascii.Error):
+        raise ValueError("Invalid cursor")
+
+    timestamp = timestamp_to_datetime(timestamp)
+    if timestamp == None:
+        raise ValueError("Invalid cursor")
+
+    return (timestamp, int(id))
+
+#############################################################################
+
+def status_update_to_json(global_id, status_type, timestamp, tz_offset,
+                          contents):
+    """ Return the JSON representation of a status update.
+
+        'global_id' and 'status_type' are the status update's issuer and type,
+        as strings, 'timestamp' is the status update's timestamp in UTC,
+        'tz_offset' is the original timezone offset in minutes, and 'contents'
+        is the status update's contents.
+
+        We return a string containing the status update as a JSON object, in
+        the form returned by the API.  This is stored with each status update
+        and its views, so the JSON can be included in responses as-is.
+    """
+    date_time = utc_and_timezone_to_datetime(timestamp, tz_offset)
+    return json.dumps({'global_id' : global_id,
+                       'type'      : status_type,
+                       'timestamp' : datetime_to_timestamp(date_time),
+                       'contents'  : contents})
+
+#############################################################################
+
+def json_fragments_response(list_name, fragments, **values):
+    """ Return a JSON response containing a list of pre-serialized objects.
+
+        'list_name' is the name of the list in the response, and 'fragments'
+        is a list of strings holding the JSON representation of each item in
+        the list.  Any other keyword arguments are added to the response as
+        normal JSON-encoded values.
+
+        We return an HttpResponse whose body is a JSON object built by joining
+        the fragments together, without decoding or re-encoding them.
+    """
+    parts = [json.dumps(list_name) + ": [" + ", ".join(fragments) + "]"]
+    for name,value in sorted(values.items()):
+        parts.append(json.dumps(name) + ": " + json.dumps(value))
+
+    return HttpResponse("{" + ", ".join(parts) + "}",
+                        content_type="application/json")
+
+#############################################################################
+
+def _body_decompressor(content_encoding):
+    """ Return a function which decompresses a request body.
+
+        'content_encoding' is the value of the request's "Content-Encoding"
+        header.  If the body isn't compressed, we return None.  Otherwise, we
+        return a function which should be called with each chunk of the
+        compressed body in turn, and then with None once the whole body has
+        been read.  The function returns a list of decompressed chunks, and
+        raises a RequestBodyTooLarge exception if the decompressed body
+        becomes larger than settings.MAX_DECOMPRESSED_BODY_SIZE.
+
+        Note that each chunk is decompressed in pieces, so that a highly
+        compressed body is rejected without ever holding more than the
+        maximum decompressed size in memory.
+    """
+    content_encoding = content_encoding.strip().lower()
+    if content_encoding in ["", "identity"]:
+        return None
+    elif content_encoding in ["gzip", "x-gzip"]:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif content_encoding == "deflate":
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+    else:
+        raise UnsupportedContentEncoding()
+
+    max_size = settings.MAX_DECOMPRESSED_BODY_SIZE
+    state    = {'size' : 0}
+
+    def decompress(chunk):
+        try:
+            output = []
+            if chunk == None:
+                output.append(decompressor.flush())
+                if not decompressor.eof or decompressor.unused_data:
+                    raise InvalidRequestBody()
+            while chunk:
+                if max_size == None:
+                    limit = 0 # Unlimited.
+                else:
+                    limit = max_size - state['size'] + 1
+                output.append(decompressor.decompress(chunk, limit))
+                chunk = decompressor.unconsumed_tail
+                state['size'] = state['size'] + len(output[-1])
+                if max_size != None and state['size'] > max_size:
+                    raise RequestBodyTooLarge()
+        except zlib.error:
+            raise InvalidRequestBody()
+
+        return output
 
+    return decompress
@@ -0,0 +1,139 @@
+""" statusAPI.shared.management.commands.benchmark_compression
+
+    This management command benchmarks the cost of accepting compressed
+    request bodies.  It builds a synthetic batch of locations, in both of the
+    formats accepted by the "/location" endpoint, and for each supported
+    "Content-Encoding" it reports the number of bytes sent, and the time taken
+    to read (and decompress) the body and then parse the locations.  For
+    example:
+
+        python manage.py benchmark_compression --points=500 --repeat=100
+
+    No database access is required, so this can be run anywhere.
+"""
+import datetime
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from statusAPI.api.views  import location
+from statusAPI.shared.lib import utils
+
+#############################################################################
+
+class Command(BaseCommand):
+    """ Our "benchmark_compression" management command.
+    """
+    help = "Compare the bytes saved by compression against its parse cost."
+
+    def add_arguments(self, parser):
+        """ Add our command-line arguments to the given parser.
+        """
+        parser.add_argument("--points", type=int, default=500,
+                            help="The number of locations in each batch.")
+        parser.add_argument("--repeat", type=int, default=100,
+                            help="The number of times to parse each batch.")
+
+
+    def handle(self, *args, **options):
+        """ Run our management command.
+        """
+        bodies = make_bodies(options['points'])
+
+        self.stdout.write("{:<8} {:<8} {:>10} {:>8} {:>10} {:>10}".format(
+                                "format", "encoding", "bytes", "saved",
+                                "read ms", "parse ms"))
+
+        for format,(content_type,body) in sorted(bodies.items()):
+            for content_encoding in ["identity", "deflate", "gzip"]:
+                if content_encoding == "identity":
+                    sent = body.encode("utf-8")
+                else:
+                    sent = utils.compress_body(body, content_encoding)
+
+                read_time,parse_time = time_request(content_type,
+                                                    content_encoding, sent,
+                                                    options['repeat'])
+
+                saved = 1 - len(sent) / len(body.encode("utf-8"))
+
+                self.stdout.write(
+                    "{:<8} {:<8} {:>10} {:>7.1f}% {:>10.3f} {:>10.3f}".format(
+                        format, content_encoding, len(sent), saved * 100,
+                        read_time * 1000, parse_time * 1000))
+
+#############################################################################
+
+def make_bodies(num_points):
+    """ Return the bodies to use for a synthetic batch of locations.
+
+        We return a dictionary mapping each format name to a (content_type,
+        body) tuple.  The locations follow a random walk, one every five
+        seconds, as a mobile device would record them.
+    """
+    start     = datetime.datetime(2016, 8, 1, 10, 0, 0,
+                                  tzinfo=datetime.timezone.utc)
+    latitude  = -33.8688
+    longitude = 151.2093
+
+    points = []
+    for i in range(num_points):
+        latitude  = latitude  + random.uniform(-0.0001, 0.0001)
+        longitude = longitude + random.uniform(-0.0001, 0.0001)
+        points.append((start + datetime.timedelta(seconds=5 * i),
+                       round(latitude, 7), round(longitude, 7)))
+
+    locations = []
+    for timestamp,latitude,longitude in points:
+        locations.append({'timestamp' : utils.datetime_to_timestamp(
+                                                                timestamp),
+                          'latitude'  : latitude,
+                          'longitude' : longitude})
+
+    columns = {'base_timestamp' : utils.datetime_to_timestamp(start),
+               'time_deltas'    : [0] + [5000] * (num_points - 1),
+               'latitudes_e7'   : [int(round(lat * 10000000))
+                                   for timestamp,lat,long in points],
+               'longitudes_e7'  : [int(round(long * 10000000))
+                                   for timestamp,lat,long in points]}
+
+    return {'json'     : ("application/json",
+                          json.dumps({'session_id' : "x",
+                                      'locations'  : locations})),
+            'columnar' : (location.COLUMNAR_CONTENT_TYPE,
+                          json.dumps(dict(columns, session_id="x")))}
+
+#############################################################################
+
+def time_request(content_type, content_encoding, body, repeat):
+    """ Time the reading and parsing of a request body.
+
+        We return a (read_time, parse_time) tuple, where 'read_time' is the
+        average number of seconds taken to read, digest and decompress the
+        body, and 'parse_time' is the average number of seconds taken to
+        decode the JSON and extract the locations.
+    """
+    factory    = RequestFactory()
+    read_time  = 0
+    parse_time = 0
+
+    for i in range(repeat):
+        request = factory.post("/location", body, content_type=content_type,
+                               HTTP_CONTENT_ENCODING=content_encoding)
+
+        start = time.perf_counter()
+        utils.read_request_body(request)
+        read_time = read_time + time.perf_counter() - start
+
+        start = time.perf_counter()
+        request_data = json.loads(request.body.decode("utf-8"))
+        if content_type == location.COLUMNAR_CONTENT_TYPE:
+            location._parse_columns(request_data)
+        else:
+            location._parse_locations(request_data)
+        parse_time = parse_time + time.perf_counter() - start
+
+    return (read_time / repeat, parse_time / repeat)
@@ -0,0 +1,74 @@
+""" statusAPI.shared.management.commands.cluster_status_updates
+
+    This management command physically reorders the StatusUpdate table so
+    that each global ID's status updates of a given type are stored together,
+    in timestamp order.  This means that retrieving a page of history only
+    needs to read a few database pages, rather than one page per status
+    update.
+
+    This is only supported for PostgreSQL, using its CLUSTER command.  Note
+    that CLUSTER takes an exclusive lock on the table while it runs, and
+    PostgreSQL doesn't keep the table clustered as new status updates are
+    added, so this command should be run periodically during a maintenance
+    window:
+
+        python manage.py cluster_status_updates
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from statusAPI.shared.models import *
+
+#############################################################################
+
+class Command(BaseCommand):
+    """ Our "cluster_status_updates" management command.
+    """
+    help = "Physically order the StatusUpdate table by its history index."
+
+    def handle(self, *args, **options):
+        """ Run our management command.
+        """
+        if connection.vendor != "postgresql":
+            raise CommandError("Clustering is only supported for PostgreSQL.")
+
+        table = StatusUpdate._meta.db_table
+        index = find_history_index()
+        if index == None:
+            raise CommandError("The history index doesn't exist.  Have you " +
+                               "run the database migrations?")
+
+        qn = connection.ops.quote_name
+
+        start = time.time()
+        with connection.cursor() as cursor:
+            cursor.execute("CLUSTER " + qn(table) + " USING " + qn(index))
+            cursor.execute("ANALYZE " + qn(table))
+        elapsed = time.time() - start
+
+        self.stdout.write("Clustered {} on {} in {:.2f} seconds."
+                          .format(table, index, elapsed))
+
+#############################################################################
+
+def find_history_index():
+    """ Return the name of the index used for StatusUpdate history queries.
+
+        This is the index on the (global_id, type, timestamp, id) fields.  If
+        the index doesn't exist, we return None.
+    """
+    meta    = StatusUpdate._meta
+    columns = [meta.get_field(name).column
+               for name in ["global_id", "type", "timestamp", "id"]]
+
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor,
+                                                               meta.db_table)
+
+    for name,constraint in constraints.items():
+        if constraint['index'] and constraint['columns'] == columns:
+            return name
+
+    return None
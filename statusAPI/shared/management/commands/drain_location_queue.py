@@ -0,0 +1,104 @@
+""" statusAPI.shared.management.commands.drain_location_queue
+
+    This management command writes out the batches of locations waiting in
+    the location queue (see the statusAPI.shared.lib.locationQueue module).
+
+    By default, the queue is drained once and the command then exits.  To
+    keep draining the queue as new batches arrive, use the --interval option
+    to set the number of seconds to wait whenever the queue is empty, and
+    the --workers option to drain the queue using several threads at once
+    (PostgreSQL only):
+
+        python manage.py drain_location_queue --interval=1 --workers=4
+
+    The queue's depth and lag are written out after each pass through the
+    queue.  To write out these statistics without draining the queue, use:
+
+        python manage.py drain_location_queue --stats
+"""
+import threading
+import time
+
+from django      import db
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from statusAPI.shared.lib import locationQueue
+
+#############################################################################
+
+class Command(BaseCommand):
+    """ Our "drain_location_queue" management command.
+    """
+    help = "Write out the batches of locations waiting in the location queue."
+
+    def add_arguments(self, parser):
+        """ Add our command-line arguments to the given parser.
+        """
+        parser.add_argument("--batch-size", type=int,
+                            default=settings.LOCATION_QUEUE_BATCH_SIZE,
+                            help="Maximum number of queued batches to write " +
+                                 "in each transaction.")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Number of threads to drain the queue with.")
+        parser.add_argument("--interval", type=float, default=None,
+                            help="If given, keep running and check the " +
+                                 "queue every this many seconds.")
+        parser.add_argument("--stats", action="store_true", default=False,
+                            help="Show the queue statistics and exit.")
+
+
+    def handle(self, *args, **options):
+        """ Run our management command.
+        """
+        if options['stats']:
+            self.write_stats()
+            return
+
+        workers = []
+        for i in range(options['workers']):
+            worker = threading.Thread(target=self.drain,
+                                      args=(options['batch_size'],
+                                            options['interval']),
+                                      daemon=True)
+            worker.start()
+            workers.append(worker)
+
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(1) # Allow for KeyboardInterrupt.
+
+
+    def drain(self, batch_size, interval):
+        """ Drain the queue.  This is run by each of our worker threads.
+        """
+        try:
+            while True:
+                start       = time.time()
+                num_written = 0
+                while True:
+                    num_entries = locationQueue.drain(batch_size)
+                    num_written = num_written + num_entries
+                    if num_entries < batch_size:
+                        break
+                elapsed = time.time() - start
+
+                if num_written > 0:
+                    self.stdout.write("Wrote {} queued batches in {:.2f} "
+                                      "seconds.".format(num_written, elapsed))
+                    self.write_stats()
+
+                if interval == None:
+                    break
+                else:
+                    time.sleep(interval)
+        finally:
+            db.connection.close()
+
+
+    def write_stats(self):
+        """ Write out the current queue statistics.
+        """
+        stats = locationQueue.stats()
+        self.stdout.write("Location queue depth: {}, lag: {:.2f} seconds."
+                          .format(stats['depth'], stats['lag']))
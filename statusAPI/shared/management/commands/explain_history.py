@@ -0,0 +1,134 @@
+""" statusAPI.shared.management.commands.explain_history
+
+    This management command benchmarks the database query used to retrieve a
+    page of a global ID's status update history.  It shows the query plan
+    chosen by the database, and then times the retrieval of the given number
+    of pages, following the 'more' cursor from one page to the next just like
+    the "<global_id>/history" endpoint does.  For example:
+
+        python manage.py explain_history 9tfn3x location/latlong --pages=100
+
+    Run this before and after applying the history index migration (and the
+    "cluster_status_updates" command) to measure the effect on a real
+    database.
+"""
+import argparse
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from statusAPI.shared.models import *
+from statusAPI.api.views import history
+
+#############################################################################
+
+class Command(BaseCommand):
+    """ Our "explain_history" management command.
+    """
+    help = "Show the query plan and timings for a global ID's history."
+
+    def add_arguments(self, parser):
+        """ Add our command-line arguments to the given parser.
+        """
+        parser.add_argument("global_id",
+                            help="The global ID whose history to retrieve.")
+        parser.add_argument("type",
+                            help="The type of status update to retrieve.")
+        parser.add_argument("--pages", type=positive_int, default=10,
+                            help="The number of pages of history to retrieve.")
+
+
+    def handle(self, *args, **options):
+        """ Run our management command.
+        """
+        try:
+            status_type = StatusUpdateType.objects.get(type=options['type'])
+        except StatusUpdateType.DoesNotExist:
+            raise CommandError("Unknown status update type.")
+
+        # Show the query plan for the first page, and for a page part-way
+        # through the history.
+
+        first_page = history_query(options['global_id'], status_type)
+        self.stdout.write("Query plan for the first page:")
+        self.stdout.write(explain(first_page))
+
+        rows = list(first_page)
+        if len(rows) > 0:
+            last_row = rows[-1]
+            later_page = history_query(options['global_id'], status_type,
+                                       last_row[0], last_row[1])
+            self.stdout.write("")
+            self.stdout.write("Query plan for a later page:")
+            self.stdout.write(explain(later_page))
+
+        # Time the retrieval of the desired number of pages.
+
+        timestamp = None
+        id        = None
+        timings   = []
+        for page in range(options['pages']):
+            start = time.time()
+            rows  = list(history_query(options['global_id'], status_type,
+                                       timestamp, id))
+            timings.append(time.time() - start)
+
+            if len(rows) <= history.MAX_PAGE_SIZE:
+                break
+            timestamp,id = rows[history.MAX_PAGE_SIZE-1][:2]
+
+        self.stdout.write("")
+        self.stdout.write("Retrieved {} pages: ".format(len(timings)) +
+                          "first {:.2f} ms, ".format(timings[0] * 1000) +
+                          "last {:.2f} ms, ".format(timings[-1] * 1000) +
+                          "average {:.2f} ms."
+                          .format(sum(timings) / len(timings) * 1000))
+
+#############################################################################
+
+def positive_int(value):
+    """ Parse a command-line argument which must be a positive integer.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+
+    if number == None or number < 1:
+        raise argparse.ArgumentTypeError(
+                            "{!r} is not a positive integer.".format(value))
+
+    return number
+
+#############################################################################
+
+def history_query(global_id, status_type, timestamp=None, id=None):
+    """ Return the query used to retrieve a page of history.
+
+        This is the same query made by the "<global_id>/history" endpoint.  If
+        'timestamp' and 'id' are given, the page starts after the status
+        update with that timestamp and record ID.  The query returns
+        (timestamp, id, ...) tuples.
+    """
+    return history._history_query(global_id, status_type.id, None, None,
+                                  timestamp, id)
+
+#############################################################################
+
+def explain(query):
+    """ Return the database's query plan for the given query, as a string.
+    """
+    sql,params = query.query.sql_with_params()
+
+    if connection.vendor == "postgresql":
+        sql = "EXPLAIN (ANALYZE, BUFFERS) " + sql
+    elif connection.vendor == "sqlite":
+        sql = "EXPLAIN QUERY PLAN " + sql
+    else:
+        sql = "EXPLAIN " + sql
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return "\n".join([" ".join([str(column) for column in row])
+                          for row in cursor.fetchall()])
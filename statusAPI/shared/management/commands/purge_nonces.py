@@ -0,0 +1,60 @@
+""" statusAPI.shared.management.commands.purge_nonces
+
+    This management command deletes the old nonce values from the configured
+    nonce store.
+
+    Old nonce values are no longer deleted as part of handling an API request.
+    Instead, this command should be run periodically (for example, from cron),
+    or left running in the background using the --interval option:
+
+        python manage.py purge_nonces --interval=60
+
+    The nonce values are deleted in chunks, with a short pause between each
+    chunk, so that purging a large backlog of nonces doesn't lock up the
+    database for the API requests being processed at the same time.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from statusAPI.shared.lib import nonceStore
+
+#############################################################################
+
+class Command(BaseCommand):
+    """ Our "purge_nonces" management command.
+    """
+    help = "Delete old nonce values from the nonce store."
+
+    def add_arguments(self, parser):
+        """ Add our command-line arguments to the given parser.
+        """
+        parser.add_argument("--chunk-size", type=int,
+                            default=settings.NONCE_PURGE_CHUNK_SIZE,
+                            help="Maximum number of nonces to delete at once.")
+        parser.add_argument("--pause", type=float,
+                            default=settings.NONCE_PURGE_PAUSE,
+                            help="Number of seconds to wait between chunks.")
+        parser.add_argument("--interval", type=float, default=None,
+                            help="If given, keep running and purge the " +
+                                 "nonces every this many seconds.")
+
+
+    def handle(self, *args, **options):
+        """ Run our management command.
+        """
+        store = nonceStore.get_nonce_store()
+
+        while True:
+            start       = time.time()
+            num_deleted = store.purge(options['chunk_size'], options['pause'])
+            elapsed     = time.time() - start
+
+            self.stdout.write("Purged {} nonce values in {:.2f} seconds."
+                              .format(num_deleted, elapsed))
+
+            if options['interval'] == None:
+                break
+            else:
+                time.sleep(options['interval'])
@@ -0,0 +1,52 @@
+""" statusAPI.shared.management.commands.run_stream_gateway
+
+    This management command runs the gateway which streams status updates to
+    clients using Server-Sent Events.  For example:
+
+        python manage.py run_stream_gateway --host=0.0.0.0 --port=8001
+
+    The gateway should be run alongside the main API server, with requests for
+    "/<global_id>/status/stream" routed to it.  See the
+    statusAPI.shared.lib.streamGateway module for more information.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from statusAPI.shared.lib import streamGateway
+
+#############################################################################
+
+class Command(BaseCommand):
+    """ Our "run_stream_gateway" management command.
+    """
+    help = "Run the gateway which streams status updates to clients."
+
+    def add_arguments(self, parser):
+        """ Add our command-line arguments to the given parser.
+        """
+        parser.add_argument("--host", default="127.0.0.1",
+                            help="The host name or IP address to listen on.")
+        parser.add_argument("--port", type=int, default=8001,
+                            help="The port number to listen on.")
+        parser.add_argument("--keepalive", type=float,
+                            default=settings.STREAM_KEEPALIVE,
+                            help="Number of seconds between keep-alive " +
+                                 "comments sent to idle clients.")
+        parser.add_argument("--threads", type=int,
+                            default=settings.STREAM_DB_THREADS,
+                            help="Number of threads to use for database " +
+                                 "access.")
+
+
+    def handle(self, *args, **options):
+        """ Run our management command.
+        """
+        gateway = streamGateway.StreamGateway(options['host'],
+                                              options['port'],
+                                              options['keepalive'],
+                                              options['threads'])
+
+        self.stdout.write("Streaming status updates on {}:{}."
+                          .format(options['host'], options['port']))
+
+        gateway.serve_forever()
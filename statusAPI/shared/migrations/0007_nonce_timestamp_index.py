@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0006_locationsession'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='noncevalue',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+""" 0008_unique_current_status_update_view
+
+    This migration adds a unique constraint on the issuer, recipient and type
+    of each CurrentStatusUpdateView record.  Any duplicate records are removed
+    first, keeping the most recently-created record in each case.
+"""
+from django.db import models, migrations
+
+#############################################################################
+
+def remove_duplicate_views(apps, schema_editor):
+    """ Remove any duplicate CurrentStatusUpdateView records.
+    """
+    CurrentStatusUpdateView = apps.get_model("shared",
+                                             "CurrentStatusUpdateView")
+
+    duplicates = (CurrentStatusUpdateView.objects
+                        .values("issuing_global_id", "recipient_global_id",
+                                "type")
+                        .annotate(max_id=models.Max("id"),
+                                  num_views=models.Count("id"))
+                        .filter(num_views__gt=1))
+
+    for duplicate in duplicates:
+        CurrentStatusUpdateView.objects.filter(
+                issuing_global_id=duplicate['issuing_global_id'],
+                recipient_global_id=duplicate['recipient_global_id'],
+                type=duplicate['type'],
+                id__lt=duplicate['max_id']).delete()
+
+#############################################################################
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0007_nonce_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_views,
+                             reverse_code=migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='currentstatusupdateview',
+            unique_together=set([('issuing_global_id', 'recipient_global_id', 'type')]),
+        ),
+    ]
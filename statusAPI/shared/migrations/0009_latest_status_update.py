@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0008_unique_current_status_update_view'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestStatusUpdate',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('timestamp', models.DateTimeField()),
+                ('tz_offset', models.IntegerField()),
+                ('contents', models.TextField()),
+                ('fanned_out', models.BooleanField(default=True)),
+                ('global_id', models.ForeignKey(related_name='+', to='shared.GlobalID')),
+                ('status_update', models.ForeignKey(to='shared.StatusUpdate')),
+                ('type', models.ForeignKey(to='shared.StatusUpdateType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='lateststatusupdate',
+            unique_together=set([('global_id', 'type')]),
+        ),
+    ]
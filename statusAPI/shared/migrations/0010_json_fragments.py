@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0009_latest_status_update'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currentstatusupdateview',
+            name='json_fragment',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='lateststatusupdate',
+            name='json_fragment',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='statusupdate',
+            name='json_fragment',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0010_json_fragments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusVersion',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField()),
+                ('global_id', models.OneToOneField(related_name='+', to='shared.GlobalID')),
+            ],
+        ),
+    ]
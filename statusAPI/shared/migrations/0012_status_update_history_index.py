@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0011_status_version'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='statusupdate',
+            index_together=set([('global_id', 'type', 'timestamp', 'id')]),
+        ),
+    ]
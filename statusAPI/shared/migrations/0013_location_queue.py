@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0012_status_update_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationQueueEntry',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('received_at', models.DateTimeField()),
+                ('points', models.TextField()),
+                ('global_id', models.ForeignKey(related_name='+', to='shared.GlobalID')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def remove_duplicate_sessions(apps, schema_editor):
+    """ Keep only the oldest location session for each global ID.
+    """
+    LocationSession = apps.get_model("shared", "LocationSession")
+
+    seen = set()
+    for id,global_id_id in LocationSession.objects.order_by("id") \
+                                          .values_list("id", "global_id"):
+        if global_id_id in seen:
+            LocationSession.objects.filter(id=id).delete()
+        else:
+            seen.add(global_id_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0013_location_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_sessions,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='locationsession',
+            name='global_id',
+            field=models.OneToOneField(related_name='+', to='shared.GlobalID'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0015_message_recipient_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currentstatusupdateview',
+            name='sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='currentstatusupdateview',
+            index_together=set([('recipient_global_id', 'sequence')]),
+        ),
+    ]
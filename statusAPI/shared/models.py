@@ -2,10 +2,11 @@
 
     This module defines the various database models for the statusAPI system.
 """
-import datetime
+import sqlite3
+import time
+import uuid
 
-from django.db import models
-from django.conf import settings
+from django.db import connection, models
 import django.utils.timezone
 
 #############################################################################
@@ -59,13 +60,30 @@ class StatusUpdate(models.Model):
         minutes) in the 'tz_offset' field so we can recreate the original
         timestamp, including the submitted timezone offset, whenever we need to
         get the original (unconverted) timestamp.
+
+        JSON FRAGMENTS
+        --------------
+
+        The 'json_fragment' field holds the status update as it is returned by
+        the API, already serialized as a JSON object.  This is written once,
+        when the status update is posted, and is copied into the status
+        update's CurrentStatusUpdateView and LatestStatusUpdate records, so
+        that responses can be built by joining the fragments together.  Status
+        updates saved before this field was added have an empty fragment, and
+        are serialized when they are read.
     """
-    id        = models.AutoField(primary_key=True)
-    global_id = models.ForeignKey(GlobalID)
-    type      = models.ForeignKey(StatusUpdateType)
-    timestamp = models.DateTimeField(db_index=True)
-    tz_offset = models.IntegerField()
-    contents  = models.TextField()
+    id            = models.AutoField(primary_key=True)
+    global_id     = models.ForeignKey(GlobalID)
+    type          = models.ForeignKey(StatusUpdateType)
+    timestamp     = models.DateTimeField(db_index=True)
+    tz_offset     = models.IntegerField()
+    contents      = models.TextField()
+    json_fragment = models.TextField(blank=True, default="")
+
+    class Meta:
+        # Used to retrieve a global ID's history for a given type of status
+        # update, newest first, by scanning this index backwards.
+        index_together = (("global_id", "type", "timestamp", "id"),)
 
 #############################################################################
 
@@ -94,13 +112,24 @@ class Permission(models.Model):
             our record, allowing for wildcards.  If the given status type is
             covered by this Permission record, we return True.
         """
-        if self.status_type == "*":
+        return Permission.pattern_matches(self.status_type, status_type)
+
+
+    @staticmethod
+    def pattern_matches(pattern, status_type):
+        """ Return True if the given status type pattern matches a status type.
+
+            'pattern' is the value of a Permission's 'status_type' field, which
+            may include wildcards.  If the given status type is covered by this
+            pattern, we return True.
+        """
+        if pattern == "*":
             return True
-        elif self.status_type.endswith("*"):
-            if status_type.startswith(self.status_type[:-1]):
+        elif pattern.endswith("*"):
+            if status_type.startswith(pattern[:-1]):
                 return True
         else:
-            if status_type == self.status_type:
+            if status_type == pattern:
                 return True
         return False # no match.
 
@@ -111,7 +140,15 @@ class CurrentStatusUpdateView(models.Model):
 
         Whenever a status update gets posted, the poster's permissions are used
         to create a CurrentStatusUpdateView record for each global ID that is
-        allowed to view that record.
+        allowed to view that record.  There is at most one record for each
+        combination of issuer, recipient and status update type; posting a new
+        status update replaces the existing record.
+
+        The 'sequence' field is set to the recipient's StatusVersion when the
+        record is written.  As the recipient's StatusVersion record stays
+        locked until the fan-out's transaction is committed, the sequence
+        numbers for each recipient increase in the order the views were
+        committed, unlike the StatusUpdate record IDs.
     """
     id                  = models.AutoField(primary_key=True)
     issuing_global_id   = models.ForeignKey(GlobalID, related_name="+")
@@ -121,6 +158,53 @@ class CurrentStatusUpdateView(models.Model):
     timestamp           = models.DateTimeField()
     tz_offset           = models.IntegerField()
     contents            = models.TextField()
+    json_fragment       = models.TextField(blank=True, default="")
+    sequence            = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = (("issuing_global_id", "recipient_global_id", "type"),)
+        index_together  = (("recipient_global_id", "sequence"),)
+
+#############################################################################
+
+class LatestStatusUpdate(models.Model):
+    """ The latest status update of a given type posted by a global ID.
+
+        There is one record for each combination of issuer and status update
+        type, which is replaced whenever a new status update is posted.  For
+        issuers with very large audiences, we don't create a
+        CurrentStatusUpdateView record for each recipient; instead, the
+        'fanned_out' field is set to False, and the recipients' permissions
+        are checked against this table whenever the current status updates
+        are read.
+    """
+    id            = models.AutoField(primary_key=True)
+    global_id     = models.ForeignKey(GlobalID, related_name="+")
+    type          = models.ForeignKey(StatusUpdateType)
+    status_update = models.ForeignKey(StatusUpdate)
+    timestamp     = models.DateTimeField()
+    tz_offset     = models.IntegerField()
+    contents      = models.TextField()
+    json_fragment = models.TextField(blank=True, default="")
+    fanned_out    = models.BooleanField(default=True)
+
+    class Meta:
+        unique_together = (("global_id", "type"),)
+
+#############################################################################
+
+class StatusVersion(models.Model):
+    """ The version of the current status updates visible to a global ID.
+
+        The 'version' field is incremented whenever a status update is written
+        to the global ID's current status updates, the global ID issues a
+        status update, or a permission change alters which status updates the
+        global ID can see, so that each new version is distinct from the ones
+        before it.
+    """
+    id        = models.AutoField(primary_key=True)
+    global_id = models.OneToOneField(GlobalID, related_name="+")
+    version   = models.BigIntegerField()
 
 #############################################################################
 
@@ -135,30 +219,145 @@ class Message(models.Model):
     recipient = models.ForeignKey(GlobalID, related_name="+")
     message   = models.TextField()
 
+    class Meta:
+        # Used to retrieve a recipient's messages, oldest first.
+        index_together = (("recipient", "timestamp"),)
+
+#############################################################################
+
+class LocationSessionManager(models.Manager):
+    """ A custom manager for the LocationSession database table.
+    """
+    def get_or_create_session_id(self, global_id_rec):
+        """ Return the session ID for a global ID's location session.
+
+            'global_id_rec' is the GlobalID record for the desired global ID.
+            If the global ID doesn't already have a location session, a new
+            one is created.  Where the database supports it, this is done
+            using a single "INSERT ... ON CONFLICT ... RETURNING" statement,
+            which relies on the unique constraint on the session's global ID.
+        """
+        session_id = uuid.uuid4().hex
+
+        if self._supports_insert_returning():
+            qn    = connection.ops.quote_name
+            table = qn(self.model._meta.db_table)
+
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO " + table +
+                               " (global_id_id, session_id) VALUES (%s, %s)" +
+                               " ON CONFLICT (global_id_id) DO UPDATE SET" +
+                               " session_id = " + table + ".session_id" +
+                               " RETURNING session_id",
+                               [global_id_rec.id, session_id])
+                return cursor.fetchone()[0]
+        else:
+            session,created = self.get_or_create(
+                                        global_id=global_id_rec,
+                                        defaults={'session_id' : session_id})
+            return session.session_id
+
+    # =====================
+    # == PRIVATE METHODS ==
+    # =====================
+
+    def _supports_insert_returning(self):
+        """ Return True if our database supports "ON CONFLICT ... RETURNING".
+        """
+        if connection.vendor == "postgresql":
+            return connection.pg_version >= 90500
+        elif connection.vendor == "sqlite":
+            return sqlite3.sqlite_version_info >= (3, 35, 0)
+        else:
+            return False
+
 #############################################################################
 
 class LocationSession(models.Model):
     """ An active location session.
+
+        Each global ID can have at most one location session at a time.
     """
     id         = models.AutoField(primary_key=True)
-    global_id  = models.ForeignKey(GlobalID, related_name="+")
+    global_id  = models.OneToOneField(GlobalID, related_name="+")
     session_id = models.TextField(db_index=True)
 
+    # Use our custom manager for the LocationSession class.
+
+    objects = LocationSessionManager()
+
+#############################################################################
+
+class LocationQueueEntry(models.Model):
+    """ A batch of uploaded locations waiting to be written to the database.
+
+        When the LOCATION_QUEUE setting is True, the "/location" endpoint
+        stores each batch of locations it receives as a LocationQueueEntry,
+        and the "drain_location_queue" management command later writes them
+        out as status updates.  The 'points' field holds a JSON-encoded list
+        of [timestamp, tz_offset, latitude, longitude] entries, one for each
+        location, where 'timestamp' is in UTC.
+    """
+    id          = models.AutoField(primary_key=True)
+    global_id   = models.ForeignKey(GlobalID, related_name="+")
+    received_at = models.DateTimeField()
+    points      = models.TextField()
+
 #############################################################################
 
 class NonceValueManager(models.Manager):
     """ A custom manager for the NonceValue database table.
     """
-    def purge(self):
-        """ Delete all NonceValues older than settings.KEEP_NONCE_VALUES_FOR.
+    def purge(self, chunk_size=None, pause=0):
+        """ Delete all NonceValues which are outside the nonce replay window.
+
+            The parameters are as follows:
+
+                'chunk_size'
+
+                    The maximum number of NonceValues to delete at once.  If
+                    this is None, all the old NonceValues are deleted in a
+                    single statement.
+
+                'pause'
+
+                    The number of seconds to wait between deleting each chunk
+                    of NonceValues, so that a large purge doesn't monopolise
+                    the database.
+
+            We return the number of NonceValues which were deleted.
         """
-        if settings.KEEP_NONCE_VALUES_FOR == None:
-            return # Keep Nonce values forever.
+        from statusAPI.shared.lib.nonceStore import nonce_window
+
+        max_age = nonce_window()
+        if max_age == None:
+            return 0 # Keep Nonce values forever.
 
-        max_age = datetime.timedelta(days=settings.KEEP_NONCE_VALUES_FOR)
-        cutoff  = django.utils.timezone.now() - max_age
+        cutoff = django.utils.timezone.now() - max_age
 
-        self.filter(timestamp__lte=cutoff).delete()
+        query = self.filter(timestamp__lte=cutoff)
+
+        if chunk_size == None:
+            num_deleted = query.count()
+            query.delete()
+            return num_deleted
+
+        num_deleted = 0
+        while True:
+            ids = list(query.order_by("timestamp")
+                            .values_list("id", flat=True)[:chunk_size])
+            if len(ids) == 0:
+                break
+
+            self.filter(id__in=ids).delete()
+            num_deleted = num_deleted + len(ids)
+
+            if len(ids) < chunk_size:
+                break
+            elif pause > 0:
+                time.sleep(pause)
+
+        return num_deleted
 
 #############################################################################
 
@@ -169,11 +368,13 @@ class NonceValue(models.Model):
         keep this database table to a reasonable size; the exact length of time
         we keep the Nonce values depends on a custom setting; the period needs
         to be long enough to ensure that HMAC-authenticated requests cannot be
-        resent.  A period of a year is probably a good value.
+        resent.  While version 1 HMAC-signed requests are accepted, a period of
+        a year is probably a good value; once all clients use version 2, the
+        nonces only need to be kept for a few minutes.
     """
     id        = models.AutoField(primary_key=True)
     nonce     = models.TextField(db_index=True, unique=True)
-    timestamp = models.DateTimeField()
+    timestamp = models.DateTimeField(db_index=True)
 
     # Use our custom manager for the NonceValue class.
 